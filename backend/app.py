@@ -1,13 +1,20 @@
 from flask import Flask
 from flask_cors import CORS
-from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS
-from database import db
+from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS, DB_AUTO_MIGRATE
+from database import db, is_sqlite_file_uri, sqlite_engine_options, apply_sqlite_pragmas
+from migrations import ensure_schema
+import tracing
+import profiling
 from routes.video import video_bp
 from routes.music import music_bp
 from routes.image import image_bp
 from routes.task_management import task_management_bp
 from routes.utility import utility_bp
 from routes.usage import usage_bp
+from routes.events import events_bp
+from routes.exports import exports_bp
+from routes.timeline import timeline_bp
+from routes.profiles import profiles_bp
 
 def create_app():
     app = Flask(__name__)
@@ -15,8 +22,13 @@ def create_app():
 
     app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = SQLALCHEMY_TRACK_MODIFICATIONS
+    sqlite_file = is_sqlite_file_uri(SQLALCHEMY_DATABASE_URI)
+    if sqlite_file:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options()
 
     db.init_app(app)
+    tracing.init_app(app) # No-op unless TRACING_EXPORTER is set
+    profiling.init_app(app) # Admin-only X-Profile header / profile flag
 
     app.register_blueprint(video_bp)
     app.register_blueprint(music_bp)
@@ -24,9 +36,15 @@ def create_app():
     app.register_blueprint(task_management_bp)
     app.register_blueprint(utility_bp)
     app.register_blueprint(usage_bp)
+    app.register_blueprint(events_bp)
+    app.register_blueprint(exports_bp)
+    app.register_blueprint(timeline_bp)
+    app.register_blueprint(profiles_bp)
 
     with app.app_context():
-        db.create_all()
+        if sqlite_file:
+            apply_sqlite_pragmas(db.engine) # Before the first connection is opened
+        ensure_schema(db.engine, DB_AUTO_MIGRATE) # One version query per worker when the schema is current
 
     return app
 
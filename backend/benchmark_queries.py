@@ -0,0 +1,198 @@
+"""
+Seeds a throwaway database with synthetic tasks and reports p50/p99 latency of the list, usage and
+status sweep queries without and with the indexes declared on the models.
+
+    python benchmark_queries.py                      # 1,000,000 video tasks in a temporary SQLite file
+    python benchmark_queries.py --rows 200000 --iterations 20
+    python benchmark_queries.py --database-uri postgresql://...   # must point at an empty scratch database
+
+The target database is dropped and recreated: never point it at a real deployment.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+BENCHMARK_ADMIN_EMAIL = "admin@benchmark.local"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark task list/usage queries before and after indexing.")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Synthetic video tasks to seed.")
+    parser.add_argument('--music-rows', type=int, default=100_000, help="Synthetic music tasks to seed.")
+    parser.add_argument('--users', type=int, default=500, help="Distinct users the tasks are spread over.")
+    parser.add_argument('--iterations', type=int, default=30, help="Requests per endpoint and phase.")
+    parser.add_argument('--database-uri', help="Scratch database (default: a temporary SQLite file).")
+    return parser.parse_args()
+
+
+args = parse_args()
+scratch_dir = None
+if not args.database_uri:
+    scratch_dir = tempfile.mkdtemp(prefix="dreamer_v_benchmark_")
+    args.database_uri = f"sqlite:///{os.path.join(scratch_dir, 'benchmark.db')}"
+# Configure before the app (and config) are imported
+os.environ["DATABASE_URI"] = args.database_uri
+os.environ["ADMIN_EMAIL"] = BENCHMARK_ADMIN_EMAIL
+
+from sqlalchemy import inspect
+
+from app import app
+from database import db
+from models import VideoGenerationTask, MusicGenerationTask
+from usage_rollup import backfill as backfill_usage_rollups
+
+MODELS = ["veo-3.0-generate-001", "veo-3.0-fast-generate-001", "veo-2.0-generate-001"]
+DURATIONS = [4, 5, 6, 8]
+STATUSES = ["completed"] * 90 + ["failed"] * 8 + ["processing", "pending"]
+BATCH_SIZE = 10_000
+
+
+def seed(engine, rows, music_rows, users):
+    user_emails = [f"user{i}@example.com" for i in range(users)]
+    weights = [1.0 / (i + 1) for i in range(users)] # A few heavy users, a long tail of light ones
+    now = time.time()
+    year = 365 * 24 * 3600
+    started_at = time.time()
+    with engine.begin() as connection:
+        for offset in range(0, rows, BATCH_SIZE):
+            batch = []
+            for user in random.choices(user_emails, weights=weights, k=min(BATCH_SIZE, rows - offset)):
+                created_at = now - random.random() * year
+                batch.append({
+                    "id": str(uuid.uuid4()),
+                    "prompt": "A synthetic benchmark prompt",
+                    "model": random.choice(MODELS),
+                    "duration_seconds": random.choice(DURATIONS),
+                    "status": random.choice(STATUSES),
+                    "user": user,
+                    "created_at": created_at,
+                    "updated_at": created_at + random.random() * 300,
+                })
+            connection.execute(VideoGenerationTask.__table__.insert(), batch)
+        for offset in range(0, music_rows, BATCH_SIZE):
+            batch = []
+            for _ in range(min(BATCH_SIZE, music_rows - offset)):
+                created_at = now - random.random() * year
+                batch.append({
+                    "id": str(uuid.uuid4()),
+                    "prompt": "A synthetic benchmark music prompt",
+                    "status": "completed",
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                })
+            connection.execute(MusicGenerationTask.__table__.insert(), batch)
+    print(f"Seeded {rows} video and {music_rows} music tasks in {time.time() - started_at:.1f}s.")
+    return user_emails[0], user_emails[users // 2]
+
+
+def set_indexes(engine, present):
+    """Creates (or drops) the indexes declared on the models, as migrate_db.py does on deploy."""
+    inspector = inspect(engine)
+    for model in (VideoGenerationTask, MusicGenerationTask):
+        existing = {index['name'] for index in inspector.get_indexes(model.__table__.name)}
+        for index in model.__table__.indexes:
+            if present and index.name not in existing:
+                started_at = time.time()
+                index.create(engine)
+                print(f"Created index '{index.name}' in {time.time() - started_at:.1f}s.")
+            elif not present and index.name in existing:
+                index.drop(engine)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(client, method_or_path, iterations, headers=None):
+    """Median and p99 latency in milliseconds of a GET path, or of a callable run in an app context."""
+    samples = []
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()): # Routes print per request
+            if callable(method_or_path):
+                method_or_path()
+            else:
+                response = client.get(method_or_path, headers=headers)
+                assert response.status_code == 200, f"{method_or_path}: HTTP {response.status_code}"
+                response.close()
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(samples), percentile(samples, 0.99)
+
+
+def run_phase(heavy_user, typical_user, iterations):
+    def as_user(email):
+        return {"X-Goog-Authenticated-User-Email": f"accounts.google.com:{email}"}
+
+    def status_sweep():
+        VideoGenerationTask.query.with_entities(VideoGenerationTask.id).filter(
+            VideoGenerationTask.status.in_(["pending", "processing"]),
+            VideoGenerationTask.updated_at < time.time() - 3600,
+        ).all()
+
+    client = app.test_client()
+    cases = [
+        ("GET /api/tasks (heavy user)", "/api/tasks?page=1", as_user(heavy_user)),
+        ("GET /api/tasks (typical user)", "/api/tasks?page=1", as_user(typical_user)),
+        ("GET /api/tasks (typical user, page 5)", "/api/tasks?page=5&per_page=20", as_user(typical_user)),
+        ("GET /api/tasks (admin)", "/api/tasks?page=1", as_user(BENCHMARK_ADMIN_EMAIL)),
+        ("GET /api/usage (typical user)", "/api/usage", as_user(typical_user)),
+        ("GET /api/usage (admin)", "/api/usage", as_user(BENCHMARK_ADMIN_EMAIL)),
+        ("GET /api/music-tasks", "/api/music-tasks", None),
+        ("status sweep (pending/processing)", status_sweep, None),
+    ]
+    results = {}
+    with app.app_context():
+        for name, target, headers in cases:
+            results[name] = measure(client, target, iterations, headers)
+            print(f"  {name:<40} p50 {results[name][0]:9.1f} ms   p99 {results[name][1]:9.1f} ms")
+    return results
+
+
+def main():
+    random.seed(42)
+    with app.app_context():
+        engine = db.engine
+        db.drop_all()
+        db.create_all()
+        set_indexes(engine, present=False)
+        heavy_user, typical_user = seed(engine, args.rows, args.music_rows, args.users)
+        backfill_usage_rollups(engine) # /api/usage reads the rollups
+        if engine.dialect.name == 'postgresql':
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.exec_driver_sql("ANALYZE")
+
+    print("\nWithout indexes:")
+    before = run_phase(heavy_user, typical_user, args.iterations)
+
+    with app.app_context():
+        engine = db.engine
+        set_indexes(engine, present=True)
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql("ANALYZE")
+
+    print("\nWith indexes:")
+    after = run_phase(heavy_user, typical_user, args.iterations)
+
+    print(f"\n{'query':<40} {'p50 before':>11} {'p50 after':>10} {'p99 before':>11} {'p99 after':>10} {'p50 speedup':>12}")
+    for name in before:
+        (p50_before, p99_before), (p50_after, p99_after) = before[name], after[name]
+        print(f"{name:<40} {p50_before:9.1f}ms {p50_after:8.1f}ms {p99_before:9.1f}ms {p99_after:8.1f}ms {p50_before / max(p50_after, 1e-3):11.1f}x")
+
+    if scratch_dir:
+        with app.app_context():
+            db.engine.dispose()
+        for filename in os.listdir(scratch_dir):
+            os.remove(os.path.join(scratch_dir, filename))
+        os.rmdir(scratch_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
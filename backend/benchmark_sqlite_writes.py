@@ -0,0 +1,163 @@
+"""
+Concurrency stress test for the SQLite engine setup: several processes (like gunicorn workers), each
+with background writer threads that walk tasks through their status/progress commits and request
+threads that read the history list, against a default engine and then against the tuned one from
+database.py (WAL, busy timeout, synchronous=NORMAL, immediate write transactions, pooled connections).
+
+    python benchmark_sqlite_writes.py
+    python benchmark_sqlite_writes.py --workers 3 --writers 8 --readers 4 --seconds 20
+
+Each phase uses its own throwaway database file.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.exc import OperationalError
+
+from database import apply_sqlite_pragmas, sqlite_engine_options
+from models import VideoGenerationTask
+
+COMMITS_PER_TASK = 6 # insert, processing, three progress updates, completed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure SQLite write throughput under concurrent workers.")
+    parser.add_argument('--workers', type=int, default=3, help="Processes, like gunicorn workers.")
+    parser.add_argument('--writers', type=int, default=6, help="Background writer threads per process.")
+    parser.add_argument('--readers', type=int, default=4, help="Reader (request handler) threads per process.")
+    parser.add_argument('--seconds', type=float, default=10.0, help="Duration of each phase.")
+    parser.add_argument('--seed-rows', type=int, default=20_000, help="Tasks in the database before the run.")
+    return parser.parse_args()
+
+
+def make_engine(uri, tuned):
+    if not tuned:
+        return create_engine(uri)
+    engine = create_engine(uri, **sqlite_engine_options())
+    apply_sqlite_pragmas(engine)
+    return engine
+
+
+def writer(engine, deadline, user, counters, lock):
+    table = VideoGenerationTask.__table__
+    commits = errors = 0
+    while time.time() < deadline:
+        task_id = str(uuid.uuid4())
+        steps = [
+            table.insert().values(id=task_id, prompt="stress", user=user, status="pending", created_at=time.time(), updated_at=time.time()),
+            update(table).where(table.c.id == task_id).values(status="processing", updated_at=time.time()),
+        ] + [
+            update(table).where(table.c.id == task_id).values(progress_percent=percent, updated_at=time.time())
+            for percent in (25.0, 50.0, 75.0)
+        ] + [
+            update(table).where(table.c.id == task_id).values(status="completed", updated_at=time.time()),
+        ]
+        for statement in steps:
+            try:
+                with engine.begin() as connection:
+                    connection.execute(statement)
+                    # Like a session flush followed by its hooks: read the row back before committing
+                    connection.execute(select(table.c.status, table.c.progress_percent).where(table.c.id == task_id)).first()
+                commits += 1
+            except OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                errors += 1
+            time.sleep(random.random() * 0.002) # Some work between commits
+    with lock:
+        counters["commits"] += commits
+        counters["lock_errors"] += errors
+
+
+def reader(engine, deadline, user, counters, lock):
+    table = VideoGenerationTask.__table__
+    reads = errors = 0
+    statement = select(table.c.id, table.c.status, table.c.updated_at).where(table.c.user == user).order_by(table.c.created_at.desc()).limit(20)
+    while time.time() < deadline:
+        try:
+            with engine.connect() as connection:
+                connection.execute(statement).all()
+            reads += 1
+        except OperationalError:
+            errors += 1
+        time.sleep(0.005) # Request handling around the query; a tight loop would only measure GIL contention
+    with lock:
+        counters["reads"] += reads
+        counters["read_errors"] += errors
+
+
+def run_worker(uri, tuned, args, start_at, results):
+    engine = make_engine(uri, tuned)
+    counters = {"commits": 0, "lock_errors": 0, "reads": 0, "read_errors": 0}
+    lock = threading.Lock()
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.time() + args.seconds
+    threads = [
+        threading.Thread(target=writer, args=(engine, deadline, f"user{i}@example.com", counters, lock))
+        for i in range(args.writers)
+    ] + [
+        threading.Thread(target=reader, args=(engine, deadline, f"user{i}@example.com", counters, lock))
+        for i in range(args.readers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    results.put(counters)
+
+
+def run_phase(name, tuned, args, scratch_dir):
+    uri = f"sqlite:///{os.path.join(scratch_dir, f'{name}.db')}"
+    engine = make_engine(uri, tuned)
+    VideoGenerationTask.metadata.create_all(engine, tables=[VideoGenerationTask.__table__])
+    now = time.time()
+    with engine.begin() as connection:
+        connection.execute(VideoGenerationTask.__table__.insert(), [
+            {"id": str(uuid.uuid4()), "prompt": "seed", "user": f"user{i % 50}@example.com", "status": "completed",
+             "created_at": now - i, "updated_at": now - i}
+            for i in range(args.seed_rows)
+        ])
+    engine.dispose()
+
+    results = multiprocessing.Queue()
+    start_at = time.time() + 1.0 # Let every process open its engine before the clock starts
+    processes = [multiprocessing.Process(target=run_worker, args=(uri, tuned, args, start_at, results)) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    totals = {"commits": 0, "lock_errors": 0, "reads": 0, "read_errors": 0}
+    for _ in processes:
+        for key, value in results.get().items():
+            totals[key] += value
+    for process in processes:
+        process.join()
+
+    print(f"{name:<8} commits/s {totals['commits'] / args.seconds:9.1f}   tasks/s {totals['commits'] / COMMITS_PER_TASK / args.seconds:7.1f}   "
+          f"'database is locked' {totals['lock_errors']:6d}   reads/s {totals['reads'] / args.seconds:9.1f}   read errors {totals['read_errors']}")
+    return totals
+
+
+def main():
+    args = parse_args()
+    scratch_dir = tempfile.mkdtemp(prefix="dreamer_v_sqlite_stress_")
+    try:
+        print(f"{args.workers} processes x ({args.writers} writer + {args.readers} reader threads), {args.seconds:.0f}s per phase\n")
+        default = run_phase("default", False, args, scratch_dir)
+        tuned = run_phase("tuned", True, args, scratch_dir)
+        speedup = tuned["commits"] / max(default["commits"], 1)
+        print(f"\nWrite throughput: {speedup:.1f}x, lock errors {default['lock_errors']} -> {tuned['lock_errors']}")
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import subprocess
+
+import numpy as np
+from moviepy.config import FFMPEG_BINARY
+
+from config import (
+    COMPOSITE_AUDIO_FADE_SECONDS,
+    COMPOSITE_MUSIC_CROSSFADE_SECONDS,
+    COMPOSITE_MUSIC_TARGET_LUFS,
+    COMPOSITE_CLIP_AUDIO_DUCK_DB,
+)
+
+# Every buffer handled here is float32, shape (samples, channels), at this rate/channel count.
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+# ITU-R BS.1770 K-weighting: high-shelf pre-filter followed by the RLB high-pass.
+_K_SHELF_GAIN_DB = 3.999843853973347
+_K_SHELF_FC = 1681.974450955533
+_K_SHELF_Q = 0.7071752369554196
+_K_HIGHPASS_FC = 38.13547087602444
+_K_HIGHPASS_Q = 0.5003270373238773
+
+_ABSOLUTE_GATE_LUFS = -70.0
+_RELATIVE_GATE_LU = -10.0
+_PEAK_CEILING = 10 ** (-1.0 / 20) # -1 dBFS
+
+
+def decode_audio(path, max_duration=None, input_format=None):
+    """
+    Decodes an audio file (or the audio of a video) once into a float32 (samples, channels) array.
+    `input_format="concat"` reads an ffmpeg concat list instead of a single file.
+    """
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-loglevel", "error"]
+    if input_format == "concat":
+        cmd += ["-f", "concat", "-safe", "0"]
+    if max_duration is not None:
+        cmd += ["-t", f"{max_duration:.3f}"]
+    cmd += ["-i", path, "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "pipe:1"]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not decode audio from {path}: {result.stderr.decode(errors='replace').strip()[-500:]}")
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, CHANNELS).copy()
+
+
+def fit_to_length(samples, num_samples):
+    """Trims or zero-pads a buffer to exactly `num_samples` frames."""
+    if len(samples) >= num_samples:
+        return samples[:num_samples]
+    padded = np.zeros((num_samples, samples.shape[1]), dtype=np.float32)
+    padded[:len(samples)] = samples
+    return padded
+
+
+def loop_with_crossfade(samples, num_samples, crossfade_samples):
+    """
+    Tiles `samples` to `num_samples` frames, overlapping consecutive repetitions by `crossfade_samples`
+    with equal-power fades so the loop seams are inaudible. Fully vectorized overlap-add.
+    """
+    length = len(samples)
+    if length == 0:
+        return np.zeros((num_samples, CHANNELS), dtype=np.float32)
+    if length >= num_samples:
+        return samples[:num_samples].copy()
+
+    crossfade = int(min(crossfade_samples, length // 4))
+    period = length - crossfade
+    copies = int(np.ceil(num_samples / period))
+
+    ramp = np.linspace(0.0, 1.0, crossfade, dtype=np.float32)[:, None] if crossfade else None
+    template = samples.copy()
+    if crossfade:
+        template[:crossfade] *= np.sin(ramp * np.pi / 2) # Fade in
+        template[-crossfade:] *= np.cos(ramp * np.pi / 2) # Fade out
+
+    # Overlap-add: copy i occupies [i*period, i*period + length). The first `period` frames of every
+    # copy land in row i of a (copies, period) view; the trailing crossfade lands at the start of row i+1.
+    out = np.zeros(((copies + 1) * period, samples.shape[1]), dtype=np.float32)
+    rows = out.reshape(copies + 1, period, samples.shape[1])
+    rows[:copies] += template[:period]
+    if crossfade:
+        rows[1:copies + 1, :crossfade] += template[period:]
+        out[:crossfade] = samples[:crossfade] # The very first copy starts without a fade-in
+    return out[:num_samples]
+
+
+def _biquad_response(b, a, omega):
+    z1 = np.exp(-1j * omega)
+    z2 = z1 * z1
+    return (b[0] + b[1] * z1 + b[2] * z2) / (a[0] + a[1] * z1 + a[2] * z2)
+
+
+def _k_weighting_power_response(num_fft, sample_rate):
+    """|H(f)|^2 of the K-weighting filter at the rfft bin frequencies (coefficients derived as in libebur128)."""
+    omega = 2 * np.pi * np.fft.rfftfreq(num_fft, d=1.0 / sample_rate) / sample_rate
+
+    k = np.tan(np.pi * _K_SHELF_FC / sample_rate)
+    vh = 10 ** (_K_SHELF_GAIN_DB / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / _K_SHELF_Q + k * k
+    shelf_b = ((vh + vb * k / _K_SHELF_Q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / _K_SHELF_Q + k * k) / a0)
+    shelf_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / _K_SHELF_Q + k * k) / a0)
+
+    k = np.tan(np.pi * _K_HIGHPASS_FC / sample_rate)
+    a0 = 1 + k / _K_HIGHPASS_Q + k * k
+    highpass_b = (1.0, -2.0, 1.0)
+    highpass_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / _K_HIGHPASS_Q + k * k) / a0)
+
+    response = _biquad_response(shelf_b, shelf_a, omega) * _biquad_response(highpass_b, highpass_a, omega)
+    return np.abs(response) ** 2
+
+
+def integrated_loudness(samples, sample_rate=SAMPLE_RATE):
+    """
+    EBU R128 / BS.1770 style integrated loudness in LUFS.
+
+    K-weighting is applied in the frequency domain: the filtered energy of every 100 ms sub-block is
+    obtained from its spectrum (Parseval), and 400 ms gating blocks with 75% overlap are sums of four
+    consecutive sub-blocks. Returns None for silence.
+    """
+    sub_block = int(0.1 * sample_rate)
+    num_sub_blocks = len(samples) // sub_block
+    if num_sub_blocks < 4:
+        return None
+
+    frames = samples[:num_sub_blocks * sub_block].reshape(num_sub_blocks, sub_block, samples.shape[1])
+    spectrum = np.fft.rfft(frames, axis=1)
+    weights = _k_weighting_power_response(sub_block, sample_rate)[None, :, None]
+    # One-sided spectrum: every bin except DC (and Nyquist for even sizes) stands for two bins
+    bin_factor = np.full(spectrum.shape[1], 2.0)
+    bin_factor[0] = 1.0
+    if sub_block % 2 == 0:
+        bin_factor[-1] = 1.0
+    sub_block_energy = (np.abs(spectrum) ** 2 * weights * bin_factor[None, :, None]).sum(axis=1) / sub_block
+
+    # Channel weights are 1.0 for left/right; sum channels, then form 400 ms blocks (4 sub-blocks, hop 100 ms)
+    sub_block_energy = sub_block_energy.sum(axis=1)
+    cumulative = np.concatenate(([0.0], np.cumsum(sub_block_energy)))
+    block_power = (cumulative[4:] - cumulative[:-4]) / (4 * sub_block)
+
+    with np.errstate(divide="ignore"):
+        block_loudness = -0.691 + 10 * np.log10(block_power)
+    gated = block_power[block_loudness > _ABSOLUTE_GATE_LUFS]
+    if gated.size == 0:
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) + _RELATIVE_GATE_LU
+    gated = block_power[(block_loudness > _ABSOLUTE_GATE_LUFS) & (block_loudness > relative_gate)]
+    if gated.size == 0:
+        return None
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def normalize_loudness(samples, target_lufs=COMPOSITE_MUSIC_TARGET_LUFS):
+    """Applies a single gain so the buffer's integrated loudness hits `target_lufs`."""
+    loudness = integrated_loudness(samples)
+    if loudness is None:
+        return samples
+    return samples * np.float32(10 ** ((target_lufs - loudness) / 20))
+
+
+def apply_fade_out(samples, fade_seconds):
+    fade = min(int(fade_seconds * SAMPLE_RATE), len(samples) // 2)
+    if fade > 0:
+        samples[-fade:] *= np.linspace(1.0, 0.0, fade, dtype=np.float32)[:, None]
+    return samples
+
+
+def build_soundtrack(music_path, duration, clip_audio=None, clip_audio_gain_db=COMPOSITE_CLIP_AUDIO_DUCK_DB):
+    """
+    Builds the final composite soundtrack from a music file: decoded once, looped to `duration` with
+    crossfaded seams, loudness-normalized and faded out. If `clip_audio` (the concatenated Veo clip
+    audio) is given it is ducked by `clip_audio_gain_db` and mixed under the music.
+    Returns float32 interleaved-ready (samples, channels) data at SAMPLE_RATE.
+    """
+    num_samples = int(round(duration * SAMPLE_RATE))
+    music = decode_audio(music_path, max_duration=duration)
+    track = loop_with_crossfade(music, num_samples, int(COMPOSITE_MUSIC_CROSSFADE_SECONDS * SAMPLE_RATE))
+    track = normalize_loudness(track)
+    track = apply_fade_out(track, COMPOSITE_AUDIO_FADE_SECONDS)
+    if clip_audio is not None:
+        track = track + fit_to_length(clip_audio, num_samples) * np.float32(10 ** (clip_audio_gain_db / 20))
+
+    peak = float(np.abs(track).max()) if track.size else 0.0
+    if peak > _PEAK_CEILING:
+        track *= np.float32(_PEAK_CEILING / peak)
+    return np.ascontiguousarray(track, dtype=np.float32)
@@ -0,0 +1,471 @@
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from moviepy.config import FFMPEG_BINARY
+
+from config import (
+    composite_work_dir,
+    COMPOSITE_X264_PRESET,
+    COMPOSITE_MAX_OPEN_READERS,
+    COMPOSITE_RENDER_ENGINE,
+)
+from segment_cache import segment_cache
+from composite_audio import SAMPLE_RATE as SOUNDTRACK_SAMPLE_RATE, CHANNELS as SOUNDTRACK_CHANNELS, build_soundtrack, decode_audio
+
+# Sample rate / layout every audio branch is normalized to before concat and mixing.
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNEL_LAYOUT = "stereo"
+AUDIO_BITRATE = "192k"
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def available_cpu_count():
+    """Number of CPUs this process may run on (respects container/cgroup affinity)."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError: # Not available on every platform
+        return os.cpu_count() or 1
+
+
+def select_encoder_settings(cpu_count=None):
+    """
+    Picks libx264 threads and preset for the cores available.
+    More cores buy a slower (better compressing) preset in the same wall time.
+    COMPOSITE_X264_PRESET overrides the automatic choice.
+    """
+    cores = cpu_count or available_cpu_count()
+    if COMPOSITE_X264_PRESET:
+        preset = COMPOSITE_X264_PRESET
+    elif cores <= 2:
+        preset = "ultrafast"
+    elif cores <= 4:
+        preset = "veryfast"
+    elif cores <= 8:
+        preset = "faster"
+    else:
+        preset = "medium"
+    return {"threads": cores, "preset": preset}
+
+
+def wait_for_sources(segments):
+    """Blocks until every segment's source file is local (segments may carry a pending GCS download future)."""
+    for segment in segments:
+        if segment.get("source_ready") is not None:
+            segment["source_ready"].result()
+
+
+def _even(value):
+    return int(value) - (int(value) % 2)
+
+
+class PeakRssMonitor:
+    """
+    Samples the resident set size of this process plus the ffmpeg children registered with it
+    and keeps the highest total seen. Used to report peak memory per composite job.
+    """
+
+    def __init__(self, interval_seconds=0.2):
+        self.interval_seconds = interval_seconds
+        self.peak_rss_bytes = 0
+        self._child_pids = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _rss_bytes(pid="self"):
+        try:
+            with open(f"/proc/{pid}/statm") as statm:
+                return int(statm.read().split()[1]) * _PAGE_SIZE
+        except (OSError, ValueError, IndexError): # Process already exited, or no procfs on this platform
+            return 0
+
+    def add_child(self, pid):
+        with self._lock:
+            self._child_pids.add(pid)
+        self.sample()
+
+    def remove_child(self, pid):
+        self.sample()
+        with self._lock:
+            self._child_pids.discard(pid)
+
+    def sample(self):
+        with self._lock:
+            child_pids = list(self._child_pids)
+        total = self._rss_bytes() + sum(self._rss_bytes(pid) for pid in child_pids)
+        self.peak_rss_bytes = max(self.peak_rss_bytes, total)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop_event.set()
+        self._thread.join()
+        self.sample()
+        if not self.peak_rss_bytes: # No procfs: fall back to the process-lifetime high-water mark
+            self.peak_rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return False
+
+
+def _feed_stdin(process, data):
+    try:
+        process.stdin.write(data)
+    except BrokenPipeError: # ffmpeg exited early; its error is reported through the exit code
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def run_ffmpeg(cmd, output_path, rss_monitor=None, on_progress=None, stdin_data=None):
+    """
+    Runs one ffmpeg command, registering it with the RSS monitor. If `on_progress` is given, ffmpeg's
+    `-progress` stream is parsed and the callback receives the number of frames encoded so far.
+    `stdin_data` (bytes) is streamed to ffmpeg's stdin, e.g. a raw PCM soundtrack read from `pipe:0`.
+    Raises RuntimeError on failure.
+    """
+    if on_progress:
+        cmd = cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
+    # stderr goes to a temp file so a chatty ffmpeg can never block on a full pipe while we read progress
+    with tempfile.TemporaryFile(mode="w+b") as stderr_file:
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE if on_progress else subprocess.DEVNULL,
+            stderr=stderr_file,
+        )
+        if rss_monitor:
+            rss_monitor.add_child(process.pid)
+        stdin_writer = None
+        if stdin_data is not None:
+            stdin_writer = threading.Thread(target=_feed_stdin, args=(process, stdin_data), daemon=True)
+            stdin_writer.start()
+        try:
+            if on_progress:
+                for line in process.stdout:
+                    key, _, value = line.decode(errors="replace").strip().partition("=")
+                    if key == "frame" and value.isdigit():
+                        on_progress(int(value))
+            process.wait()
+            if stdin_writer:
+                stdin_writer.join()
+        finally:
+            if rss_monitor:
+                rss_monitor.remove_child(process.pid)
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode(errors="replace")
+    if process.returncode != 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise RuntimeError(f"ffmpeg failed for {os.path.basename(output_path)} (exit code {process.returncode}): {stderr.strip()[-1000:]}")
+    return output_path
+
+
+def segment_frame_count(segment, fps):
+    return int(round((segment["end"] - segment["start"]) * fps))
+
+
+def composite_geometry(segments):
+    """Common output frame size, frame rate and duration for a list of segments."""
+    return {
+        "width": _even(max(seg["width"] for seg in segments)),
+        "height": _even(max(seg["height"] for seg in segments)),
+        "fps": max(seg["fps"] for seg in segments) or 24,
+        "duration": sum(seg["end"] - seg["start"] for seg in segments),
+    }
+
+
+def _video_normalize_filter(geometry):
+    return (
+        f"scale={geometry['width']}:{geometry['height']}:force_original_aspect_ratio=decrease,"
+        f"pad={geometry['width']}:{geometry['height']}:(ow-iw)/2:(oh-ih)/2,setsar=1,"
+        f"fps={geometry['fps']},format=yuv420p,setpts=PTS-STARTPTS"
+    )
+
+
+def _audio_normalize_filter(duration):
+    return (
+        f"aresample={AUDIO_SAMPLE_RATE},aformat=channel_layouts={AUDIO_CHANNEL_LAYOUT},"
+        f"apad,atrim=0:{duration:.3f},asetpts=PTS-STARTPTS"
+    )
+
+
+def _silence_source(duration):
+    return f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl={AUDIO_CHANNEL_LAYOUT},atrim=0:{duration:.3f},asetpts=PTS-STARTPTS"
+
+
+def _soundtrack_input_args():
+    """Raw float32 PCM soundtrack (from composite_audio.build_soundtrack) streamed on stdin."""
+    return ["-f", "f32le", "-ar", str(SOUNDTRACK_SAMPLE_RATE), "-ac", str(SOUNDTRACK_CHANNELS), "-i", "pipe:0"]
+
+
+def _video_encoder_args(geometry, encoder_settings):
+    return [
+        "-c:v", "libx264",
+        "-preset", encoder_settings["preset"],
+        "-threads", str(encoder_settings["threads"]),
+        "-pix_fmt", "yuv420p",
+        "-r", f"{geometry['fps']}",
+    ]
+
+
+def build_composite_command(segments, output_path, with_soundtrack=False, encoder_settings=None):
+    """
+    Compiles a list of trimmed segments into one ffmpeg invocation with a single filter_complex.
+
+    Each segment is a dict with 'path', 'start', 'end', 'width', 'height', 'fps' and 'has_audio'.
+    Mirrors the moviepy pipeline: clips are scaled/padded (centered) onto the largest frame and
+    concatenated. With `with_soundtrack`, the prepared music soundtrack read from stdin replaces the
+    clip audio.
+    """
+    if not segments:
+        raise ValueError("No segments to render.")
+    encoder_settings = encoder_settings or select_encoder_settings()
+    geometry = composite_geometry(segments)
+    total_duration = geometry["duration"]
+    use_clip_audio = not with_soundtrack and any(seg["has_audio"] for seg in segments)
+
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-y", "-loglevel", "error"]
+    for seg in segments:
+        # Input-level seeking: ffmpeg jumps to the nearest keyframe and only decodes from there.
+        cmd += ["-ss", f"{seg['start']:.3f}", "-t", f"{seg['end'] - seg['start']:.3f}", "-i", seg["path"]]
+    if with_soundtrack:
+        cmd += _soundtrack_input_args()
+
+    filters = []
+    concat_inputs = ""
+    for i, seg in enumerate(segments):
+        duration = seg["end"] - seg["start"]
+        filters.append(f"[{i}:v]{_video_normalize_filter(geometry)}[v{i}]")
+        concat_inputs += f"[v{i}]"
+        if use_clip_audio:
+            if seg["has_audio"]:
+                filters.append(f"[{i}:a]{_audio_normalize_filter(duration)}[a{i}]")
+            else:
+                filters.append(f"{_silence_source(duration)}[a{i}]")
+            concat_inputs += f"[a{i}]"
+
+    if use_clip_audio:
+        filters.append(f"{concat_inputs}concat=n={len(segments)}:v=1:a=1[vout][aout]")
+    else:
+        filters.append(f"{concat_inputs}concat=n={len(segments)}:v=1:a=0[vout]")
+
+    cmd += ["-filter_complex", ";".join(filters), "-map", "[vout]"]
+    if use_clip_audio:
+        cmd += ["-map", "[aout]", "-c:a", "aac", "-b:a", AUDIO_BITRATE]
+    elif with_soundtrack:
+        cmd += ["-map", f"{len(segments)}:a", "-c:a", "aac", "-b:a", AUDIO_BITRATE]
+    cmd += _video_encoder_args(geometry, encoder_settings)
+    cmd += ["-movflags", "+faststart", "-t", f"{total_duration:.3f}", output_path]
+    return cmd
+
+
+def build_segment_command(segment, output_path, geometry, include_audio, encoder_settings):
+    """
+    Renders one trimmed segment into a normalized intermediate (common size, fps, pixel format and
+    audio layout) so that all intermediates can later be joined with the concat demuxer without re-encoding.
+    """
+    duration = segment["end"] - segment["start"]
+    cmd = [
+        FFMPEG_BINARY, "-hide_banner", "-nostdin", "-y", "-loglevel", "error",
+        "-ss", f"{segment['start']:.3f}", "-t", f"{duration:.3f}", "-i", segment["path"],
+    ]
+    filters = [f"[0:v]{_video_normalize_filter(geometry)}[vout]"]
+    if include_audio:
+        if segment["has_audio"]:
+            filters.append(f"[0:a]{_audio_normalize_filter(duration)}[aout]")
+        else:
+            filters.append(f"{_silence_source(duration)}[aout]")
+    cmd += ["-filter_complex", ";".join(filters), "-map", "[vout]"]
+    if include_audio:
+        cmd += ["-map", "[aout]", "-c:a", "aac", "-b:a", AUDIO_BITRATE, "-ar", str(AUDIO_SAMPLE_RATE)]
+    cmd += _video_encoder_args(geometry, encoder_settings)
+    cmd += ["-t", f"{duration:.3f}", output_path]
+    return cmd
+
+
+def build_concat_command(concat_list_path, output_path, total_duration, with_soundtrack=False):
+    """Joins normalized intermediates by stream copy; only the soundtrack from stdin (if any) is encoded."""
+    cmd = [
+        FFMPEG_BINARY, "-hide_banner", "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", concat_list_path,
+    ]
+    if with_soundtrack:
+        cmd += _soundtrack_input_args()
+        cmd += ["-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "aac", "-b:a", AUDIO_BITRATE]
+    else:
+        cmd += ["-map", "0:v", "-map", "0:a?", "-c", "copy"]
+    cmd += ["-movflags", "+faststart", "-t", f"{total_duration:.3f}", output_path]
+    return cmd
+
+
+def render_composite_with_ffmpeg(segments, output_path, music_path=None, rss_monitor=None, progress=None):
+    """
+    Renders the composite in one ffmpeg subprocess. The music soundtrack (if any) is prepared in
+    NumPy and streamed to the encoder. `progress` (a CompositeProgressReporter) is fed from ffmpeg's
+    -progress output. Raises RuntimeError if ffmpeg fails.
+    """
+    encoder_settings = select_encoder_settings()
+    soundtrack = build_soundtrack(music_path, composite_geometry(segments)["duration"]) if music_path else None
+    wait_for_sources(segments) # A single pass needs every input up front
+    cmd = build_composite_command(segments, output_path, with_soundtrack=soundtrack is not None, encoder_settings=encoder_settings)
+    print(f"Rendering composite with ffmpeg ({len(segments)} segments, preset={encoder_settings['preset']}, threads={encoder_settings['threads']})")
+    on_progress = (lambda frames: progress.update("composite", frames)) if progress else None
+    return run_ffmpeg(
+        cmd,
+        output_path,
+        rss_monitor=rss_monitor,
+        on_progress=on_progress,
+        stdin_data=soundtrack.tobytes() if soundtrack is not None else None,
+    )
+
+
+def segment_encoding_profile(geometry, include_audio, encoder_settings):
+    """Everything that determines the bytes of a normalized segment, apart from its source and trim window."""
+    return {
+        "codec": "libx264",
+        "preset": encoder_settings["preset"],
+        "pix_fmt": "yuv420p",
+        "width": geometry["width"],
+        "height": geometry["height"],
+        "fps": geometry["fps"],
+        "audio": f"aac/{AUDIO_BITRATE}/{AUDIO_SAMPLE_RATE}/{AUDIO_CHANNEL_LAYOUT}" if include_audio else None,
+    }
+
+
+def _sequential_settings(segments, music_path, duck_clip_audio, max_open_readers):
+    """(max open readers, encoder settings, geometry, include_audio) of a segment-by-segment render."""
+    max_open_readers = max(1, max_open_readers or COMPOSITE_MAX_OPEN_READERS)
+    # Split the cores between the encoders that may run side by side. This depends only on the
+    # deployment, not on the composite, so the encoding profile (and segment cache keys) stay stable.
+    encoder_settings = select_encoder_settings(max(1, available_cpu_count() // max_open_readers))
+    geometry = composite_geometry(segments)
+    include_audio = (music_path is None or duck_clip_audio) and any(seg["has_audio"] for seg in segments)
+    return max_open_readers, encoder_settings, geometry, include_audio
+
+
+def _segment_cache_key(segment, geometry, include_audio, encoder_settings):
+    if not segment_cache.enabled or not segment.get("source_task_id"):
+        return None
+    profile = segment_encoding_profile(geometry, include_audio, encoder_settings)
+    return segment_cache.key_for(segment["source_task_id"], segment["start"], segment["end"], profile)
+
+
+def cached_segment_count(segments, music_path=None, duck_clip_audio=False, max_open_readers=None):
+    """How many segments a sequential render of this composite would take from the segment cache right now."""
+    if not segment_cache.enabled:
+        return 0
+    _, encoder_settings, geometry, include_audio = _sequential_settings(segments, music_path, duck_clip_audio, max_open_readers)
+    keys = (_segment_cache_key(segment, geometry, include_audio, encoder_settings) for segment in segments)
+    return sum(1 for key in keys if key and segment_cache.contains(key))
+
+
+def choose_composite_engine(segments, music_path=None, duck_clip_audio=False):
+    """
+    "ffmpeg" (render_composite_with_ffmpeg) or "sequential" (render_composite_sequential) for a
+    composite when COMPOSITE_RENDER_ENGINE is "ffmpeg" or "sequential":
+    - "sequential" if configured so;
+    - "sequential" if the clip audio is ducked under music: the mix needs the concatenated intermediates;
+    - "sequential" above COMPOSITE_MAX_OPEN_READERS segments: the single filtergraph keeps one decoder
+      per input open, the segment-by-segment render bounds memory;
+    - "sequential" if some segments are already in the segment cache, so they are reused;
+    - otherwise "ffmpeg": one pass, no intermediates. It does not fill the segment cache.
+    """
+    if COMPOSITE_RENDER_ENGINE == "sequential":
+        return "sequential"
+    if music_path and duck_clip_audio:
+        return "sequential"
+    if len(segments) > COMPOSITE_MAX_OPEN_READERS:
+        return "sequential"
+    if cached_segment_count(segments, music_path, duck_clip_audio) > 0:
+        return "sequential"
+    return "ffmpeg"
+
+
+def _render_or_reuse_segment(segment_index, segment, segment_path, geometry, include_audio, encoder_settings, rss_monitor=None, progress=None):
+    """Checks the normalized segment out of the segment cache, or renders it and caches it. Returns True on a cache hit."""
+    cache_key = _segment_cache_key(segment, geometry, include_audio, encoder_settings)
+    if cache_key:
+        if segment_cache.checkout(cache_key, segment_path):
+            if progress:
+                progress.skip(segment_index, segment_frame_count(segment, geometry["fps"])) # Done, but not encoded: kept out of the render fps
+            return True
+    if segment.get("source_ready") is not None:
+        segment["source_ready"].result() # Source still downloading: wait only for this segment's file
+    on_progress = (lambda frames: progress.update(segment_index, frames)) if progress else None
+    cmd = build_segment_command(segment, segment_path, geometry, include_audio, encoder_settings)
+    run_ffmpeg(cmd, segment_path, rss_monitor=rss_monitor, on_progress=on_progress)
+    if cache_key:
+        segment_cache.store(cache_key, segment_path)
+    return False
+
+
+def render_composite_sequential(segments, output_path, music_path=None, duck_clip_audio=False, max_open_readers=None, rss_monitor=None, progress=None):
+    """
+    Memory-bounded render: each source is opened only while its own segment is being encoded, with at
+    most `max_open_readers` ffmpeg readers alive at once. Segments already rendered for an earlier
+    composite (same source, trim window and encoding profile) are taken from the segment cache.
+    The normalized segments are then joined by stream copy. With music, the soundtrack is prepared in
+    NumPy (optionally with the clip audio ducked under it) and streamed to the final pass.
+    Raises RuntimeError if any ffmpeg step fails.
+    """
+    if not segments:
+        raise ValueError("No segments to render.")
+    max_open_readers, encoder_settings, geometry, include_audio = _sequential_settings(segments, music_path, duck_clip_audio, max_open_readers)
+    workers = min(max_open_readers, len(segments))
+
+    print(f"Rendering composite sequentially ({len(segments)} segments, {workers} open readers max, preset={encoder_settings['preset']}, threads={encoder_settings['threads']})")
+    work_dir = tempfile.mkdtemp(prefix="composite_", dir=composite_work_dir)
+    try:
+        segment_paths = [os.path.join(work_dir, f"segment_{i:04d}.mp4") for i in range(len(segments))]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _render_or_reuse_segment,
+                    i,
+                    segment,
+                    segment_path,
+                    geometry,
+                    include_audio,
+                    encoder_settings,
+                    rss_monitor,
+                    progress,
+                )
+                for i, (segment, segment_path) in enumerate(zip(segments, segment_paths))
+            ]
+            cache_hits = sum(1 for future in futures if future.result()) # Re-raises the first ffmpeg failure
+        print(f"{cache_hits}/{len(segments)} composite segments reused from the segment cache")
+
+        concat_list_path = os.path.join(work_dir, "concat.txt")
+        with open(concat_list_path, "w") as concat_list:
+            for segment_path in segment_paths:
+                concat_list.write(f"file '{segment_path}'\n")
+        soundtrack = None
+        if music_path:
+            clip_audio = decode_audio(concat_list_path, input_format="concat") if include_audio else None
+            soundtrack = build_soundtrack(music_path, geometry["duration"], clip_audio=clip_audio)
+        cmd = build_concat_command(concat_list_path, output_path, geometry["duration"], with_soundtrack=soundtrack is not None)
+        return run_ffmpeg(
+            cmd,
+            output_path,
+            rss_monitor=rss_monitor,
+            stdin_data=soundtrack.tobytes() if soundtrack is not None else None,
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
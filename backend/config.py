@@ -23,6 +23,11 @@ thumbnails_dir = os.path.join(data_dir, 'thumbnails') # Local thumbnails folder,
 generated_music_dir = os.path.join(data_dir, 'music') # Local folder for Lyria generated music
 user_uploaded_music_dir = os.path.join(data_dir, 'user_uploaded_music') # Local folder for user uploaded music
 uploads_dir = os.path.join(data_dir, 'uploads') # Local uploads folder for images, now in data_dir
+composite_work_dir = os.path.join(data_dir, 'composite_work') # Scratch space for intermediate composite segments
+previews_dir = os.path.join(data_dir, 'previews') # Low-bitrate playback proxies
+segment_cache_dir = os.path.join(data_dir, 'segment_cache') # LRU cache of normalized composite segments (same filesystem as composite_work_dir)
+parquet_export_dir = os.path.join(data_dir, 'exports', 'parquet') # Partitioned Parquet history exports
+profiles_dir = os.path.join(data_dir, 'profiles') # On-demand request and job profiles (profiling.py)
 
 
 # Ensure directories exist
@@ -38,6 +43,16 @@ if not os.path.exists(user_uploaded_music_dir):
     os.makedirs(user_uploaded_music_dir, exist_ok=True)
 if not os.path.exists(uploads_dir): # This will now create backend/data/uploads
     os.makedirs(uploads_dir, exist_ok=True)
+if not os.path.exists(composite_work_dir):
+    os.makedirs(composite_work_dir, exist_ok=True)
+if not os.path.exists(segment_cache_dir):
+    os.makedirs(segment_cache_dir, exist_ok=True)
+if not os.path.exists(previews_dir):
+    os.makedirs(previews_dir, exist_ok=True)
+if not os.path.exists(parquet_export_dir):
+    os.makedirs(parquet_export_dir, exist_ok=True)
+if not os.path.exists(profiles_dir):
+    os.makedirs(profiles_dir, exist_ok=True)
 
 
 # --- Video Generation Configuration ---
@@ -49,5 +64,98 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 ALLOWED_MUSIC_EXTENSIONS = {'mp3', 'wav'}
 MAX_MUSIC_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
 
+# --- Media Tools Configuration ---
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe") # Used to probe technical metadata of downloaded/rendered videos
+
+# --- Composite Rendering Configuration ---
+COMPOSITE_RENDER_ENGINE = os.getenv("COMPOSITE_RENDER_ENGINE", "ffmpeg") # "ffmpeg" (single pass, switching to segment by segment per composite: see composite_renderer.choose_composite_engine), "sequential" (always segment by segment) or "moviepy"
+COMPOSITE_MAX_OPEN_READERS = int(os.getenv("COMPOSITE_MAX_OPEN_READERS", "2")) # Max source files decoded at once; larger composites render segment by segment
+COMPOSITE_X264_PRESET = os.getenv("COMPOSITE_X264_PRESET") # Overrides the core-count based preset choice if set
+COMPOSITE_SEGMENT_CACHE_MAX_BYTES = int(os.getenv("COMPOSITE_SEGMENT_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024))) # 0 disables the segment cache
+COMPOSITE_PREFETCH_WORKERS = int(os.getenv("COMPOSITE_PREFETCH_WORKERS", "4")) # Parallel GCS downloads of composite sources missing locally
+COMPOSITE_PROGRESS_INTERVAL_SECONDS = float(os.getenv("COMPOSITE_PROGRESS_INTERVAL_SECONDS", "2.0")) # Min time between render progress writes to the task row
+COMPOSITE_AUDIO_FADE_SECONDS = float(os.getenv("COMPOSITE_AUDIO_FADE_SECONDS", "1.0")) # Music fade-out at the end of composites
+COMPOSITE_MUSIC_CROSSFADE_SECONDS = float(os.getenv("COMPOSITE_MUSIC_CROSSFADE_SECONDS", "0.5")) # Crossfade at music loop seams
+COMPOSITE_MUSIC_TARGET_LUFS = float(os.getenv("COMPOSITE_MUSIC_TARGET_LUFS", "-16.0")) # Integrated loudness target for composite music
+COMPOSITE_CLIP_AUDIO_DUCK_DB = float(os.getenv("COMPOSITE_CLIP_AUDIO_DUCK_DB", "-12.0")) # Gain of Veo clip audio kept under the music
+
+# --- Thumbnail Configuration ---
+THUMBNAIL_WIDTHS = [int(w) for w in os.getenv("THUMBNAIL_WIDTHS", "160,320,640").split(",") if w.strip()] # Poster variant widths, in addition to the full-size JPEG
+THUMBNAIL_FORMATS = [f.strip() for f in os.getenv("THUMBNAIL_FORMATS", "webp,jpg").split(",") if f.strip()] # Encodings written for every variant width
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_CANDIDATE_FRAMES = int(os.getenv("THUMBNAIL_CANDIDATE_FRAMES", "8")) # Keyframes scored when picking the poster frame
+THUMBNAIL_SPRITE_TILE_WIDTH = int(os.getenv("THUMBNAIL_SPRITE_TILE_WIDTH", "160"))
+THUMBNAIL_SPRITE_COLUMNS = int(os.getenv("THUMBNAIL_SPRITE_COLUMNS", "10"))
+THUMBNAIL_SPRITE_INTERVAL_SECONDS = float(os.getenv("THUMBNAIL_SPRITE_INTERVAL_SECONDS", "1.0")) # One hover-scrub tile per interval
+THUMBNAIL_SPRITE_MAX_TILES = int(os.getenv("THUMBNAIL_SPRITE_MAX_TILES", "100")) # Long videos are sampled more sparsely
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2")) # Background thumbnail jobs run in parallel per worker
+
+# --- Preview Proxy Configuration ---
+PREVIEW_HEIGHT = int(os.getenv("PREVIEW_HEIGHT", "360")) # Proxies are never upscaled
+PREVIEW_GOP_SECONDS = float(os.getenv("PREVIEW_GOP_SECONDS", "1.0")) # Keyframe interval, keeps seeking in the proxy cheap
+PREVIEW_CRF = int(os.getenv("PREVIEW_CRF", "30"))
+PREVIEW_MAX_BITRATE = os.getenv("PREVIEW_MAX_BITRATE", "600k")
+PREVIEW_AUDIO_BITRATE = os.getenv("PREVIEW_AUDIO_BITRATE", "64k")
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "1")) # Background proxy encodes run in parallel per worker
+PREVIEW_CACHE_MAX_AGE = int(os.getenv("PREVIEW_CACHE_MAX_AGE", str(365 * 24 * 3600))) # Proxies never change once written
+
+# --- HLS Packaging Configuration ---
+HLS_PACKAGING_ENABLED = os.getenv("HLS_PACKAGING_ENABLED", "false").lower() == "true" # Optional stage after a video completes
+HLS_RENDITIONS = [
+    (int(height), bitrate)
+    for height, _, bitrate in (r.partition(":") for r in os.getenv("HLS_RENDITIONS", "720:2500k,480:1200k,360:600k").split(",") if r.strip())
+] # "<height>:<video bitrate>" ladder rungs; rungs taller than the source are skipped
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "4"))
+HLS_AUDIO_BITRATE = os.getenv("HLS_AUDIO_BITRATE", "128k")
+HLS_WORKERS = int(os.getenv("HLS_WORKERS", "1"))
+
+# --- Pagination Configuration ---
+PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT", "200")) # Upper bound for per_page/limit on list endpoints
+PAGINATION_COUNT_CACHE_SECONDS = float(os.getenv("PAGINATION_COUNT_CACHE_SECONDS", "30")) # Max age of cached list totals
+STATUS_BATCH_MAX_IDS = int(os.getenv("STATUS_BATCH_MAX_IDS", "200")) # Max task ids per batched status poll
+
+# --- Task Events (SSE) Configuration ---
+TASK_EVENTS_POLL_INTERVAL_SECONDS = float(os.getenv("TASK_EVENTS_POLL_INTERVAL_SECONDS", "1.0")) # Change log tail interval (SQLite; fallback under PostgreSQL LISTEN/NOTIFY)
+TASK_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("TASK_EVENTS_HEARTBEAT_SECONDS", "15")) # Comment line sent on idle streams so proxies keep them open
+TASK_EVENTS_MAX_STREAM_SECONDS = float(os.getenv("TASK_EVENTS_MAX_STREAM_SECONDS", "300")) # Streams are closed after this long; browsers reconnect with Last-Event-ID
+TASK_EVENTS_RETRY_MS = int(os.getenv("TASK_EVENTS_RETRY_MS", "3000")) # Reconnect delay advertised to EventSource clients
+TASK_EVENTS_RETENTION_SECONDS = float(os.getenv("TASK_EVENTS_RETENTION_SECONDS", str(24 * 3600))) # Change log rows older than this are pruned
+
+# --- Parquet Export Configuration ---
+PARQUET_EXPORT_BATCH_ROWS = int(os.getenv("PARQUET_EXPORT_BATCH_ROWS", "50000")) # Rows fetched and written per row group
+PARQUET_EXPORT_COMPRESSION = os.getenv("PARQUET_EXPORT_COMPRESSION", "zstd")
+PARQUET_EXPORT_SETTLE_SECONDS = float(os.getenv("PARQUET_EXPORT_SETTLE_SECONDS", "60")) # Rows updated more recently wait for the next run
+
+# --- SQLite Configuration (only used when DATABASE_URI is a SQLite file) ---
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL") # Readers don't block the writer and vice versa
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL") # With WAL, durable across app crashes; a power loss may drop the last commits
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "15000")) # How long a writer waits for the lock before "database is locked"
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")) # Page cache per connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))) # Memory-mapped reads; 0 disables
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "10")) # Pooled connections per worker process, shared by request and background threads
+SQLITE_MAX_OVERFLOW = int(os.getenv("SQLITE_MAX_OVERFLOW", "20"))
+
+# --- Metrics Configuration ---
+METRICS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") # Set by start.sh: /api/metrics merges the samples of all gunicorn workers from this directory
+
+# --- Tracing Configuration ---
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower() # none, jsonl (local file) or otlp (OTLP/HTTP JSON collector)
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "0.05")) # Share of traces recorded; requests with a traceparent header follow its sampled flag
+TRACING_JSONL_PATH = os.getenv("TRACING_JSONL_PATH", os.path.join(data_dir, 'traces', 'spans.jsonl'))
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "dreamer-v-backend")
+TRACING_EXPORT_BATCH_SIZE = int(os.getenv("TRACING_EXPORT_BATCH_SIZE", "256")) # Spans per file write / OTLP request
+TRACING_EXPORT_INTERVAL_SECONDS = float(os.getenv("TRACING_EXPORT_INTERVAL_SECONDS", "5")) # Max delay before a partial batch is exported
+TRACING_QUEUE_SIZE = int(os.getenv("TRACING_QUEUE_SIZE", "10000")) # Finished spans waiting for export; more are dropped
+
+# --- Profiling Configuration ---
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10")) # Stack sampling period of on-demand profiles
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "1800")) # Sampling stops after this long (long composites); the memory report is still taken at the end
+PROFILE_TRACEMALLOC_TOP_N = int(os.getenv("PROFILE_TRACEMALLOC_TOP_N", "30")) # Allocation sites listed in a profile's memory report
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "100")) # Profiles kept in profiles_dir; the oldest are deleted beyond this
+
+# --- Schema Migration Configuration ---
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true" # Apply pending migrations at app startup; start.sh disables it and migrates once per deploy
+
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
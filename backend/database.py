@@ -1,3 +1,49 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from config import (
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CACHE_SIZE_KB,
+    SQLITE_MMAP_SIZE,
+    SQLITE_POOL_SIZE,
+    SQLITE_MAX_OVERFLOW,
+)
 
 db = SQLAlchemy()
+
+def is_sqlite_file_uri(uri):
+    return uri.startswith('sqlite') and ':memory:' not in uri and uri.rstrip('/') not in ('sqlite:', 'sqlite://')
+
+def sqlite_engine_options():
+    """
+    create_engine options for a SQLite file shared by request handlers and background job threads
+    of several worker processes.
+    """
+    return {
+        "poolclass": QueuePool, # One connection per thread at a time, reused across requests and jobs
+        "pool_size": SQLITE_POOL_SIZE,
+        "max_overflow": SQLITE_MAX_OVERFLOW,
+        "connect_args": {
+            "check_same_thread": False, # Pooled connections are handed to whichever thread checks them out
+            "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+            # sqlite3 opens a transaction right before the first INSERT/UPDATE/DELETE; IMMEDIATE takes the
+            # write lock there (waiting up to the busy timeout) instead of failing on a lock upgrade later.
+            # SELECTs outside a write transaction still run without holding any lock.
+            "isolation_level": "IMMEDIATE",
+        },
+    }
+
+def apply_sqlite_pragmas(engine):
+    """Per-connection pragmas, applied to every new connection of `engine`."""
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
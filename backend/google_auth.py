@@ -4,6 +4,9 @@ from typing import Optional
 import google.auth
 import google.auth.transport.requests
 
+from metrics import record_token_refresh
+from tracing import start_span
+
 _access_token: Optional[str] = None
 _token_created_at: Optional[datetime.datetime] = None
 _TOKEN_EXPIRATION_MINUTES = 30
@@ -20,18 +23,22 @@ def get_access_token() -> str:
         (now - _token_created_at) > datetime.timedelta(minutes=_TOKEN_EXPIRATION_MINUTES)
     ):
         try:
-            creds, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
-            auth_req = google.auth.transport.requests.Request()
-            creds.refresh(auth_req)
+            with start_span("google_auth refresh_token", kind="client"):
+                creds, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+                auth_req = google.auth.transport.requests.Request()
+                creds.refresh(auth_req)
             _access_token = creds.token
             _token_created_at = now
+            record_token_refresh("ok")
             print("Generated new access token.")
         except google.auth.exceptions.DefaultCredentialsError as e:
+            record_token_refresh("failed")
             raise RuntimeError(
                 "Failed to get default Google Cloud credentials. "
                 "Ensure you are authenticated (e.g., `gcloud auth application-default login`)."
             ) from e
         except Exception as e:
+            record_token_refresh("failed")
             raise RuntimeError(f"An unexpected error occurred while refreshing token: {e}") from e
     
     if _access_token is None:
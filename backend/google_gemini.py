@@ -1,6 +1,7 @@
 from google.genai import types
 from clients import get_genai_client
 from config import PROJECT_ID
+from tracing import start_span
 
 def call_gemini(prompt: str, system_instruction: str) -> str:
     """
@@ -41,13 +42,14 @@ def call_gemini(prompt: str, system_instruction: str) -> str:
         )
         
         full_response_text = ""
-        for chunk in client.models.generate_content_stream(
-            model=model_name,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            if chunk.text:
-                full_response_text += chunk.text
+        with start_span(f"gemini {model_name}:streamGenerateContent", kind="client"):
+            for chunk in client.models.generate_content_stream(
+                model=model_name,
+                contents=contents,
+                config=generate_content_config,
+            ):
+                if chunk.text:
+                    full_response_text += chunk.text
         
         return full_response_text.strip()
 
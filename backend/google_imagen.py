@@ -5,6 +5,7 @@ from typing import Optional, Dict, Any, List
 import requests
 
 from google_auth import get_access_token
+from metrics import vertex_post
 
 
 class GoogleImagen:
@@ -48,7 +49,7 @@ class GoogleImagen:
             "Content-Type": "application/json; charset=utf-8",
         }
         try:
-            response = requests.post(self.api_endpoint, headers=headers, json=data)
+            response = vertex_post(self.api_endpoint, headers=headers, json=data)
             response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
             return response.json()
         except requests.exceptions.HTTPError as http_err:
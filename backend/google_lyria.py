@@ -5,6 +5,7 @@ import uuid
 import requests
 
 from google_auth import get_access_token
+from metrics import vertex_post
 
 class GoogleLyria:
     def __init__(self, project_id: str, location: str = "us-central1"):
@@ -48,7 +49,7 @@ class GoogleLyria:
         }
 
         try:
-            response = requests.post(self.api_endpoint, headers=headers, json=payload, timeout=300) # Increased timeout for potentially long API calls
+            response = vertex_post(self.api_endpoint, headers=headers, json=payload, timeout=300) # Increased timeout for potentially long API calls
             response.raise_for_status()  # Raise an exception for bad status codes
             
             response_data = response.json()
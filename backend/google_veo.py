@@ -1,10 +1,11 @@
 import time
-import requests
 import os # For gsutil command
 
 from typing import Optional, Union, Dict # Added for Python 3.9 compatibility
 
 from google_auth import get_access_token
+from metrics import vertex_post
+from tracing import start_span
 
 class GoogleVeo:
     def __init__(self, project_id: str, model_name: str = "veo-3.0-generate-001"): # Default if not provided
@@ -26,7 +27,7 @@ class GoogleVeo:
             "Content-Type": "application/json",
         }
 
-        response = requests.post(api_endpoint, headers=headers, json=data)
+        response = vertex_post(api_endpoint, headers=headers, json=data)
         response.raise_for_status()
         return response.json()
 
@@ -76,17 +77,19 @@ class GoogleVeo:
 
     def _fetch_operation(self, lro_name: str, retries: int = 30, delay_seconds: int = 10):
         request_data = {"operationName": lro_name}
-        for i in range(retries):
-            resp = self._send_request_to_google_api(self.fetch_endpoint, request_data)
-            print("@@@", resp)
-            if "done" in resp and resp["done"]:
-                return resp
-            time.sleep(delay_seconds)
-        # If loop finishes, operation timed out
-        raise TimeoutError(f"Operation {lro_name} did not complete after {retries * delay_seconds} seconds.")
+        with start_span("veo fetch_operation", attributes={"veo.operation": lro_name}) as span:
+            for i in range(retries):
+                resp = self._send_request_to_google_api(self.fetch_endpoint, request_data)
+                span.set_attribute("veo.polls", i + 1)
+                if "done" in resp and resp["done"]:
+                    span.set_attribute("veo.error_code", (resp.get("error") or {}).get("code"))
+                    return resp
+                time.sleep(delay_seconds)
+            # If loop finishes, operation timed out
+            raise TimeoutError(f"Operation {lro_name} did not complete after {retries * delay_seconds} seconds.")
 
 
-    def generate_video(
+    def start_video_generation(
         self,
         prompt: str,
         parameters: Dict[str, Union[str, int, bool]],
@@ -98,7 +101,8 @@ class GoogleVeo:
         camera_control: str = "",
         generate_audio: bool = False,
         resolution: Optional[str] = None,
-    ):
+    ) -> str:
+        """Submits a generation request and returns the name of its long-running operation."""
         req = self._compose_videogen_request(
             prompt=prompt,
             parameters=parameters,
@@ -114,4 +118,11 @@ class GoogleVeo:
         print(f"Sending video generation request: {req}")
         resp = self._send_request_to_google_api(self.prediction_endpoint, req)
         print(f"Received LRO name: {resp.get('name')}")
-        return self._fetch_operation(resp["name"])
+        return resp["name"]
+
+    def wait_for_operation(self, lro_name: str):
+        """Polls a generation operation until it is done and returns it."""
+        return self._fetch_operation(lro_name)
+
+    def generate_video(self, prompt: str, parameters: Dict[str, Union[str, int, bool]], **kwargs):
+        return self.wait_for_operation(self.start_video_generation(prompt, parameters, **kwargs))
@@ -0,0 +1,9 @@
+# Loaded by start.sh (gunicorn -c gunicorn.conf.py). Worker count, class and bind stay on the command line.
+import os
+
+
+def child_exit(server, worker):
+    # Drop the live gauges (in-flight/queued jobs) of a worker that exited, so /api/metrics stops counting them
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
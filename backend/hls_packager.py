@@ -0,0 +1,152 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import storage
+from moviepy.config import FFMPEG_BINARY
+
+from database import db
+from models import VideoGenerationTask
+from task_timeline import TaskTimeline
+from metrics import record_gcs_transfer, tracked_job
+from tracing import start_span
+from composite_renderer import run_ffmpeg
+from config import (
+    videos_dir,
+    DEFAULT_OUTPUT_GCS_BUCKET,
+    HLS_RENDITIONS,
+    HLS_SEGMENT_SECONDS,
+    HLS_AUDIO_BITRATE,
+    HLS_WORKERS,
+)
+
+MASTER_PLAYLIST_NAME = "master.m3u8"
+
+_hls_executor = ThreadPoolExecutor(max_workers=HLS_WORKERS, thread_name_prefix="hls")
+
+
+def hls_dir_for(task_id):
+    """HLS output lives next to the MP4: videos_dir/<task_id>_hls/"""
+    return os.path.join(videos_dir, f"{task_id}_hls")
+
+
+def select_renditions(source_short_side):
+    """
+    Ladder rungs (sized by the short side, so 720 means 1280x720 or 720x1280) no larger than the
+    source; the smallest rung is always kept.
+    """
+    renditions = sorted(HLS_RENDITIONS, key=lambda r: r[0], reverse=True)
+    selected = [r for r in renditions if source_short_side is None or r[0] <= source_short_side]
+    return selected or renditions[-1:]
+
+
+def build_hls_command(video_path, output_dir, renditions, has_audio, portrait=False):
+    """
+    One ffmpeg pass: the decoded video is split into one scaled x264 encode per rendition, all with
+    keyframes forced on segment boundaries so every rendition cuts at the same timestamps and players
+    can switch between them mid-stream.
+    """
+    count = len(renditions)
+    split = f"[0:v]split={count}" + "".join(f"[v{i}]" for i in range(count))
+    scales = [
+        f"[v{i}]scale={size}:-2[v{i}out]" if portrait else f"[v{i}]scale=-2:{size}[v{i}out]"
+        for i, (size, _) in enumerate(renditions)
+    ]
+    cmd = [
+        FFMPEG_BINARY, "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-i", video_path,
+        "-filter_complex", ";".join([split] + scales),
+    ]
+    stream_map = []
+    for i, (_, bitrate) in enumerate(renditions):
+        cmd += [
+            "-map", f"[v{i}out]",
+            f"-c:v:{i}", "libx264", f"-b:v:{i}", bitrate, f"-maxrate:v:{i}", bitrate, f"-bufsize:v:{i}", bitrate,
+        ]
+        if has_audio:
+            cmd += ["-map", "0:a:0", f"-c:a:{i}", "aac", f"-b:a:{i}", HLS_AUDIO_BITRATE]
+            stream_map.append(f"v:{i},a:{i}")
+        else:
+            stream_map.append(f"v:{i}")
+    cmd += [
+        "-preset", "veryfast", "-pix_fmt", "yuv420p", "-sc_threshold", "0",
+        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(output_dir, "v%v", "segment_%03d.ts"),
+        "-master_pl_name", MASTER_PLAYLIST_NAME,
+        "-var_stream_map", " ".join(stream_map),
+        os.path.join(output_dir, "v%v", "index.m3u8"),
+    ]
+    return cmd
+
+
+def upload_hls_to_gcs(task_id, output_dir, bucket_name):
+    """Uploads the package under hls/<task_id>/ in the bucket and returns the master playlist URI."""
+    bucket = storage.Client().bucket(bucket_name)
+    prefix = f"hls/{task_id}"
+    for root, _, files in os.walk(output_dir):
+        for filename in files:
+            local_path = os.path.join(root, filename)
+            blob_name = f"{prefix}/{os.path.relpath(local_path, output_dir)}"
+            with start_span("gcs upload", kind="client", attributes={"gcs.uri": f"gs://{bucket_name}/{blob_name}"}):
+                bucket.blob(blob_name).upload_from_filename(local_path)
+            record_gcs_transfer("upload", local_path)
+    return f"gs://{bucket_name}/{prefix}/{MASTER_PLAYLIST_NAME}"
+
+
+def package_hls(task, video_path):
+    """Packages a task's video as an HLS ladder and stores the manifest paths on it (caller commits)."""
+    output_dir = hls_dir_for(task.id)
+    tmp_dir = f"{output_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    portrait = bool(task.media_width and task.media_height and task.media_height > task.media_width)
+    short_side = min(task.media_width, task.media_height) if task.media_width and task.media_height else None
+    renditions = select_renditions(short_side)
+    for i in range(len(renditions)):
+        os.makedirs(os.path.join(tmp_dir, f"v{i}"), exist_ok=True)
+    has_audio = task.media_audio_codec is not None
+    try:
+        run_ffmpeg(build_hls_command(video_path, tmp_dir, renditions, has_audio, portrait), os.path.join(tmp_dir, MASTER_PLAYLIST_NAME))
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(tmp_dir, output_dir) # Players never see a half-written package
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    task.local_hls_manifest_path = f"/hls/{task.id}/{MASTER_PLAYLIST_NAME}"
+    print(f"HLS package for task {task.id}: {', '.join(f'{h}p@{b}' for h, b in renditions)}")
+
+    bucket_to_use = task.gcs_output_bucket or DEFAULT_OUTPUT_GCS_BUCKET
+    if bucket_to_use:
+        task.hls_gcs_uri = upload_hls_to_gcs(task.id, output_dir, bucket_to_use.replace("gs://", "").split("/")[0])
+        print(f"HLS package for task {task.id} uploaded to GCS: {task.hls_gcs_uri}")
+
+
+def _run_hls_job(app, task_id, video_path):
+    with app.app_context():
+        task = VideoGenerationTask.query.get(task_id)
+        if not task:
+            print(f"Task {task_id} not found for HLS packaging.")
+            return
+        try:
+            with TaskTimeline.for_task(db.engine, task).stage("hls"):
+                package_hls(task, video_path)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"HLS packaging failed for task {task_id}: {e}")
+        finally:
+            db.session.remove()
+
+
+def schedule_hls_packaging(app, task_id, video_path):
+    """Queues HLS packaging on the background pool."""
+    return _hls_executor.submit(tracked_job("hls", None, _run_hls_job), app, task_id, video_path)
+
+
+def purge_task_hls(task_id):
+    output_dir = hls_dir_for(task_id)
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return True
+    return False
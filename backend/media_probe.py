@@ -0,0 +1,107 @@
+import json
+import os
+import subprocess
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from config import FFPROBE_BINARY
+
+
+def _parse_rate(rate):
+    """'30000/1001' -> 29.97"""
+    try:
+        numerator, _, denominator = rate.partition("/")
+        return round(float(numerator) / float(denominator or 1), 3)
+    except (ValueError, ZeroDivisionError, AttributeError):
+        return None
+
+
+def _run_ffprobe(args):
+    result = subprocess.run([FFPROBE_BINARY, "-v", "error"] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed (exit code {result.returncode}): {result.stderr.strip()[-500:]}")
+    return result.stdout
+
+
+def _probe_with_ffprobe(path):
+    info = json.loads(_run_ffprobe(["-print_format", "json", "-show_format", "-show_streams", path]))
+    streams = info.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+    fmt = info.get("format", {})
+
+    # Packet flags carry the keyframe marker, so this reads the container index without decoding frames
+    keyframe_times = []
+    if video:
+        packets = _run_ffprobe(["-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path])
+        for line in packets.splitlines():
+            pts_time, _, flags = line.partition(",")
+            if "K" in flags and pts_time not in ("", "N/A"):
+                keyframe_times.append(round(float(pts_time), 3))
+
+    return {
+        "duration": float(fmt["duration"]) if fmt.get("duration") else None,
+        "fps": _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "video_codec": video.get("codec_name"),
+        "audio_codec": audio.get("codec_name"),
+        "bitrate": int(fmt["bit_rate"]) if fmt.get("bit_rate") else None,
+        "keyframe_times": sorted(keyframe_times),
+    }
+
+
+def _probe_with_ffmpeg(path):
+    """Fallback when ffprobe is not installed: header parse through moviepy's ffmpeg (no keyframe index)."""
+    infos = ffmpeg_parse_infos(path)
+    video_size = infos.get("video_size") or [None, None]
+    return {
+        "duration": infos.get("duration"),
+        "fps": infos.get("video_fps"),
+        "width": video_size[0],
+        "height": video_size[1],
+        "video_codec": infos.get("video_codec_name"),
+        "audio_codec": "unknown" if infos.get("audio_found") else None,
+        "bitrate": infos["bitrate"] * 1000 if infos.get("bitrate") else None, # ffmpeg reports kb/s
+        "keyframe_times": None,
+    }
+
+
+def probe_media_file(path):
+    """
+    Reads the technical metadata of a media file: duration, fps, width, height, video/audio codecs,
+    bitrate (bits/s), keyframe timestamps and file size.
+    """
+    try:
+        probe = _probe_with_ffprobe(path)
+    except (OSError, RuntimeError, ValueError) as e: # ffprobe missing or unable to read the file
+        print(f"ffprobe unavailable for {path} ({e}); falling back to ffmpeg header parsing.")
+        probe = _probe_with_ffmpeg(path)
+    probe["file_size"] = os.path.getsize(path)
+    return probe
+
+
+def apply_probe_to_task(task, probe):
+    """Stores probe results on a VideoGenerationTask (caller commits)."""
+    task.media_duration_seconds = probe.get("duration")
+    task.media_fps = probe.get("fps")
+    task.media_width = probe.get("width")
+    task.media_height = probe.get("height")
+    task.media_video_codec = probe.get("video_codec")
+    task.media_audio_codec = probe.get("audio_codec")
+    task.media_bitrate = probe.get("bitrate")
+    task.media_file_size = probe.get("file_size")
+    keyframe_times = probe.get("keyframe_times")
+    task.media_keyframe_times = json.dumps(keyframe_times) if keyframe_times is not None else None
+
+
+def probe_task_video(task, path):
+    """Probes a task's local video and stores the metadata on the task. Never raises; returns the probe or None."""
+    try:
+        probe = probe_media_file(path)
+    except Exception as e:
+        print(f"Could not probe video {path} for task {task.id}: {e}")
+        return None
+    apply_probe_to_task(task, probe)
+    print(f"Probed video for task {task.id}: {probe['duration']}s, {probe['width']}x{probe['height']} @ {probe['fps']} fps, {probe['video_codec']}/{probe['audio_codec']}")
+    return probe
@@ -0,0 +1,180 @@
+"""
+Prometheus metrics served at /api/metrics.
+
+Under gunicorn every worker is a separate process, so start.sh points PROMETHEUS_MULTIPROC_DIR at a
+fresh directory: prometheus_client then keeps each worker's samples in memory-mapped files there and
+the scraping worker merges them (gunicorn.conf.py removes the files of workers that exit). Without
+the variable (flask run, scripts) the metrics live in the default in-process registry.
+
+Disk usage gauges are not recorded by the jobs; they are measured by whichever worker serves the scrape.
+"""
+import os
+import shutil
+import time
+
+import requests
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from tracing import start_span, traced
+from profiling import profiled_job
+from config import METRICS_MULTIPROC_DIR, data_dir, segment_cache_dir, COMPOSITE_SEGMENT_CACHE_MAX_BYTES
+
+# Stages range from milliseconds (probe) to tens of minutes (Veo polling, long composites)
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180, 300, 600, 1200, 1800, 3600)
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+JOBS_QUEUED = Gauge(
+    'dreamer_jobs_queued', "Background jobs submitted but not started yet.",
+    ['kind', 'model'], multiprocess_mode='livesum',
+)
+JOBS_IN_FLIGHT = Gauge(
+    'dreamer_jobs_in_flight', "Background jobs running now.",
+    ['kind', 'model'], multiprocess_mode='livesum',
+)
+JOB_SECONDS = Histogram(
+    'dreamer_job_duration_seconds', "Wall time of background jobs, from start to finish.",
+    ['kind', 'model'], buckets=STAGE_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    'dreamer_task_stage_duration_seconds', "Duration of task stages (see task_timeline.py).",
+    ['kind', 'model', 'stage', 'outcome'], buckets=STAGE_BUCKETS,
+)
+VERTEX_REQUESTS = Counter(
+    'dreamer_vertex_requests_total', "Vertex AI API calls by endpoint and HTTP status ('error' if no response).",
+    ['endpoint', 'code'],
+)
+VERTEX_SECONDS = Histogram(
+    'dreamer_vertex_request_duration_seconds', "Latency of Vertex AI API calls.",
+    ['endpoint'], buckets=REQUEST_BUCKETS,
+)
+TOKEN_REFRESHES = Counter(
+    'dreamer_access_token_refreshes_total', "Google access token refreshes.",
+    ['outcome'],
+)
+GCS_BYTES = Counter(
+    'dreamer_gcs_bytes_total', "Bytes moved to or from Cloud Storage.",
+    ['direction'],
+)
+GCS_TRANSFERS = Counter(
+    'dreamer_gcs_transfers_total', "Cloud Storage object uploads and downloads.",
+    ['direction'],
+)
+COMPOSITE_FRAMES = Counter(
+    'dreamer_composite_frames_rendered_total', "Frames encoded by finished composite renders.",
+)
+COMPOSITE_RENDER_SECONDS = Counter(
+    'dreamer_composite_render_seconds_total', "Wall time of finished composite renders; frames / seconds is the render throughput.",
+)
+
+
+# --- Jobs ---
+
+def tracked_job(kind, model, target):
+    """
+    Counts a job as queued from now until `target` starts, then as in flight until it returns, and
+    traces it as a child of the current span (the request or job that queued it). If the current
+    request asked for its jobs to be profiled (profiling.py), the job also runs under a profile.
+    Wrap the callable handed to a thread or executor: Thread(target=tracked_job("video", model, run), ...).
+    """
+    labels = (kind, model or "")
+    JOBS_QUEUED.labels(*labels).inc()
+    target = traced(f"job {kind}", target, {"job.kind": kind, "job.model": model or ""})
+    target = profiled_job(f"job {kind}", target)
+
+    def run(*args, **kwargs):
+        JOBS_QUEUED.labels(*labels).dec()
+        JOBS_IN_FLIGHT.labels(*labels).inc()
+        started_at = time.time()
+        try:
+            return target(*args, **kwargs)
+        finally:
+            JOBS_IN_FLIGHT.labels(*labels).dec()
+            JOB_SECONDS.labels(*labels).observe(time.time() - started_at)
+    return run
+
+def observe_stage(kind, model, stage, outcome, seconds):
+    STAGE_SECONDS.labels(kind, model or "", stage, outcome).observe(seconds)
+
+
+# --- Outbound calls ---
+
+def vertex_post(url, **kwargs):
+    """requests.post to a Vertex AI endpoint, counted by endpoint (`<model>:<method>`) and status code."""
+    endpoint = url.rsplit('/', 1)[-1]
+    started_at = time.time()
+    with start_span(f"vertex {endpoint}", kind="client", attributes={"http.method": "POST", "vertex.endpoint": endpoint}) as span:
+        try:
+            response = requests.post(url, **kwargs)
+        except requests.exceptions.RequestException:
+            VERTEX_REQUESTS.labels(endpoint, "error").inc()
+            raise
+        finally:
+            VERTEX_SECONDS.labels(endpoint).observe(time.time() - started_at)
+        span.set_attribute("http.status_code", response.status_code)
+    VERTEX_REQUESTS.labels(endpoint, str(response.status_code)).inc()
+    return response
+
+def record_token_refresh(outcome):
+    TOKEN_REFRESHES.labels(outcome).inc()
+
+def record_gcs_transfer(direction, path):
+    """Counts an upload or download of the local file at `path`."""
+    GCS_TRANSFERS.labels(direction).inc()
+    try:
+        GCS_BYTES.labels(direction).inc(os.path.getsize(path))
+    except OSError:
+        pass
+
+def record_composite_render(frames, seconds):
+    COMPOSITE_FRAMES.inc(frames)
+    COMPOSITE_RENDER_SECONDS.inc(seconds)
+
+
+# --- Scrape ---
+
+class DiskUsageCollector:
+    """Segment cache size and free space on the data volume, measured at scrape time."""
+
+    def collect(self):
+        cache_bytes = cache_entries = 0
+        try:
+            for entry in os.scandir(segment_cache_dir):
+                if entry.name.endswith(".mp4"):
+                    try:
+                        cache_bytes += entry.stat().st_size
+                        cache_entries += 1
+                    except FileNotFoundError: # Evicted while scanning
+                        pass
+        except FileNotFoundError:
+            pass
+        yield GaugeMetricFamily('dreamer_segment_cache_bytes', "Bytes in the composite segment cache.", value=cache_bytes)
+        yield GaugeMetricFamily('dreamer_segment_cache_entries', "Segments in the composite segment cache.", value=cache_entries)
+        yield GaugeMetricFamily('dreamer_segment_cache_max_bytes', "Segment cache size limit.", value=COMPOSITE_SEGMENT_CACHE_MAX_BYTES)
+        usage = shutil.disk_usage(data_dir)
+        yield GaugeMetricFamily('dreamer_data_volume_free_bytes', "Free space on the volume holding the data directory.", value=usage.free)
+        yield GaugeMetricFamily('dreamer_data_volume_size_bytes', "Size of the volume holding the data directory.", value=usage.total)
+
+
+_disk_usage_collector = DiskUsageCollector()
+if not METRICS_MULTIPROC_DIR:
+    REGISTRY.register(_disk_usage_collector)
+
+def render_metrics():
+    """(body, content type) of a scrape, merged across worker processes in multiprocess mode."""
+    if METRICS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_disk_usage_collector)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,135 +1,179 @@
 import sys
 import os
+import time
+import hashlib
+import json
 import argparse
 
-# Add the project root to the Python path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Run from anywhere: the backend modules are imported by their plain names, as the app does
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
-from sqlalchemy import create_engine, inspect, text, Table, MetaData
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, delete, func, inspect, select
 from sqlalchemy.exc import SQLAlchemyError
-from backend.config import DATABASE_URI, data_dir
-from backend.models import VideoGenerationTask
+from config import DATABASE_URI, data_dir
+from models import VideoGenerationTask, MusicGenerationTask
+from migrations import LATEST_VERSION, MigrationError, current_version, run_migrations
 
 # --- Database Agnostic Migration Script ---
 
-def column_exists(engine, table_name, column_name):
-    """Checks if a column exists in a table in a database-agnostic way."""
-    inspector = inspect(engine)
-    columns = [col['name'] for col in inspector.get_columns(table_name)]
-    return column_name in columns
+COPIED_MODELS = (VideoGenerationTask, MusicGenerationTask)
+COPY_CHUNK_ROWS = 5000 # Rows per SELECT on the source and per multi-row INSERT on the destination
 
-def initialize_schema(engine):
-    """Creates tables based on the model definitions if they don't exist."""
-    print("Executing initial schema setup (CREATE TABLE IF NOT EXISTS)...")
-    try:
-        # Use the model's metadata to create the table, which is db-agnostic
-        VideoGenerationTask.metadata.create_all(engine, checkfirst=True)
-        print("'video_generation_task' table schema check/creation complete.")
-    except SQLAlchemyError as e:
-        print(f"Error during initial schema setup: {e}")
-
-def migrate_schema_add_column(engine, table_name, column_name, column_type):
-    """Adds a column to a table if it doesn't exist."""
-    if not column_exists(engine, table_name, column_name):
-        print(f"Adding '{column_name}' column to '{table_name}' table...")
-        try:
-            with engine.connect() as connection:
-                # Use text() for cross-compatibility of the SQL statement
-                connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
-                connection.commit()
-            print(f"'{column_name}' column added successfully.")
-        except SQLAlchemyError as e:
-            print(f"Error adding '{column_name}' column: {e}")
-    else:
-        print(f"'{column_name}' column already exists in '{table_name}'.")
 
-def migrate_data_backfill_user_column(engine):
-    """Backfills the 'user' column with 'public@dreamer-v' for existing tasks where user is NULL."""
-    print("Backfilling 'user' column for existing tasks with 'public@dreamer-v'...")
-    try:
-        with engine.connect() as connection:
-            # Use text() for cross-compatibility
-            result = connection.execute(text("UPDATE video_generation_task SET \"user\" = 'public@dreamer-v' WHERE \"user\" IS NULL"))
-            connection.commit()
-            print(f"Successfully backfilled 'user' column for {result.rowcount} tasks.")
-    except SQLAlchemyError as e:
-        # Note: Using "user" in quotes for PostgreSQL compatibility, as USER is a reserved keyword.
-        print(f"Error backfilling 'user' column: {e}")
-
-def copy_sqlite_to_postgres(sqlite_uri, postgres_uri, force=False):
-    """Copies data from a SQLite database to a PostgreSQL database."""
-    print(f"Starting data copy from SQLite ({sqlite_uri}) to PostgreSQL ({postgres_uri})...")
-    
-    # Create engines for both databases
-    sqlite_engine = create_engine(sqlite_uri)
+def _checkpoint_path(sqlite_path):
+    return f"{sqlite_path}.pgcopy.json"
+
+def _read_checkpoint(path, destination):
+    """Copy progress per table, or {} if there is none for this destination."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        checkpoint = json.load(f)
+    return checkpoint.get("tables", {}) if checkpoint.get("destination") == destination else {}
+
+def _write_checkpoint(path, destination, tables):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"destination": destination, "tables": tables}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path) # Never leave a truncated checkpoint behind
+
+def _copied_columns(sqlite_engine, table):
+    """Columns present in the source table; databases from older releases lack the newer ones."""
+    existing = {column['name'] for column in inspect(sqlite_engine).get_columns(table.name)}
+    return [column for column in table.columns if column.name in existing]
+
+def _insert_ignoring_duplicates(connection, table):
+    # A chunk committed just before a crash is sent again on resume; skip the rows already there
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table).on_conflict_do_nothing(index_elements=['id'])
+
+def table_checksum(engine, columns):
+    """
+    Row count and an order-independent checksum (sum of per-row SHA-256 digests) of the given columns.
+    Values are read through the column types, so the same data gives the same checksum on SQLite and PostgreSQL.
+    """
+    count, total = 0, 0
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=COPY_CHUNK_ROWS).execute(select(*columns))
+        for row in result:
+            digest = hashlib.sha256(repr(tuple(row)).encode("utf-8")).digest()
+            total = (total + int.from_bytes(digest, "big")) % (1 << 256)
+            count += 1
+    return count, f"{total:064x}"
+
+def copy_table(sqlite_engine, postgres_engine, table, columns, progress, on_chunk, chunk_rows=COPY_CHUNK_ROWS):
+    """
+    Copies `table` in primary-key order, one chunk per transaction, starting after progress['last_id'].
+    Each chunk is a keyset-paginated SELECT on the source and a single executemany INSERT on the destination;
+    on_chunk(progress) is called after every committed chunk. Returns the rows copied by this call.
+    """
+    key = table.c.id
+    copied = 0
+    started_at = time.time()
+    while True:
+        statement = select(*columns).order_by(key).limit(chunk_rows)
+        if progress.get("last_id") is not None:
+            statement = statement.where(key > progress["last_id"])
+        with sqlite_engine.connect() as connection:
+            rows = [dict(row) for row in connection.execute(statement).mappings()]
+        if not rows:
+            return copied
+        with postgres_engine.begin() as connection:
+            connection.execute(_insert_ignoring_duplicates(connection, table), rows)
+        copied += len(rows)
+        progress["last_id"] = rows[-1]["id"]
+        progress["rows"] = progress.get("rows", 0) + len(rows)
+        on_chunk(progress)
+        elapsed = time.time() - started_at
+        print(f"  {table.name}: {progress['rows']} row(s) copied ({copied / max(elapsed, 1e-6):.0f} rows/s)")
+
+def copy_sqlite_to_postgres(sqlite_path, postgres_uri, force=False, chunk_rows=COPY_CHUNK_ROWS):
+    """
+    Copies the video and music task tables from a SQLite database to PostgreSQL in chunks, then verifies
+    row counts and checksums. Progress is checkpointed next to the SQLite file, so an interrupted copy
+    resumes where it stopped when run again. Returns True if every table verified.
+    """
+    sqlite_engine = create_engine(f"sqlite:///{sqlite_path}")
     postgres_engine = create_engine(postgres_uri)
-    
-    # Create sessions
-    SessionSqlite = sessionmaker(bind=sqlite_engine)
-    SessionPostgres = sessionmaker(bind=postgres_engine)
-    sqlite_session = SessionSqlite()
-    postgres_session = SessionPostgres()
-    
+    destination = postgres_engine.url.render_as_string(hide_password=True)
+    checkpoint_path = _checkpoint_path(sqlite_path)
+    print(f"Starting data copy from SQLite ({sqlite_path}) to PostgreSQL ({destination})...")
+
     try:
-        # Check if the destination table is empty
-        if postgres_session.query(VideoGenerationTask).count() > 0:
-            if not force:
-                print("PostgreSQL database is not empty. Use --force to overwrite. Aborting copy.")
-                return
-            else:
+        run_migrations(postgres_engine) # The destination schema must be current before rows arrive
+        progress = {} if force else _read_checkpoint(checkpoint_path, destination)
+
+        if not progress:
+            with postgres_engine.connect() as connection:
+                non_empty = [model.__tablename__ for model in COPIED_MODELS
+                             if connection.execute(select(func.count()).select_from(model.__table__)).scalar()]
+            if non_empty and not force:
+                print(f"PostgreSQL table(s) {', '.join(non_empty)} are not empty. Use --force to overwrite. Aborting copy.")
+                return False
+            if non_empty:
                 print("PostgreSQL database is not empty. --force is used, deleting existing data...")
-                postgres_session.query(VideoGenerationTask).delete()
-                postgres_session.commit()
+                with postgres_engine.begin() as connection:
+                    for model in COPIED_MODELS:
+                        connection.execute(delete(model.__table__))
                 print("Existing data deleted.")
-
-        # Fetch all data from the source table
-        print("Fetching all tasks from SQLite database...")
-        tasks = sqlite_session.query(VideoGenerationTask).all()
-        print(f"Found {len(tasks)} tasks to copy.")
-
-        # Insert data into the destination table
-        print("Inserting tasks into PostgreSQL database...")
-        for old_task in tasks:
-            new_task = VideoGenerationTask(
-                id=old_task.id,
-                prompt=old_task.prompt,
-                model=old_task.model,
-                aspect_ratio=old_task.aspect_ratio,
-                camera_control=old_task.camera_control,
-                duration_seconds=old_task.duration_seconds,
-                gcs_output_bucket=old_task.gcs_output_bucket,
-                status=old_task.status,
-                video_gcs_uri=old_task.video_gcs_uri,
-                local_video_path=old_task.local_video_path,
-                local_thumbnail_path=old_task.local_thumbnail_path,
-                image_filename=old_task.image_filename,
-                image_gcs_uri=old_task.image_gcs_uri,
-                last_frame_filename=old_task.last_frame_filename,
-                last_frame_gcs_uri=old_task.last_frame_gcs_uri,
-                video_uri=old_task.video_uri,
-                error_message=old_task.error_message,
-                user=old_task.user,
-                generate_audio=old_task.generate_audio,
-                created_at=old_task.created_at,
-                updated_at=old_task.updated_at,
-                music_file_path=old_task.music_file_path,
-                resolution=old_task.resolution
+        else:
+            print(f"Resuming from checkpoint {checkpoint_path}.")
+
+        started_at = time.time()
+        total_copied = 0
+        for model in COPIED_MODELS:
+            table = model.__table__
+            columns = _copied_columns(sqlite_engine, table)
+            table_progress = progress.setdefault(table.name, {})
+            if table_progress.get("done"):
+                print(f"{table.name}: already copied ({table_progress.get('rows', 0)} rows).")
+                continue
+            print(f"Copying {table.name}...")
+            table_started_at = time.time()
+            copied = copy_table(
+                sqlite_engine, postgres_engine, table, columns, table_progress,
+                lambda _: _write_checkpoint(checkpoint_path, destination, progress), chunk_rows,
             )
-            postgres_session.add(new_task)
-        
-        postgres_session.commit()
-        print("Data copy successful!")
-
-    except SQLAlchemyError as e:
+            table_progress["done"] = True
+            _write_checkpoint(checkpoint_path, destination, progress)
+            total_copied += copied
+            elapsed = time.time() - table_started_at
+            print(f"{table.name}: copied {copied} row(s) in {elapsed:.1f}s ({copied / max(elapsed, 1e-6):.0f} rows/s).")
+
+        elapsed = time.time() - started_at
+        print(f"Copied {total_copied} row(s) in {elapsed:.1f}s ({total_copied / max(elapsed, 1e-6):.0f} rows/s).")
+
+        print("Verifying row counts and checksums...")
+        verified = True
+        for model in COPIED_MODELS:
+            columns = _copied_columns(sqlite_engine, model.__table__)
+            source_count, source_checksum = table_checksum(sqlite_engine, columns)
+            destination_count, destination_checksum = table_checksum(postgres_engine, columns)
+            ok = source_count == destination_count and source_checksum == destination_checksum
+            verified = verified and ok
+            print(f"  {model.__tablename__}: {source_count} -> {destination_count} rows, "
+                  f"checksum {'match' if ok else 'MISMATCH'} ({source_checksum[:12]} / {destination_checksum[:12]})")
+
+        if not verified:
+            print("Verification failed: the destination differs from the source. Re-run with --force to copy again.")
+            return False
+        os.remove(checkpoint_path)
+        print("Data copy successful! Usage rollups are rebuilt with: python3 backend/usage_rollup.py --backfill")
+        return True
+
+    except (SQLAlchemyError, MigrationError) as e:
         print(f"An error occurred during data copy: {e}")
-        postgres_session.rollback()
+        print(f"Progress is saved in {checkpoint_path}; run the same command again to resume.")
+        return False
     finally:
-        sqlite_session.close()
-        postgres_session.close()
+        sqlite_engine.dispose()
+        postgres_engine.dispose()
 
 def setup_database():
-    """Sets up the database by creating tables and running migrations."""
+    """Applies pending schema migrations (see migrations.py). Runs once per deploy, before the workers start."""
     print(f"Connecting to database using URI: {DATABASE_URI}")
     engine = None
     try:
@@ -139,32 +183,14 @@ def setup_database():
             print(f"Created data directory at {data_dir} as it was missing.")
 
         engine = create_engine(DATABASE_URI)
+        print(f"Schema version {current_version(engine)}, latest {LATEST_VERSION}.")
+        applied = run_migrations(engine)
+        print(f"Database setup and migration successful! ({applied} migration(s) applied)")
 
-        # Initialize schema (creates table if it doesn't exist)
-        initialize_schema(engine)
-
-        # Run migrations for each required column
-        # Note: For PostgreSQL, BOOLEAN is a native type. For SQLite, it's often INTEGER.
-        # SQLAlchemy handles this abstraction well, but for raw SQL, we need to be careful.
-        # Using VARCHAR for user as it's defined in the model.
-        migrate_schema_add_column(engine, 'video_generation_task', 'user', 'VARCHAR(255)')
-        migrate_schema_add_column(engine, 'video_generation_task', 'music_file_path', 'VARCHAR(1024)')
-        migrate_schema_add_column(engine, 'video_generation_task', 'resolution', 'VARCHAR(10)')
-        
-        # For boolean, the type can be tricky. BOOLEAN is standard SQL.
-        # SQLite will use INTEGER 0/1, PostgreSQL will use true/false.
-        # The model uses db.Boolean, so SQLAlchemy handles the abstraction.
-        # When adding manually, 'BOOLEAN' should be acceptable for both via SQLAlchemy's engine.
-        migrate_schema_add_column(engine, 'video_generation_task', 'generate_audio', 'BOOLEAN')
-
-        # Backfill data
-        migrate_data_backfill_user_column(engine)
-
-        print("Database setup and migration successful!")
-
-    except SQLAlchemyError as e:
+    except (SQLAlchemyError, MigrationError) as e:
         print(f"An error occurred during database setup: {e}")
         print("Database setup failed.")
+        sys.exit(1)
     finally:
         if engine:
             engine.dispose()
@@ -180,25 +206,34 @@ if __name__ == '__main__':
     parser.add_argument(
         '--force',
         action='store_true',
-        help="Force the copy operation even if the destination database is not empty."
+        help="Force the copy operation even if the destination database is not empty (discards any checkpoint)."
+    )
+    parser.add_argument(
+        '--sqlite-path',
+        default=os.path.join(data_dir, 'tasks.db'),
+        help="Source SQLite database for --copy-sqlite-to-postgres (default: the local tasks.db)."
     )
-    
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=COPY_CHUNK_ROWS,
+        help="Rows per copied chunk (one transaction and checkpoint each)."
+    )
+
     args = parser.parse_args()
 
     if args.copy_sqlite_to_postgres:
-        # Default source is the local tasks.db
-        default_sqlite_path = os.path.join(data_dir, 'tasks.db')
-        sqlite_uri = f'sqlite:///{default_sqlite_path}'
-        
         # Destination is the configured DATABASE_URI
         postgres_uri = DATABASE_URI
 
         if 'postgres' not in postgres_uri:
             print("Error: The configured DATABASE_URI is not a PostgreSQL database.")
-        elif not os.path.exists(default_sqlite_path):
-            print(f"Error: Default SQLite database not found at {default_sqlite_path}")
-        else:
-            copy_sqlite_to_postgres(sqlite_uri, postgres_uri, force=args.force)
+            sys.exit(1)
+        elif not os.path.exists(args.sqlite_path):
+            print(f"Error: SQLite database not found at {args.sqlite_path}")
+            sys.exit(1)
+        elif not copy_sqlite_to_postgres(args.sqlite_path, postgres_uri, force=args.force, chunk_rows=args.chunk_size):
+            sys.exit(1)
     else:
         print("Starting database setup process...")
         setup_database()
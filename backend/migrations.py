@@ -0,0 +1,186 @@
+"""
+Versioned schema migrations.
+
+Applied versions are recorded in the schema_version table. MIGRATIONS is an ordered list of steps;
+run_migrations() applies the ones above the recorded version, one at a time, while holding a
+migration lock (a PostgreSQL advisory lock, or a file lock next to a SQLite database), so concurrent
+deploys or workers never run a step twice. start.sh runs them once per deploy via migrate_db.py;
+worker startup only compares the recorded version with LATEST_VERSION (one query, no reflection).
+
+The first steps bring databases created by earlier releases (db.create_all() plus migrate_db.py's
+per-column ALTERs) up to the baseline and are idempotent. Later steps only ever run once, so they
+may assume the schema of the previous version. Never edit or reorder a released step; append one.
+"""
+import contextlib
+import fcntl
+import time
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateIndex
+
+from database import db
+from models import VideoGenerationTask, MusicGenerationTask, TaskChangeLog, UsageRollup, TaskEvent
+
+MIGRATION_LOCK_KEY = 4_205_731_120 # pg_advisory_lock key of migration runs (arbitrary, must never change)
+
+# Kept out of db.metadata so db.create_all()/drop_all() in scripts never touch it
+schema_version_table = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', String(255), nullable=False),
+    Column('applied_at', Float, nullable=False),
+    Column('duration_seconds', Float, nullable=True),
+)
+
+
+class MigrationError(Exception):
+    pass
+
+
+# --- Step helpers ---
+
+def create_missing_indexes(engine, model):
+    """
+    Creates the indexes declared in a model's __table_args__ if they don't exist.
+    On PostgreSQL the index is built CONCURRENTLY so the table stays writable while it builds.
+    """
+    table = model.__table__
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+    for index in sorted(table.indexes, key=lambda ix: ix.name):
+        if index.name in existing:
+            continue
+        print(f"Creating index '{index.name}' on '{table.name}' ({', '.join(col.name for col in index.columns)})...")
+        statement = str(CreateIndex(index).compile(dialect=engine.dialect))
+        started_at = time.time()
+        if engine.dialect.name == 'postgresql':
+            # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+            statement = statement.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.execute(text(statement))
+        else:
+            with engine.begin() as connection:
+                connection.execute(text(statement))
+        print(f"Index '{index.name}' created in {time.time() - started_at:.1f}s.")
+
+def add_missing_columns(engine, model):
+    """Adds the model's columns that are missing from its table (one reflection per table)."""
+    table = model.__table__
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    preparer = engine.dialect.identifier_preparer
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=engine.dialect)
+        print(f"Adding '{column.name}' column ({column_type}) to '{table.name}' table...")
+        with engine.begin() as connection:
+            connection.execute(text(
+                f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} {column_type}"
+            ))
+
+
+# --- Steps ---
+
+def _create_tables(engine):
+    db.metadata.create_all(engine, checkfirst=True)
+
+def _add_legacy_columns(engine):
+    # Tables created by older releases lack the columns added since; migrate_db.py used to add the
+    # video ones column by column and never looked at music_generation_task.
+    for model in (VideoGenerationTask, MusicGenerationTask, TaskChangeLog, UsageRollup):
+        add_missing_columns(engine, model)
+
+def _backfill_video_task_user(engine):
+    with engine.begin() as connection:
+        result = connection.execute(text("UPDATE video_generation_task SET \"user\" = 'public@dreamer-v' WHERE \"user\" IS NULL"))
+    print(f"Backfilled 'user' for {result.rowcount} task(s).")
+
+def _create_indexes(engine):
+    for model in (VideoGenerationTask, MusicGenerationTask, TaskChangeLog, UsageRollup):
+        create_missing_indexes(engine, model)
+
+def _create_task_event_table(engine):
+    TaskEvent.__table__.create(engine, checkfirst=True) # Already there if step 1 ran on this release
+
+def _add_music_task_user(engine):
+    add_missing_columns(engine, MusicGenerationTask) # Already there if step 1 ran on this release
+
+
+MIGRATIONS = [
+    # (version, name, step(engine))
+    (1, "create tables", _create_tables),
+    (2, "add columns missing from tables created by earlier releases", _add_legacy_columns),
+    (3, "backfill video_generation_task.user", _backfill_video_task_user),
+    (4, "task list, usage, change log and rollup indexes", _create_indexes),
+    (5, "task_event stage timeline table", _create_task_event_table),
+    (6, "music_generation_task.user", _add_music_task_user),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# --- Runner ---
+
+@contextlib.contextmanager
+def migration_lock(engine):
+    """Serializes migrations across processes and hosts (PostgreSQL) or processes (SQLite file)."""
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    elif engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+        with open(f"{engine.url.database}.migrate.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+def current_version(engine):
+    """Highest applied version, 0 for a database that has never been migrated."""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(select(schema_version_table.c.version).order_by(schema_version_table.c.version.desc()).limit(1)).scalar() or 0
+    except SQLAlchemyError: # No schema_version table yet
+        return 0
+
+def run_migrations(engine):
+    """Applies pending migrations under the migration lock. Returns the number of steps applied."""
+    with migration_lock(engine):
+        schema_version_table.create(engine, checkfirst=True)
+        version = current_version(engine) # Re-read under the lock: another process may have just migrated
+        pending = [migration for migration in MIGRATIONS if migration[0] > version]
+        if not pending:
+            print(f"Database schema is at version {version}, nothing to migrate.")
+            return 0
+        for step_version, name, step in pending:
+            print(f"Applying migration {step_version}: {name}...")
+            started_at = time.time()
+            try:
+                step(engine)
+            except Exception as e:
+                raise MigrationError(f"Migration {step_version} ({name}) failed: {e}") from e
+            with engine.begin() as connection:
+                connection.execute(schema_version_table.insert().values(
+                    version=step_version, name=name, applied_at=time.time(), duration_seconds=time.time() - started_at,
+                ))
+            print(f"Migration {step_version} applied in {time.time() - started_at:.1f}s.")
+        return len(pending)
+
+def ensure_schema(engine, auto_migrate):
+    """
+    Worker startup check: a single version query when the schema is current. A database behind
+    LATEST_VERSION is migrated here if `auto_migrate` (local development), otherwise only reported.
+    """
+    version = current_version(engine)
+    if version >= LATEST_VERSION:
+        return
+    if auto_migrate:
+        run_migrations(engine)
+    else:
+        print(f"Warning: database schema is at version {version}, this release expects {LATEST_VERSION}. "
+              f"Run migrate_db.py before starting workers.")
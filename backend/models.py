@@ -1,11 +1,21 @@
 import time
 import uuid
 import os
+import json
 from database import db
 from config import DEFAULT_VIDEO_MODEL
 
 # --- SQLAlchemy Model for VideoGenerationTask ---
 class VideoGenerationTask(db.Model):
+    __table_args__ = (
+        db.Index('ix_video_task_user_created_at', 'user', 'created_at'), # /api/tasks for one user, newest first
+        db.Index('ix_video_task_created_at', 'created_at'), # /api/tasks for the admin (all users)
+        db.Index('ix_video_task_model_duration_user', 'model', 'duration_seconds', 'user'), # /api/usage group-bys (admin)
+        db.Index('ix_video_task_user_model_duration', 'user', 'model', 'duration_seconds'), # /api/usage group-bys for one user
+        db.Index('ix_video_task_status_updated_at', 'status', 'updated_at'), # Sweeps for stuck pending/processing tasks
+        db.Index('ix_video_task_user_updated_at', 'user', 'updated_at'), # History list ETag: max(updated_at) and count per user
+    )
+
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     prompt = db.Column(db.String(1024), nullable=False)
     model = db.Column(db.String(100), default=DEFAULT_VIDEO_MODEL) # New field for model
@@ -29,6 +39,27 @@ class VideoGenerationTask(db.Model):
     created_at = db.Column(db.Float, default=time.time)
     updated_at = db.Column(db.Float, default=time.time, onupdate=time.time)
     music_file_path = db.Column(db.String(1024), nullable=True, default=None) # Path to music file for composite video
+    render_peak_rss_bytes = db.Column(db.BigInteger, nullable=True) # Peak memory (backend + ffmpeg children) while rendering a composite
+    progress_frames_done = db.Column(db.Integer, nullable=True) # Composite render progress, updated while rendering
+    progress_total_frames = db.Column(db.Integer, nullable=True)
+    progress_percent = db.Column(db.Float, nullable=True)
+    progress_eta_seconds = db.Column(db.Float, nullable=True)
+    progress_render_fps = db.Column(db.Float, nullable=True) # Encoded frames per second of wall time
+    media_duration_seconds = db.Column(db.Float, nullable=True) # Technical metadata probed from the local video file
+    media_fps = db.Column(db.Float, nullable=True)
+    media_width = db.Column(db.Integer, nullable=True)
+    media_height = db.Column(db.Integer, nullable=True)
+    media_video_codec = db.Column(db.String(50), nullable=True)
+    media_audio_codec = db.Column(db.String(50), nullable=True) # None if the video has no audio stream
+    media_bitrate = db.Column(db.BigInteger, nullable=True) # bits/s
+    media_file_size = db.Column(db.BigInteger, nullable=True) # bytes
+    media_keyframe_times = db.Column(db.Text, nullable=True) # JSON list of keyframe timestamps (seconds)
+    thumbnail_variants = db.Column(db.Text, nullable=True) # JSON list of {width, height, format, path} poster variants
+    local_sprite_path = db.Column(db.String(1024), nullable=True) # Hover-scrub sprite sheet
+    local_sprite_vtt_path = db.Column(db.String(1024), nullable=True) # WebVTT index of the sprite sheet tiles
+    local_preview_path = db.Column(db.String(1024), nullable=True) # Low-bitrate 360p playback proxy
+    local_hls_manifest_path = db.Column(db.String(1024), nullable=True) # HLS master playlist (optional packaging stage)
+    hls_gcs_uri = db.Column(db.String(1024), nullable=True)
 
     def __repr__(self):
         attributes = []
@@ -72,11 +103,78 @@ class VideoGenerationTask(db.Model):
             "gcs_output_bucket": self.gcs_output_bucket,
             "user": self.user,
             "generate_audio": self.generate_audio,
-            "music_file_path": getattr(self, 'music_file_path', None) # Safely access music_file_path
+            "music_file_path": getattr(self, 'music_file_path', None), # Safely access music_file_path
+            "render_peak_rss_bytes": self.render_peak_rss_bytes,
+            "progress_frames_done": self.progress_frames_done,
+            "progress_total_frames": self.progress_total_frames,
+            "progress_percent": self.progress_percent,
+            "progress_eta_seconds": self.progress_eta_seconds,
+            "progress_render_fps": self.progress_render_fps,
+            "media_duration_seconds": self.media_duration_seconds,
+            "media_fps": self.media_fps,
+            "media_width": self.media_width,
+            "media_height": self.media_height,
+            "media_video_codec": self.media_video_codec,
+            "media_audio_codec": self.media_audio_codec,
+            "media_bitrate": self.media_bitrate,
+            "media_file_size": self.media_file_size,
+            "media_keyframe_times": json.loads(self.media_keyframe_times) if self.media_keyframe_times else None,
+            "thumbnail_variants": json.loads(self.thumbnail_variants) if self.thumbnail_variants else [],
+            "local_sprite_path": self.local_sprite_path,
+            "local_sprite_vtt_path": self.local_sprite_vtt_path,
+            "preview_url": self.local_preview_path,
+            "hls_manifest_url": self.local_hls_manifest_path,
+            "hls_gcs_uri": self.hls_gcs_uri,
+        }
+
+    # Columns the history list needs; everything else (probe details, HLS/sprite paths, render stats) is
+    # only served by the single-task endpoints. video_gcs_uri stays: the UI's selected task comes from
+    # this list and the Extend button needs it.
+    LIST_COLUMNS = (
+        'id', 'prompt', 'model', 'status', 'camera_control', 'aspect_ratio', 'duration_seconds',
+        'resolution', 'gcs_output_bucket', 'video_gcs_uri', 'local_video_path', 'local_thumbnail_path', 'image_filename',
+        'last_frame_filename', 'error_message', 'created_at', 'updated_at', 'progress_percent',
+        'media_duration_seconds', 'thumbnail_variants', 'local_preview_path', 'local_hls_manifest_path',
+    )
+
+    @classmethod
+    def list_columns(cls):
+        return [getattr(cls, name) for name in cls.LIST_COLUMNS]
+
+    @staticmethod
+    def list_row_to_dict(row):
+        """Compact serializer for a row selected with list_columns() (same keys as to_dict, fewer of them)."""
+        return {
+            "task_id": row.id,
+            "prompt": row.prompt,
+            "model": row.model,
+            "status": row.status,
+            "camera_control": row.camera_control,
+            "aspect_ratio": row.aspect_ratio,
+            "duration_seconds": row.duration_seconds,
+            "resolution": row.resolution,
+            "gcs_output_bucket": row.gcs_output_bucket,
+            "video_gcs_uri": row.video_gcs_uri,
+            "local_video_path": row.local_video_path,
+            "local_thumbnail_path": row.local_thumbnail_path,
+            "original_image_path": f"/uploads/{row.image_filename}" if row.image_filename else None,
+            "original_last_frame_path": f"/uploads/{row.last_frame_filename}" if row.last_frame_filename else None,
+            "error_message": row.error_message,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+            "progress_percent": row.progress_percent,
+            "media_duration_seconds": row.media_duration_seconds,
+            "thumbnail_variants": json.loads(row.thumbnail_variants) if row.thumbnail_variants else [],
+            "preview_url": row.local_preview_path,
+            "hls_manifest_url": row.local_hls_manifest_path,
         }
 
 # --- SQLAlchemy Model for MusicGenerationTask ---
 class MusicGenerationTask(db.Model):
+    __table_args__ = (
+        db.Index('ix_music_task_created_at', 'created_at'), # /api/music-tasks, newest first
+    )
+
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     prompt = db.Column(db.String(1024), nullable=False)
     negative_prompt = db.Column(db.String(1024), nullable=True)
@@ -84,6 +182,7 @@ class MusicGenerationTask(db.Model):
     status = db.Column(db.String(50), default="pending")  # pending, processing, completed, failed
     local_music_path = db.Column(db.String(1024), nullable=True) # Path to locally saved music file
     error_message = db.Column(db.String(1024), nullable=True)
+    user = db.Column(db.String(255), nullable=True) # Requester; None for tasks created before it was recorded
     created_at = db.Column(db.Float, default=time.time)
     updated_at = db.Column(db.Float, default=time.time, onupdate=time.time)
 
@@ -108,6 +207,95 @@ class MusicGenerationTask(db.Model):
             "local_music_path": self.local_music_path, # Relative path like /music/filename.wav
             "music_url_http": music_url,
             "error_message": self.error_message,
+            "user": self.user,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
         }
+
+# --- SQLAlchemy Model for TaskChangeLog ---
+class TaskChangeLog(db.Model):
+    """
+    Append-only log of task changes, written in the same transaction as the change itself. Row ids are
+    the event ids of /api/events; every worker process tails the log to fan changes out to its streams.
+    """
+    __table_args__ = (
+        db.Index('ix_task_change_log_user_id', 'user', 'id'), # Per-user tail after a Last-Event-ID
+        db.Index('ix_task_change_log_created_at', 'created_at'), # Retention pruning
+        {'sqlite_autoincrement': True}, # Never reuse ids of pruned rows, clients resume from them
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user = db.Column(db.String(255), nullable=True) # Owner of the task; None for music tasks created before owners were recorded
+    kind = db.Column(db.String(20), nullable=False) # video, composite, music
+    task_id = db.Column(db.String(36), nullable=False)
+    event = db.Column(db.String(20), nullable=False) # created, updated, deleted
+    status = db.Column(db.String(50), nullable=True)
+    payload = db.Column(db.Text, nullable=True) # JSON snapshot of the task (list shape for video tasks)
+    created_at = db.Column(db.Float, default=time.time)
+
+    @staticmethod
+    def row_to_dict(row):
+        """Event body for a change log row (ORM instance or Core row)."""
+        return {
+            "id": row.id,
+            "kind": row.kind,
+            "task_id": row.task_id,
+            "event": row.event,
+            "status": row.status,
+            "task": json.loads(row.payload) if row.payload else None,
+            "created_at": row.created_at,
+        }
+
+# --- SQLAlchemy Model for UsageRollup ---
+class UsageRollup(db.Model):
+    """
+    Video task counts per UTC day, user, model, duration and terminal status, kept up to date by
+    usage_rollup.py. /api/usage sums these instead of aggregating video_generation_task.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('day', 'user', 'model', 'duration_seconds', 'status', name='uq_usage_rollup_key'), # Also serves admin date ranges
+        db.Index('ix_usage_rollup_user_day', 'user', 'day'), # /api/usage for one user
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    day = db.Column(db.Date, nullable=False) # UTC day the tasks were created
+    user = db.Column(db.String(255), nullable=False, default='') # '' for tasks without a user
+    model = db.Column(db.String(100), nullable=False, default='')
+    duration_seconds = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(50), nullable=False) # completed, failed
+    video_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.Float, default=time.time, onupdate=time.time)
+
+# --- SQLAlchemy Model for TaskEvent ---
+class TaskEvent(db.Model):
+    """
+    One timed stage of a video, composite or music job (queued, gcs_upload, veo_poll, render, ...),
+    written by task_timeline.py when the stage ends. Feeds /api/tasks/<id>/timeline and the
+    per-stage latency percentiles.
+    """
+    __table_args__ = (
+        db.Index('ix_task_event_task_id_started_at', 'task_id', 'started_at'), # Timeline of one task
+        db.Index('ix_task_event_started_at', 'started_at'), # Stage percentiles over a time window
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    task_id = db.Column(db.String(36), nullable=False)
+    kind = db.Column(db.String(20), nullable=False) # video, composite, music
+    model = db.Column(db.String(100), nullable=True) # Video model; None for music tasks
+    stage = db.Column(db.String(50), nullable=False)
+    started_at = db.Column(db.Float, nullable=False)
+    duration_seconds = db.Column(db.Float, nullable=False)
+    outcome = db.Column(db.String(20), nullable=False, default="ok") # ok, failed
+    detail = db.Column(db.String(1024), nullable=True) # Error message of a failed stage
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "kind": self.kind,
+            "model": self.model,
+            "started_at": self.started_at,
+            "ended_at": self.started_at + self.duration_seconds,
+            "duration_seconds": self.duration_seconds,
+            "outcome": self.outcome,
+            "detail": self.detail,
+        }
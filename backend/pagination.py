@@ -0,0 +1,95 @@
+import base64
+import json
+import math
+import threading
+import time
+
+from sqlalchemy import and_, or_
+
+from config import PAGINATION_COUNT_CACHE_SECONDS, PAGINATION_MAX_LIMIT
+
+
+def encode_cursor(created_at, task_id):
+    """Opaque cursor for the row after which the next page starts (created_at may be None on legacy rows)."""
+    payload = json.dumps([created_at, task_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for anything that isn't one of our cursors."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, task_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return (None if created_at is None else float(created_at)), str(task_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def clamp_limit(limit, default):
+    if limit is None:
+        return default
+    return max(1, min(int(limit), PAGINATION_MAX_LIMIT))
+
+
+def keyset_page(query, model, cursor=None, limit=50):
+    """
+    Newest-first page of `query` after `cursor`, seeking on (created_at, id) so every page costs the
+    same index range scan regardless of depth (no OFFSET, no COUNT). Returns (rows, next_cursor);
+    next_cursor is None on the last page. Legacy rows without a created_at sort after all others and
+    are paged on id alone.
+    """
+    if cursor:
+        created_at, task_id = decode_cursor(cursor)
+        if created_at is None:
+            query = query.filter(model.created_at.is_(None), model.id < task_id)
+        else:
+            query = query.filter(or_(
+                model.created_at < created_at,
+                and_(model.created_at == created_at, model.id < task_id),
+                model.created_at.is_(None),
+            ))
+    rows = query.order_by(model.created_at.desc().nulls_last(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+class ApproximateCounter:
+    """
+    Per-process cache of row counts keyed by scope (e.g. a user's email), refreshed at most every
+    `max_age_seconds`. Totals shown next to paginated lists can lag by that much, which spares a
+    COUNT(*) on every page request.
+    """
+
+    def __init__(self, max_age_seconds):
+        self.max_age_seconds = max_age_seconds
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, count_query):
+        now = time.time()
+        with self._lock:
+            cached = self._counts.get(key)
+        if cached and now - cached[1] < self.max_age_seconds:
+            return cached[0]
+        count = count_query.order_by(None).count()
+        with self._lock:
+            self._counts[key] = (count, now)
+        return count
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._counts.clear()
+            else:
+                self._counts.pop(key, None)
+
+
+def total_pages(total, per_page):
+    return math.ceil(total / per_page) if total else 0
+
+
+task_counter = ApproximateCounter(PAGINATION_COUNT_CACHE_SECONDS)
+music_task_counter = ApproximateCounter(PAGINATION_COUNT_CACHE_SECONDS)
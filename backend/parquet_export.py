@@ -0,0 +1,230 @@
+"""
+Parquet export of the task history for offline analysis.
+
+Each run writes the video_generation_task and music_generation_task rows updated since the table's
+watermark as Hive-partitioned Parquet under PARQUET_EXPORT_DIR:
+
+    video_generation_task/month=2025-07/model=veo-3.0-generate-001/part-<run>.parquet
+    music_generation_task/month=2025-07/part-<run>.parquet        (music tasks have no model column)
+
+Rows are read with a server-side cursor and written one row group per batch, so memory is bounded
+by PARQUET_EXPORT_BATCH_ROWS. Runs are append-only snapshots: a task updated after it was exported
+appears again in a later part, and readers keep the row with the latest updated_at per id. Rows
+whose updated_at is NULL (written before it was tracked) are placed by created_at instead.
+
+    python parquet_export.py                 # incremental, from the stored watermarks
+    python parquet_export.py --full          # everything, ignoring (and then resetting) the watermarks
+    python parquet_export.py --since 1735689600
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import re
+import time
+import uuid
+
+from sqlalchemy import BigInteger, Boolean, Float, Integer, func, select
+
+from models import VideoGenerationTask, MusicGenerationTask
+from metrics import tracked_job
+from config import (
+    parquet_export_dir,
+    PARQUET_EXPORT_BATCH_ROWS,
+    PARQUET_EXPORT_COMPRESSION,
+    PARQUET_EXPORT_SETTLE_SECONDS,
+)
+
+EXPORTED_MODELS = (VideoGenerationTask, MusicGenerationTask)
+STATE_FILENAME = "_state.json"
+LOCK_FILENAME = "_export.lock"
+PARTITION_COLUMNS = ("model",) # In addition to month, which is derived from created_at
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+
+class ExportInProgress(Exception):
+    pass
+
+
+def _arrow_schema(table):
+    import pyarrow as pa # Only needed by exports; keeps the app importable without pyarrow
+
+    def arrow_type(column_type):
+        if isinstance(column_type, BigInteger):
+            return pa.int64()
+        if isinstance(column_type, Integer):
+            return pa.int32()
+        if isinstance(column_type, Float):
+            return pa.float64()
+        if isinstance(column_type, Boolean):
+            return pa.bool_()
+        return pa.string()
+
+    # Partition columns live in the directory names only; duplicating them in the files breaks Hive readers
+    return pa.schema([
+        pa.field(column.name, arrow_type(column.type)) for column in table.columns if column.name not in PARTITION_COLUMNS
+    ])
+
+
+def _partition_value(value):
+    """Path-safe Hive partition value."""
+    return re.sub(r'[^A-Za-z0-9._-]', '_', value) if value else "__HIVE_DEFAULT_PARTITION__"
+
+
+def _partition_path(table, row):
+    month = datetime.datetime.fromtimestamp(row["created_at"] or 0, tz=datetime.timezone.utc).strftime('%Y-%m')
+    parts = [table.name, f"month={month}"]
+    if "model" in table.columns:
+        parts.append(f"model={_partition_value(row['model'])}")
+    return os.path.join(*parts)
+
+
+def read_state():
+    path = os.path.join(parquet_export_dir, STATE_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_state(state):
+    path = os.path.join(parquet_export_dir, STATE_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def _export_lock():
+    """Exclusive across worker processes; a second export fails fast instead of queueing."""
+    with open(os.path.join(parquet_export_dir, LOCK_FILENAME), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ExportInProgress("A Parquet export is already running")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def export_table(engine, model, since, until, run_id):
+    """
+    Writes the rows of `model` with since < coalesce(updated_at, created_at, 0) <= until. Returns
+    (row count, written paths).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = model.__table__
+    schema = _arrow_schema(table)
+    changed_at = func.coalesce(table.c.updated_at, table.c.created_at, 0) # Undated rows go out once, in the first run
+    statement = select(table).where(changed_at <= until).order_by(changed_at)
+    if since is not None:
+        statement = statement.where(changed_at > since)
+
+    writers = {} # partition path -> (ParquetWriter, tmp path, final path)
+    row_count = 0
+    try:
+        with engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=PARQUET_EXPORT_BATCH_ROWS).execute(statement)
+            for batch in result.mappings().partitions():
+                by_partition = {}
+                for row in batch:
+                    by_partition.setdefault(_partition_path(table, row), []).append(row)
+                for partition, rows in by_partition.items():
+                    if partition not in writers:
+                        directory = os.path.join(parquet_export_dir, partition)
+                        os.makedirs(directory, exist_ok=True)
+                        final_path = os.path.join(directory, f"part-{run_id}.parquet")
+                        tmp_path = f"{final_path}.tmp"
+                        writers[partition] = (pq.ParquetWriter(tmp_path, schema, compression=PARQUET_EXPORT_COMPRESSION), tmp_path, final_path)
+                    columns = {name: [row[name] for row in rows] for name in schema.names}
+                    writers[partition][0].write_table(pa.Table.from_pydict(columns, schema=schema))
+                row_count += len(batch)
+    except Exception:
+        for writer, tmp_path, _ in writers.values():
+            writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+
+    written = []
+    for writer, tmp_path, final_path in writers.values():
+        writer.close()
+        os.replace(tmp_path, final_path) # Readers never see a partial file
+        written.append(os.path.relpath(final_path, parquet_export_dir))
+    return row_count, sorted(written)
+
+
+def run_export(engine, full=False, since=None):
+    """
+    Exports every table from its watermark (or `since`, or from the start with `full`) up to now minus
+    PARQUET_EXPORT_SETTLE_SECONDS, then advances the watermarks. Returns a summary per table.
+    """
+    with _export_lock():
+        state = read_state()
+        until = time.time() - PARQUET_EXPORT_SETTLE_SECONDS # Leave room for transactions still in flight
+        run_id = f"{datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}"
+        summary = {}
+        for model in EXPORTED_MODELS:
+            name = model.__table__.name
+            table_since = None if full else (since if since is not None else state.get(name, {}).get("watermark"))
+            started_at = time.time()
+            row_count, written = export_table(engine, model, table_since, until, run_id)
+            elapsed = time.time() - started_at
+            state[name] = {"watermark": until, "exported_at": time.time(), "rows": row_count, "files": written}
+            _write_state(state)
+            summary[name] = {"since": table_since, "until": until, "rows": row_count, "files": written}
+            print(f"Exported {row_count} {name} row(s) to {len(written)} Parquet file(s) in {elapsed:.1f}s "
+                  f"({row_count / max(elapsed, 1e-6):.0f} rows/s).")
+        return summary
+
+
+def schedule_export(app, full=False, since=None):
+    """Runs an export in the background; callers poll list_export_files()/read_state() for the result."""
+    def job():
+        with app.app_context():
+            from database import db
+            try:
+                run_export(db.engine, full=full, since=since)
+            except ExportInProgress as e:
+                print(str(e))
+            except Exception as e:
+                print(f"Parquet export failed: {e}")
+    return _executor.submit(tracked_job("parquet_export", None, job))
+
+
+def list_export_files():
+    files = []
+    for root, _, filenames in os.walk(parquet_export_dir):
+        for filename in filenames:
+            if filename.endswith(".parquet"):
+                path = os.path.join(root, filename)
+                files.append({"path": os.path.relpath(path, parquet_export_dir), "size": os.path.getsize(path)})
+    return sorted(files, key=lambda f: f["path"])
+
+
+def export_is_running():
+    try:
+        with _export_lock():
+            return False
+    except ExportInProgress:
+        return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export task history as partitioned Parquet.")
+    parser.add_argument('--full', action='store_true', help="Export all rows, ignoring the stored watermarks.")
+    parser.add_argument('--since', type=float, help="Export rows updated after this Unix timestamp.")
+    args = parser.parse_args()
+
+    from app import app
+    from database import db
+    with app.app_context():
+        run_export(db.engine, full=args.full, since=args.since)
@@ -0,0 +1,83 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from moviepy.config import FFMPEG_BINARY
+
+from database import db
+from models import VideoGenerationTask
+from task_timeline import TaskTimeline
+from metrics import tracked_job
+from composite_renderer import run_ffmpeg
+from config import (
+    previews_dir,
+    PREVIEW_HEIGHT,
+    PREVIEW_GOP_SECONDS,
+    PREVIEW_CRF,
+    PREVIEW_MAX_BITRATE,
+    PREVIEW_AUDIO_BITRATE,
+    PREVIEW_WORKERS,
+)
+
+_preview_executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix="previews")
+
+
+def build_preview_command(video_path, output_path):
+    """
+    ffmpeg command for a small playback proxy: PREVIEW_HEIGHT lines, capped bitrate, a keyframe every
+    PREVIEW_GOP_SECONDS so scrubbing lands quickly, and the moov atom up front (faststart) so
+    playback starts before the download completes.
+    """
+    return [
+        FFMPEG_BINARY, "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-vf", f"scale=-2:'min({PREVIEW_HEIGHT},ih)'",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(PREVIEW_CRF),
+        "-maxrate", PREVIEW_MAX_BITRATE, "-bufsize", PREVIEW_MAX_BITRATE,
+        "-force_key_frames", f"expr:gte(t,n_forced*{PREVIEW_GOP_SECONDS})",
+        "-pix_fmt", "yuv420p", "-threads", "2",
+        "-map", "0:a:0?", "-c:a", "aac", "-b:a", PREVIEW_AUDIO_BITRATE, # Optional map: silent clips have no audio stream
+        "-movflags", "+faststart",
+        output_path,
+    ]
+
+
+def generate_preview(task, video_path):
+    """Encodes the preview proxy of a task's video and stores its path on the task (caller commits)."""
+    preview_filename = f"{task.id}.mp4"
+    preview_path = os.path.join(previews_dir, preview_filename)
+    tmp_path = os.path.join(previews_dir, f"{task.id}.tmp.mp4")
+    run_ffmpeg(build_preview_command(video_path, tmp_path), tmp_path)
+    os.replace(tmp_path, preview_path)
+    task.local_preview_path = f"/previews/{preview_filename}"
+    print(f"Preview proxy for task {task.id}: {os.path.getsize(preview_path) / 1024:.0f} KB (source {os.path.getsize(video_path) / 1024:.0f} KB)")
+
+
+def _run_preview_job(app, task_id, video_path):
+    with app.app_context():
+        task = VideoGenerationTask.query.get(task_id)
+        if not task:
+            print(f"Task {task_id} not found for preview generation.")
+            return
+        try:
+            with TaskTimeline.for_task(db.engine, task).stage("preview"):
+                generate_preview(task, video_path)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Preview generation failed for task {task_id}: {e}")
+        finally:
+            db.session.remove()
+
+
+def schedule_preview(app, task_id, video_path):
+    """Queues the preview proxy encode on the background pool."""
+    return _preview_executor.submit(tracked_job("preview", None, _run_preview_job), app, task_id, video_path)
+
+
+def purge_task_preview(task_id):
+    preview_path = os.path.join(previews_dir, f"{task_id}.mp4")
+    if os.path.exists(preview_path):
+        os.remove(preview_path)
+        return True
+    return False
@@ -0,0 +1,397 @@
+"""
+On-demand profiling of single requests and background jobs.
+
+An admin switches it on per request with the `X-Profile` header:
+
+    X-Profile: request        profiles this request
+    X-Profile: job            profiles the jobs this request starts (metrics.tracked_job)
+    X-Profile: 1 (or all)     both
+
+A `profile=true` field (query string, form or JSON body) on a generation request is the task-level
+flag and is the same as `X-Profile: job`. Both are ignored for everyone but ADMIN_EMAIL.
+
+A profile samples the stack of the profiled thread every PROFILE_SAMPLE_INTERVAL_MS from a separate
+thread (sys._current_frames(), so the profiled code runs uninstrumented) and traces allocations with
+tracemalloc. It is stored in profiles_dir as:
+
+    <id>.folded       collapsed stacks, one "frame;frame;frame count" line per stack (speedscope, flamegraph.pl)
+    <id>.svg          the same stacks rendered as a flame graph, callers on top
+    <id>.memory.txt   peak traced memory and the top PROFILE_TRACEMALLOC_TOP_N allocation sites
+    <id>.json         what was profiled, for how long, and the file names above
+
+tracemalloc is process-wide and slows every thread of the worker while it runs, so a worker runs
+one profile at a time: a profile requested while another is running is skipped (and logged).
+"""
+import collections
+import contextlib
+import contextvars
+import glob
+import html
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+
+from config import (
+    ADMIN_EMAIL,
+    backend_dir,
+    profiles_dir,
+    PROFILE_SAMPLE_INTERVAL_MS,
+    PROFILE_MAX_SECONDS,
+    PROFILE_TRACEMALLOC_TOP_N,
+    PROFILE_MAX_STORED,
+)
+
+PROFILE_HEADER = 'X-Profile'
+MAX_STACK_DEPTH = 200
+PROFILE_ID_PATTERN = re.compile(r'^[0-9]{8}-[0-9]{6}-[a-z0-9_-]+-[0-9a-f]{6}$')
+JOB_PROFILE_WAIT_SECONDS = 10 # A job started by a profiled request waits for that request's profile to end
+FLAME_GRAPH_WIDTH = 1200
+FLAME_GRAPH_ROW_HEIGHT = 16
+
+# Set for the duration of a request whose jobs must be profiled: {"origin": "POST /api/...", "job_ids": [...]}
+_job_profiling = contextvars.ContextVar('job_profiling', default=None)
+_active_lock = threading.Lock() # One profile per process (tracemalloc is global)
+
+
+def _slug(label):
+    return re.sub(r'[^a-z0-9]+', '-', label.lower()).strip('-')[:40] or "profile"
+
+def new_profile_id(label):
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{_slug(label)}-{os.urandom(3).hex()}"
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(backend_dir + os.sep):
+        filename = os.path.relpath(filename, backend_dir)
+    else:
+        filename = os.path.join(*filename.split(os.sep)[-2:]) if os.sep in filename else filename
+    name = getattr(code, 'co_qualname', code.co_name) # co_qualname is Python 3.11+, the image runs 3.9
+    return f"{name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread (the caller of start()) until stop(), then writes the profile files."""
+
+    def __init__(self, label, profile_id=None, detail=None):
+        self.label = label
+        self.profile_id = profile_id or new_profile_id(label)
+        self.detail = detail
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.sampler_error = None
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started_tracemalloc = False
+        self._memory_baseline = None
+        self._started_at = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._started_at = time.time()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._memory_baseline = tracemalloc.take_snapshot()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.profile_id}", daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        try:
+            self._sample_until_stopped()
+        except Exception as e: # Logged, and recorded in the profile's metadata
+            self.sampler_error = f"{type(e).__name__}: {e}"
+            print(f"Sampler of profile {self.profile_id} stopped after {self.samples} samples: {self.sampler_error}")
+
+    def _sample_until_stopped(self):
+        interval = PROFILE_SAMPLE_INTERVAL_MS / 1000.0
+        deadline = time.time() + PROFILE_MAX_SECONDS
+        while not self._stop.wait(interval) and time.time() < deadline:
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None: # Profiled thread is gone
+                return
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            del frame
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self, error=None):
+        """Stops sampling and writes the profile. Profiling must never fail the work, so errors are only logged."""
+        self._stop.set()
+        self._sampler.join()
+        wall_seconds = time.time() - self._started_at
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+        try:
+            self._write(wall_seconds, snapshot, current_bytes, peak_bytes, error)
+            prune_profiles()
+            print(f"Profile {self.profile_id} ({self.label}, {wall_seconds:.2f}s, {self.samples} samples) written to {profiles_dir}")
+        except Exception as e:
+            print(f"Could not write profile {self.profile_id}: {e}")
+
+    def _write(self, wall_seconds, snapshot, current_bytes, peak_bytes, error):
+        base = os.path.join(profiles_dir, self.profile_id)
+        files = {
+            "folded": f"{self.profile_id}.folded",
+            "flame_graph": f"{self.profile_id}.svg",
+            "memory": f"{self.profile_id}.memory.txt",
+        }
+        with open(f"{base}.folded", "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        with open(f"{base}.svg", "w") as f:
+            f.write(render_flame_graph(self.stacks, f"{self.label} ({wall_seconds:.2f}s, {self.samples} samples)"))
+        with open(f"{base}.memory.txt", "w") as f:
+            f.write(memory_report(snapshot, self._memory_baseline, current_bytes, peak_bytes))
+        meta = {
+            "id": self.profile_id,
+            "label": self.label,
+            "detail": self.detail,
+            "started_at": self._started_at,
+            "wall_seconds": round(wall_seconds, 3),
+            "samples": self.samples,
+            "sample_interval_ms": PROFILE_SAMPLE_INTERVAL_MS,
+            "peak_traced_bytes": peak_bytes,
+            "error": error,
+            "sampler_error": self.sampler_error,
+            "files": files,
+        }
+        # The metadata file is what list_profiles() looks for, so it goes last and atomically
+        with open(f"{base}.json.tmp", "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(f"{base}.json.tmp", f"{base}.json")
+
+
+@contextlib.contextmanager
+def profile_block(label, profile_id=None, detail=None, wait_seconds=0):
+    """Profiles the block on the current thread, unless this process is running another profile (after `wait_seconds`)."""
+    acquired = _active_lock.acquire(timeout=wait_seconds) if wait_seconds else _active_lock.acquire(blocking=False)
+    if not acquired:
+        print(f"Skipping profile of {label}: another profile is running in this process")
+        yield None
+        return
+    try:
+        profiler = SamplingProfiler(label, profile_id=profile_id, detail=detail)
+        profiler.start()
+        try:
+            yield profiler
+        except BaseException as e:
+            profiler.stop(error=f"{type(e).__name__}: {e}")
+            raise
+        profiler.stop()
+    finally:
+        _active_lock.release()
+
+
+def profiled_job(label, target):
+    """
+    Wraps a thread or executor target so it runs under a profile if the request current *now* asked for
+    its jobs to be profiled; otherwise returns `target` unchanged. The profile id is reported to the
+    request (X-Profile-Job-Ids response header) before the job starts.
+    """
+    requested = _job_profiling.get()
+    if requested is None:
+        return target
+    profile_id = new_profile_id(label)
+    requested["job_ids"].append(profile_id)
+
+    def run(*args, **kwargs):
+        # Leave out the Flask app every job receives first
+        detail = {"started_by": requested["origin"], "args": [repr(arg)[:200] for arg in args if not hasattr(arg, 'app_context')]}
+        with profile_block(label, profile_id=profile_id, detail=detail, wait_seconds=JOB_PROFILE_WAIT_SECONDS):
+            return target(*args, **kwargs)
+    return run
+
+
+# --- Reports ---
+
+def memory_report(snapshot, baseline, current_bytes, peak_bytes):
+    """Allocation sites that grew most since the profile started, plus current and peak traced memory."""
+    ignored = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__), # The sampler's own stack labels
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    )
+    differences = snapshot.filter_traces(ignored).compare_to(baseline.filter_traces(ignored), 'lineno')
+    lines = [
+        f"Traced memory at end: {current_bytes / 1024:.1f} KiB, peak: {peak_bytes / 1024:.1f} KiB",
+        "(peak covers every thread of the process while the profile ran)",
+        "",
+        f"Top {PROFILE_TRACEMALLOC_TOP_N} allocation sites by growth since the profile started:",
+    ]
+    for rank, stat in enumerate(differences[:PROFILE_TRACEMALLOC_TOP_N], start=1):
+        frame = stat.traceback[0]
+        lines.append(f"#{rank}: {frame.filename}:{frame.lineno}: {stat.size_diff / 1024:+.1f} KiB "
+                     f"({stat.size / 1024:.1f} KiB in {stat.count} blocks, {stat.count_diff:+d})")
+    return "\n".join(lines) + "\n"
+
+
+def _flame_color(name):
+    hue = zlib.crc32(name.encode("utf-8"))
+    return f"rgb({205 + hue % 50},{80 + (hue >> 8) % 120},{(hue >> 16) % 60})"
+
+def render_flame_graph(stacks, title):
+    """An SVG flame graph (icicle layout: outermost frame on top) of collapsed stacks."""
+    total = sum(stacks.values())
+    root = {"count": 0, "children": {}}
+    for stack, count in stacks.items():
+        node = root
+        node["count"] += count
+        for name in stack:
+            node = node["children"].setdefault(name, {"count": 0, "children": {}})
+            node["count"] += count
+
+    rects = []
+    max_depth = 0
+    scale = FLAME_GRAPH_WIDTH / total if total else 0
+
+    def layout(node, x, depth):
+        nonlocal max_depth
+        for name, child in sorted(node["children"].items()):
+            width = child["count"] * scale
+            if width >= 0.5:
+                max_depth = max(max_depth, depth)
+                rects.append((name, child["count"], x, depth, width))
+                layout(child, x, depth + 1)
+            x += width
+
+    layout(root, 0.0, 0)
+    header = 24
+    height = header + (max_depth + 1) * FLAME_GRAPH_ROW_HEIGHT + 4
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAME_GRAPH_WIDTH}" height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="4" y="16" font-size="13">{html.escape(title)}</text>',
+    ]
+    for name, count, x, depth, width in rects:
+        y = header + depth * FLAME_GRAPH_ROW_HEIGHT
+        tooltip = html.escape(f"{name}: {count} samples ({100.0 * count / total:.1f}%)")
+        parts.append(f'<g><title>{tooltip}</title><rect x="{x:.1f}" y="{y}" width="{width:.1f}" '
+                     f'height="{FLAME_GRAPH_ROW_HEIGHT - 1}" fill="{_flame_color(name)}"/>')
+        visible_chars = int((width - 6) / 7)
+        if visible_chars >= 3:
+            text = name if len(name) <= visible_chars else name[:visible_chars - 2] + ".."
+            parts.append(f'<text x="{x + 3:.1f}" y="{y + 11}">{html.escape(text)}</text>')
+        parts.append('</g>')
+    parts.append('</svg>')
+    return "\n".join(parts) + "\n"
+
+
+# --- Stored profiles ---
+
+def list_profiles():
+    """Metadata of the stored profiles, newest first."""
+    profiles = []
+    for path in glob.glob(os.path.join(profiles_dir, "*.json")):
+        try:
+            with open(path) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Could not read profile metadata {path}: {e}")
+    profiles.sort(key=lambda meta: meta.get("started_at") or 0, reverse=True)
+    return profiles
+
+def is_profile_file(filename):
+    """Whether `filename` is one of the files a profile writes (download allow-list)."""
+    for suffix in (".folded", ".svg", ".memory.txt", ".json"):
+        if filename.endswith(suffix):
+            return bool(PROFILE_ID_PATTERN.match(filename[:-len(suffix)]))
+    return False
+
+def prune_profiles():
+    """Deletes the oldest profiles beyond PROFILE_MAX_STORED."""
+    for meta in list_profiles()[PROFILE_MAX_STORED:]:
+        profile_id = meta.get("id", "")
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            continue
+        for suffix in (".folded", ".svg", ".memory.txt", ".json"):
+            try:
+                os.remove(os.path.join(profiles_dir, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+# --- Flask ---
+
+def _truthy(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "on", "all")
+
+def _requested_modes(request):
+    """Which of 'request' and 'job' the current request asks to profile."""
+    modes = set()
+    for mode in (request.headers.get(PROFILE_HEADER) or "").lower().split(','):
+        mode = mode.strip()
+        if mode in ("request", "job"):
+            modes.add(mode)
+        elif mode and _truthy(mode):
+            modes.update(("request", "job"))
+    flag = request.values.get('profile')
+    if flag is None and request.is_json:
+        body = request.get_json(silent=True) # Cached, the view reads the same parsed body
+        flag = body.get('profile') if isinstance(body, dict) else None
+    if flag is not None and _truthy(flag):
+        modes.add("job")
+    return modes
+
+
+def init_app(app):
+    """Starts the profiles an admin asked for at the start of a request; the request profile ends at teardown."""
+    from flask import g, request
+    from utils import get_processed_user_email_from_header
+
+    @app.before_request
+    def _start_profiles():
+        if get_processed_user_email_from_header() != ADMIN_EMAIL:
+            return
+        modes = _requested_modes(request)
+        if not modes:
+            return
+        origin = f"{request.method} {request.path}"
+        if "job" in modes:
+            g.profile_jobs = {"origin": origin, "job_ids": []}
+            g.profile_jobs_token = _job_profiling.set(g.profile_jobs)
+        if "request" in modes:
+            block = profile_block(f"request {request.url_rule.rule if request.url_rule else 'unmatched'}", detail={"request": origin})
+            profiler = block.__enter__()
+            g.profile_block = block
+            g.profile_id = profiler.profile_id if profiler is not None else None
+
+    @app.after_request
+    def _tag_response(response):
+        if g.get('profile_id'):
+            response.headers['X-Profile-Id'] = g.profile_id
+        jobs = g.get('profile_jobs')
+        if jobs and jobs["job_ids"]:
+            response.headers['X-Profile-Job-Ids'] = ",".join(jobs["job_ids"])
+        return response
+
+    @app.teardown_request
+    def _stop_profiles(exception):
+        token = g.pop('profile_jobs_token', None)
+        if token is not None:
+            try:
+                _job_profiling.reset(token)
+            except ValueError: # Torn down from another context (streamed responses)
+                pass
+        block = g.pop('profile_block', None)
+        if block is not None:
+            if exception is not None:
+                block.__exit__(type(exception), exception, exception.__traceback__)
+            else:
+                block.__exit__(None, None, None)
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import proglog
+from sqlalchemy import update
+
+from models import VideoGenerationTask
+from task_events import record_progress_change
+from metrics import record_composite_render
+from config import COMPOSITE_PROGRESS_INTERVAL_SECONDS
+
+
+class CompositeProgressReporter:
+    """
+    Collects frame counts from one or more concurrent encoders of a composite render and writes
+    frames done, percent, ETA and render fps to the task row at most every `min_interval_seconds`.
+    Frames that were not encoded (segments reused from the segment cache, see skip()) count towards
+    frames done and percent, but not towards the render fps the ETA is extrapolated from.
+
+    Writes go through the engine directly (not the scoped session) so the reporter can be fed from
+    ffmpeg progress readers running in worker threads; each write appends its own task change event.
+    """
+
+    def __init__(self, engine, task_id, total_frames, min_interval_seconds=COMPOSITE_PROGRESS_INTERVAL_SECONDS):
+        self.engine = engine
+        self.task_id = task_id
+        self.total_frames = max(1, int(total_frames))
+        self.min_interval_seconds = min_interval_seconds
+        self._frames_by_stream = {}
+        self._frames_skipped = {}
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._last_write_at = 0.0
+
+    def reset(self, total_frames=None):
+        """Starts over, e.g. when falling back to another render engine."""
+        with self._lock:
+            self._frames_by_stream = {}
+            self._frames_skipped = {}
+            self._started_at = time.time()
+            if total_frames:
+                self.total_frames = max(1, int(total_frames))
+        self._write(force=True)
+
+    def update(self, stream_key, frames_done):
+        """Records the frames encoded so far by one encoder (`stream_key` identifies the encoder)."""
+        with self._lock:
+            self._frames_by_stream[stream_key] = frames_done
+        self._write()
+
+    def skip(self, stream_key, frames):
+        """Records frames that are done without being encoded (a segment taken from the segment cache)."""
+        with self._lock:
+            self._frames_skipped[stream_key] = frames
+        self._write()
+
+    def finish(self):
+        with self._lock:
+            skipped = min(sum(self._frames_skipped.values()), self.total_frames)
+            self._frames_by_stream = {"done": self.total_frames - skipped}
+            elapsed = time.time() - self._started_at
+        record_composite_render(self.total_frames - skipped, elapsed)
+        self._write(force=True)
+
+    def snapshot(self):
+        with self._lock:
+            frames_skipped = sum(self._frames_skipped.values())
+            frames_encoded = sum(self._frames_by_stream.values())
+            elapsed = max(time.time() - self._started_at, 1e-6)
+        frames_done = min(frames_encoded + frames_skipped, self.total_frames)
+        render_fps = frames_encoded / elapsed
+        remaining = self.total_frames - frames_done
+        eta_seconds = remaining / render_fps if render_fps > 0 else None
+        return {
+            "progress_frames_done": frames_done,
+            "progress_total_frames": self.total_frames,
+            "progress_percent": round(100.0 * frames_done / self.total_frames, 1),
+            "progress_eta_seconds": round(eta_seconds, 1) if eta_seconds is not None else None,
+            "progress_render_fps": round(render_fps, 2),
+        }
+
+    def _write(self, force=False):
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_write_at < self.min_interval_seconds:
+                return
+            self._last_write_at = now
+        values = self.snapshot()
+        values["updated_at"] = now
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(
+                    update(VideoGenerationTask.__table__)
+                    .where(VideoGenerationTask.__table__.c.id == self.task_id)
+                    .values(**values)
+                )
+                record_progress_change(connection, self.task_id)
+        except Exception as e: # Progress is best effort and must never fail the render
+            print(f"Could not record render progress for task {self.task_id}: {e}")
+
+
+class MoviepyProgressLogger(proglog.ProgressBarLogger):
+    """proglog logger for write_videofile that forwards the frame bar to a CompositeProgressReporter."""
+
+    def __init__(self, reporter, stream_key="moviepy"):
+        super().__init__()
+        self.reporter = reporter
+        self.stream_key = stream_key
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar == "frame_index" and attr == "index" and value is not None and value >= 0:
+            self.reporter.update(self.stream_key, value)
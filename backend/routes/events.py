@@ -0,0 +1,29 @@
+from flask import Blueprint, Response, request, jsonify
+from database import db
+from config import ADMIN_EMAIL
+from utils import get_processed_user_email_from_header
+from task_events import event_stream
+
+events_bp = Blueprint('events_bp', __name__)
+
+@events_bp.route('/api/events', methods=['GET'])
+def task_events_route():
+    """
+    Server-Sent Events stream of the current user's task changes (the admin gets everyone's): status
+    transitions, render progress and completion of video, composite and music tasks. Resumes after
+    the `Last-Event-ID` header (or `lastEventId` parameter) and sends a heartbeat comment when idle.
+    """
+    current_user_email = get_processed_user_email_from_header()
+    is_admin = current_user_email == ADMIN_EMAIL
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    try:
+        last_event_id = int(last_event_id) if last_event_id not in (None, '') else None
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID must be an event id"}), 400
+
+    stream = event_stream(db.engine, None if is_admin else current_user_email, last_event_id)
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # Let nginx pass events through as they are written
+    })
@@ -0,0 +1,49 @@
+from flask import Blueprint, current_app, request, jsonify, send_from_directory
+from config import ADMIN_EMAIL, parquet_export_dir
+from utils import get_processed_user_email_from_header
+from parquet_export import export_is_running, list_export_files, read_state, schedule_export
+
+exports_bp = Blueprint('exports_bp', __name__)
+
+def _forbidden_unless_admin():
+    if get_processed_user_email_from_header() != ADMIN_EMAIL:
+        return jsonify({"error": "Admin only"}), 403
+    return None
+
+@exports_bp.route('/api/exports/parquet', methods=['GET', 'POST'])
+def parquet_exports_route():
+    """
+    GET: export watermarks, whether an export is running and the Parquet files written so far.
+    POST: starts an export in the background; body `{"full": true}` or `{"since": <updated_at>}`
+    overrides the incremental watermark.
+    """
+    forbidden = _forbidden_unless_admin()
+    if forbidden:
+        return forbidden
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        since = data.get('since')
+        try:
+            since = float(since) if since is not None else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "'since' must be an updated_at timestamp"}), 400
+        if export_is_running():
+            return jsonify({"error": "A Parquet export is already running"}), 409
+        schedule_export(current_app._get_current_object(), full=bool(data.get('full')), since=since)
+        return jsonify({"message": "Parquet export started"}), 202
+
+    return jsonify({
+        "running": export_is_running(),
+        "state": read_state(),
+        "files": list_export_files(),
+    }), 200
+
+@exports_bp.route('/api/exports/parquet/<path:filename>', methods=['GET'])
+def download_parquet_export(filename):
+    forbidden = _forbidden_unless_admin()
+    if forbidden:
+        return forbidden
+    if not filename.endswith('.parquet'):
+        return jsonify({"error": "Not found"}), 404
+    return send_from_directory(parquet_export_dir, filename, as_attachment=True)
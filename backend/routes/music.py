@@ -6,12 +6,14 @@ from werkzeug.utils import secure_filename
 from database import db
 from models import MusicGenerationTask
 from tasks import _run_music_generation
+from metrics import tracked_job
 from config import (
     user_uploaded_music_dir,
     generated_music_dir,
     MAX_MUSIC_FILE_SIZE,
 )
-from utils import allowed_music_file
+from utils import allowed_music_file, parse_status_batch_args, get_processed_user_email_from_header
+from pagination import clamp_limit, keyset_page, music_task_counter
 from clients import lyria_client
 
 music_bp = Blueprint('music_bp', __name__)
@@ -74,16 +76,33 @@ def generate_music_route():
         prompt=prompt_text,
         negative_prompt=negative_prompt,
         seed=seed,
-        status="pending"
+        status="pending",
+        user=get_processed_user_email_from_header()
     )
     db.session.add(new_task)
     db.session.commit()
     
-    thread = threading.Thread(target=_run_music_generation, args=(current_app._get_current_object(), new_task.id))
+    thread = threading.Thread(target=tracked_job("music", None, _run_music_generation), args=(current_app._get_current_object(), new_task.id))
     thread.start()
     
     return jsonify({"message": "Music generation started", "task_id": new_task.id}), 202
 
+@music_bp.route('/api/music-task-status', methods=['GET'])
+def batch_music_task_status_route():
+    """Batched music status poll; same contract as /api/task-status?ids=...&since=..."""
+    try:
+        ids, since = parse_status_batch_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = MusicGenerationTask.query.filter(MusicGenerationTask.id.in_(ids))
+    if since is not None:
+        query = query.filter(MusicGenerationTask.updated_at > since)
+    tasks = query.all()
+
+    watermark = max([task.updated_at for task in tasks if task.updated_at is not None] + [since or 0.0])
+    return jsonify({"tasks": [task.to_dict() for task in tasks], "watermark": watermark}), 200
+
 @music_bp.route('/api/music-task-status/<task_id>', methods=['GET'])
 def music_task_status_route(task_id):
     task = MusicGenerationTask.query.get(task_id)
@@ -93,8 +112,20 @@ def music_task_status_route(task_id):
 
 @music_bp.route('/api/music-tasks', methods=['GET'])
 def get_music_tasks_route():
-    tasks = MusicGenerationTask.query.order_by(MusicGenerationTask.created_at.desc()).limit(50).all()
-    return jsonify([task.to_dict() for task in tasks]), 200
+    # Without cursor/limit this keeps returning a bare list of the 50 newest tasks
+    if 'cursor' not in request.args and 'limit' not in request.args:
+        tasks = MusicGenerationTask.query.order_by(MusicGenerationTask.created_at.desc(), MusicGenerationTask.id.desc()).limit(50).all()
+        return jsonify([task.to_dict() for task in tasks]), 200
+
+    limit = clamp_limit(request.args.get('limit', type=int), 50)
+    try:
+        tasks, next_cursor = keyset_page(MusicGenerationTask.query, MusicGenerationTask, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = {"tasks": [task.to_dict() for task in tasks], "next_cursor": next_cursor}
+    if request.args.get('include_total', 'false').lower() == 'true':
+        response["approximate_total"] = music_task_counter.get("__all__", MusicGenerationTask.query)
+    return jsonify(response), 200
 
 @music_bp.route('/api/music/<filename>')
 def serve_music(filename):
@@ -124,6 +155,7 @@ def delete_music_task_route(task_id):
         
         db.session.delete(task)
         db.session.commit()
+        music_task_counter.invalidate()
         return jsonify({"message": "Music task and associated file deleted successfully"}), 200
     except Exception as e:
         db.session.rollback()
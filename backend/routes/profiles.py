@@ -0,0 +1,29 @@
+from flask import Blueprint, jsonify, send_from_directory
+from config import ADMIN_EMAIL, profiles_dir
+from utils import get_processed_user_email_from_header
+from profiling import is_profile_file, list_profiles
+
+profiles_bp = Blueprint('profiles_bp', __name__)
+
+def _forbidden_unless_admin():
+    if get_processed_user_email_from_header() != ADMIN_EMAIL:
+        return jsonify({"error": "Admin only"}), 403
+    return None
+
+@profiles_bp.route('/api/profiles', methods=['GET'])
+def list_profiles_route():
+    """Stored request and job profiles, newest first (see profiling.py for how to record one)."""
+    forbidden = _forbidden_unless_admin()
+    if forbidden:
+        return forbidden
+    return jsonify({"profiles": list_profiles()}), 200
+
+@profiles_bp.route('/api/profiles/<path:filename>', methods=['GET'])
+def download_profile(filename):
+    """One profile file: <id>.svg (flame graph), <id>.folded, <id>.memory.txt or <id>.json."""
+    forbidden = _forbidden_unless_admin()
+    if forbidden:
+        return forbidden
+    if not is_profile_file(filename):
+        return jsonify({"error": "Not found"}), 404
+    return send_from_directory(profiles_dir, filename, as_attachment=True)
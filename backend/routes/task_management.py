@@ -1,13 +1,39 @@
 import os
 import time
-from flask import Blueprint, request, jsonify
+import hashlib
+from flask import Blueprint, Response, request, jsonify
+from sqlalchemy import func, select
 from database import db
-from models import VideoGenerationTask
-from config import ADMIN_EMAIL, videos_dir, thumbnails_dir, uploads_dir
-from utils import get_processed_user_email_from_header
+from models import VideoGenerationTask, TaskChangeLog
+from config import ADMIN_EMAIL, videos_dir, uploads_dir
+from utils import get_processed_user_email_from_header, parse_status_batch_args
+from segment_cache import segment_cache
+from thumbnail_engine import purge_task_thumbnails
+from preview_proxy import purge_task_preview
+from hls_packager import purge_task_hls
+from pagination import clamp_limit, keyset_page, task_counter, total_pages
 
 task_management_bp = Blueprint('task_management_bp', __name__)
 
+@task_management_bp.route('/api/task-status', methods=['GET'])
+def batch_task_status_route():
+    """
+    Batched status poll: `ids=a,b,c&since=<updated_at>` returns only the listed tasks updated after
+    the watermark, in one primary-key lookup. Clients pass the returned `watermark` back as `since`.
+    """
+    try:
+        ids, since = parse_status_batch_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = VideoGenerationTask.query.filter(VideoGenerationTask.id.in_(ids))
+    if since is not None:
+        query = query.filter(VideoGenerationTask.updated_at > since)
+    tasks = query.all()
+
+    watermark = max([task.updated_at for task in tasks if task.updated_at is not None] + [since or 0.0])
+    return jsonify({"tasks": [task.to_dict() for task in tasks], "watermark": watermark}), 200
+
 @task_management_bp.route('/api/task-status/<task_id>', methods=['GET', 'POST'])
 def task_status_route(task_id):
     task = VideoGenerationTask.query.get(task_id)
@@ -26,28 +52,90 @@ def task_status_route(task_id):
 
     return jsonify(task.to_dict()), 200
 
+def _history_validator(user_email):
+    """
+    (max updated_at, latest change log id) of the tasks a user can list: two index lookups, on
+    (user, updated_at) and on the change log's (user, id). Inserts and updates move updated_at;
+    deletes leave it alone but always append a change log row. None means every user (admin).
+    """
+    tasks = VideoGenerationTask.__table__
+    change_log = TaskChangeLog.__table__
+    latest_update = select(func.max(tasks.c.updated_at))
+    latest_change = select(func.max(change_log.c.id))
+    if user_email is not None:
+        latest_update = latest_update.where(tasks.c.user == user_email)
+        latest_change = latest_change.where(change_log.c.user == user_email)
+    with db.engine.connect() as connection:
+        return connection.execute(latest_update).scalar(), connection.execute(latest_change).scalar()
+
 @task_management_bp.route('/api/tasks', methods=['GET'])
 def get_tasks_route():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 100, type=int)
+    """
+    Newest-first task list. Two modes:
+    - cursor mode (`cursor` and/or `limit` given): keyset pagination on (created_at, id), returns
+      `next_cursor`; `include_total=true` adds the total.
+    - page mode (`page`/`per_page`, used by the history sidebar): `tasks`, `total_pages`, `current_page`.
+
+    Rows are selected column-projected and serialized compactly (`view=full` returns full to_dict()
+    rows). Responses carry an ETag derived from the user's max updated_at, latest change log id and
+    cached task count, so an unchanged poll is answered 304 after two index lookups and no COUNT(*)
+    (the count comes from the per-process task_counter, refreshed every PAGINATION_COUNT_CACHE_SECONDS).
+    """
     current_user_email = get_processed_user_email_from_header()
+    is_admin = current_user_email == ADMIN_EMAIL
+    full_view = request.args.get('view') == 'full'
+
+    count_query = VideoGenerationTask.query
+    if not is_admin:
+        count_query = count_query.filter(VideoGenerationTask.user == current_user_email)
+    max_updated_at, latest_change_id = _history_validator(None if is_admin else current_user_email)
+    # Part of the ETag too, so a total that lagged behind an insert or delete is sent once it refreshes
+    task_count = task_counter.get("__all__" if is_admin else current_user_email, count_query)
+    etag = hashlib.sha1(
+        f"{current_user_email}|{max_updated_at!r}|{latest_change_id}|{task_count}|{sorted(request.args.items(multi=True))}".encode("utf-8")
+    ).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
-    if current_user_email == ADMIN_EMAIL:
+    query = VideoGenerationTask.query if full_view else db.session.query(*VideoGenerationTask.list_columns())
+    if is_admin:
         print(f"Admin user {ADMIN_EMAIL} requesting all tasks.")
-        query = VideoGenerationTask.query.order_by(VideoGenerationTask.created_at.desc())
     else:
         print(f"User {current_user_email} requesting their tasks.")
-        query = VideoGenerationTask.query.filter_by(user=current_user_email).order_by(VideoGenerationTask.created_at.desc())
-    
-    paginated_tasks = query.paginate(page=page, per_page=per_page, error_out=False)
-    tasks = paginated_tasks.items
-    total_pages = paginated_tasks.pages
-
-    return jsonify({
-        "tasks": [task.to_dict() for task in tasks],
-        "total_pages": total_pages,
-        "current_page": page
-    }), 200
+        query = query.filter(VideoGenerationTask.user == current_user_email)
+    serialize = (lambda task: task.to_dict()) if full_view else VideoGenerationTask.list_row_to_dict
+
+    if 'cursor' in request.args or 'limit' in request.args:
+        limit = clamp_limit(request.args.get('limit', type=int), 50)
+        try:
+            tasks, next_cursor = keyset_page(query, VideoGenerationTask, request.args.get('cursor'), limit)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        body = {"tasks": [serialize(task) for task in tasks], "next_cursor": next_cursor}
+        if request.args.get('include_total', 'false').lower() == 'true':
+            body["approximate_total"] = task_count
+    else:
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = clamp_limit(request.args.get('per_page', type=int), 100)
+        tasks = (
+            query.order_by(VideoGenerationTask.created_at.desc(), VideoGenerationTask.id.desc())
+            .offset((page - 1) * per_page)
+            .limit(per_page)
+            .all()
+        )
+        body = {
+            "tasks": [serialize(task) for task in tasks],
+            "total_pages": total_pages(task_count, per_page),
+            "current_page": page
+        }
+
+    response = jsonify(body)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache' # Browsers revalidate with If-None-Match on every poll
+    return response
 
 @task_management_bp.route('/api/task/<task_id>', methods=['DELETE'])
 def delete_task_route(task_id):
@@ -67,15 +155,14 @@ def delete_task_route(task_id):
             else:
                 print(f"Local video file not found for deletion: {video_file_to_delete}")
         
-        if task.local_thumbnail_path:
-            # local_thumbnail_path is stored as "/thumbnails/filename.jpg"
-            # thumbnails_dir now points to backend/data/thumbnails
-            thumbnail_file_to_delete = os.path.join(thumbnails_dir, os.path.basename(task.local_thumbnail_path))
-            if os.path.exists(thumbnail_file_to_delete):
-                os.remove(thumbnail_file_to_delete)
-                print(f"Deleted local thumbnail file: {thumbnail_file_to_delete}")
-            else:
-                print(f"Local thumbnail file not found for deletion: {thumbnail_file_to_delete}")
+        if purge_task_preview(task.id):
+            print(f"Deleted preview proxy of task {task_id}")
+        if purge_task_hls(task.id):
+            print(f"Deleted HLS package of task {task_id}")
+
+        purged_thumbnails = purge_task_thumbnails(task.id) # Poster, size variants and sprite sheet
+        if purged_thumbnails:
+            print(f"Deleted {purged_thumbnails} local thumbnail file(s) of task {task_id}")
         
         if task.image_filename:
             image_file_to_delete = os.path.join(uploads_dir, task.image_filename)
@@ -93,8 +180,15 @@ def delete_task_route(task_id):
             else:
                 print(f"Uploaded last frame image file not found for deletion: {last_frame_file_to_delete}")
 
+        purged_segments = segment_cache.purge_source(task.id)
+        if purged_segments:
+            print(f"Purged {purged_segments} cached composite segment(s) cut from task {task_id}")
+
+        task_user = task.user
         db.session.delete(task)
         db.session.commit()
+        task_counter.invalidate(task_user)
+        task_counter.invalidate("__all__")
         return jsonify({"message": "Task and associated files deleted successfully"}), 200
     except Exception as e:
         db.session.rollback() # Rollback in case of error during file deletion or db operation
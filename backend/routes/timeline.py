@@ -0,0 +1,52 @@
+import time
+from flask import Blueprint, request, jsonify
+from database import db
+from models import VideoGenerationTask, MusicGenerationTask
+from config import ADMIN_EMAIL
+from utils import get_processed_user_email_from_header
+from task_timeline import task_timeline, stage_percentiles
+
+timeline_bp = Blueprint('timeline_bp', __name__)
+
+STAGE_STATS_DEFAULT_DAYS = 7
+
+@timeline_bp.route('/api/tasks/<task_id>/timeline', methods=['GET'])
+def task_timeline_route(task_id):
+    """Timed stages of a video, composite or music task, in the order they started."""
+    current_user_email = get_processed_user_email_from_header()
+    task = VideoGenerationTask.query.get(task_id) or MusicGenerationTask.query.get(task_id)
+    if not task:
+        return jsonify({"error": "Task not found"}), 404
+    owner = getattr(task, 'user', None)
+    if owner and owner != current_user_email and current_user_email != ADMIN_EMAIL:
+        return jsonify({"error": "Task not found"}), 404
+
+    stages = task_timeline(task_id)
+    return jsonify({
+        "task_id": task_id,
+        "status": task.status,
+        "stages": stages,
+        "total_seconds": round(sum(stage["duration_seconds"] for stage in stages), 3),
+    }), 200
+
+@timeline_bp.route('/api/tasks/stage-latency', methods=['GET'])
+def stage_latency_route():
+    """
+    Admin only: p50/p90/p99 stage durations per kind, model and stage over the last `days` days
+    (default 7), optionally for one `kind` (video, composite, music).
+    """
+    if get_processed_user_email_from_header() != ADMIN_EMAIL:
+        return jsonify({"error": "Admin only"}), 403
+    try:
+        days = float(request.args.get('days', STAGE_STATS_DEFAULT_DAYS))
+    except ValueError:
+        return jsonify({"error": "'days' must be a number"}), 400
+    if days <= 0:
+        return jsonify({"error": "'days' must be positive"}), 400
+
+    since = time.time() - days * 24 * 3600
+    return jsonify({
+        "since": since,
+        "days": days,
+        "stages": stage_percentiles(db.engine, since, kind=request.args.get('kind')),
+    }), 200
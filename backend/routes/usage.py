@@ -1,89 +1,109 @@
-from flask import Blueprint, jsonify, Response
+from flask import Blueprint, jsonify, request, Response
 from sqlalchemy import func
-import io
-import csv
 import datetime
 from database import db
-from models import VideoGenerationTask
+from models import UsageRollup
+from usage_rollup import usage_query
+from usage_export import EXPORT_FORMATS, parse_export_filters, stream_export
 from utils import get_processed_user_email_from_header
 from config import ADMIN_EMAIL
 
 usage_bp = Blueprint('usage_bp', __name__)
 
+def _parse_day(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a YYYY-MM-DD date")
+
 @usage_bp.route('/api/usage', methods=['GET'])
 def get_usage_data():
+    """
+    Usage totals from the daily rollups (tasks that completed or failed), optionally limited to the
+    UTC days `start`..`end` (inclusive, YYYY-MM-DD).
+    """
     current_user_email = get_processed_user_email_from_header()
     is_admin = current_user_email == ADMIN_EMAIL
 
-    query_base = VideoGenerationTask.query
-    if not is_admin:
-        query_base = query_base.filter(VideoGenerationTask.user == current_user_email)
+    try:
+        start_day = _parse_day(request.args.get('start'), 'start')
+        end_day = _parse_day(request.args.get('end'), 'end')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query_base = usage_query(None if is_admin else current_user_email, start_day, end_day)
 
-    total_videos = query_base.count()
-    total_seconds = query_base.with_entities(func.sum(VideoGenerationTask.duration_seconds)).scalar()
+    total_videos, total_seconds = query_base.with_entities(
+        func.sum(UsageRollup.video_count),
+        func.sum(UsageRollup.video_count * UsageRollup.duration_seconds)
+    ).one()
 
     videos_by_model = query_base.with_entities(
-        VideoGenerationTask.model,
-        func.count(VideoGenerationTask.id)
-    ).group_by(VideoGenerationTask.model).all()
+        UsageRollup.model,
+        func.sum(UsageRollup.video_count)
+    ).group_by(UsageRollup.model).all()
 
     videos_by_length = query_base.with_entities(
-        VideoGenerationTask.duration_seconds,
-        func.count(VideoGenerationTask.id)
-    ).group_by(VideoGenerationTask.duration_seconds).all()
+        UsageRollup.duration_seconds,
+        func.sum(UsageRollup.video_count)
+    ).group_by(UsageRollup.duration_seconds).all()
+
+    videos_by_day = query_base.with_entities(
+        UsageRollup.day,
+        func.sum(UsageRollup.video_count)
+    ).group_by(UsageRollup.day).order_by(UsageRollup.day).all()
 
     response = {
         "total_videos": total_videos or 0,
         "total_seconds": total_seconds or 0,
         "videos_by_model": [{"model": model, "count": count} for model, count in videos_by_model],
         "videos_by_length": [{"length": length, "count": count} for length, count in videos_by_length],
+        "videos_by_day": [{"day": day.isoformat(), "count": count} for day, count in videos_by_day],
+        "start": start_day.isoformat() if start_day else None,
+        "end": end_day.isoformat() if end_day else None,
         "is_admin": is_admin
     }
 
     if is_admin:
-        videos_by_user = db.session.query(
-            VideoGenerationTask.user,
-            func.count(VideoGenerationTask.id)
-        ).group_by(VideoGenerationTask.user).all()
-        response["videos_by_user"] = [{"user": user, "count": count} for user, count in videos_by_user]
+        videos_by_user = query_base.with_entities(
+            UsageRollup.user,
+            func.sum(UsageRollup.video_count)
+        ).group_by(UsageRollup.user).all()
+        response["videos_by_user"] = [{"user": user or None, "count": count} for user, count in videos_by_user]
 
     return jsonify(response)
 
 @usage_bp.route('/api/usage/download', methods=['GET'])
 def download_usage_data():
+    """
+    Streams the task history as CSV (default) or NDJSON (`format=ndjson`), gzip-compressed with
+    `gzip=true`. Filters: `start`/`end` (YYYY-MM-DD), `user` (admin only), `model`, `status`.
+    """
     current_user_email = get_processed_user_email_from_header()
     is_admin = current_user_email == ADMIN_EMAIL
 
-    query_base = VideoGenerationTask.query
-    if not is_admin:
-        query_base = query_base.filter(VideoGenerationTask.user == current_user_email)
-
-    tasks = query_base.all()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Write header
-    header = [
-        'id', 'user', 'model', 'prompt', 'duration_seconds', 'status',
-        'video_gcs_uri', 'created_at', 'updated_at'
-    ]
-    writer.writerow(header)
-
-    # Write data
-    for task in tasks:
-        writer.writerow([
-            task.id, task.user, task.model, task.prompt, task.duration_seconds,
-            task.status, task.video_gcs_uri, task.created_at, task.updated_at
-        ])
-
-    output.seek(0)
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"'format' must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    compress = request.args.get('gzip', 'false').lower() == 'true'
+    try:
+        filters = parse_export_filters(request.args, current_user_email, is_admin)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    mimetype, extension = EXPORT_FORMATS[export_format]
     timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d_%H%M%S')
-    filename = f"dreamer_v_usage_data_{timestamp}.csv"
+    filename = f"dreamer_v_usage_data_{timestamp}.{extension}"
+    if compress:
+        mimetype, filename = 'application/gzip', f"{filename}.gz"
 
     return Response(
-        output,
-        mimetype="text/csv",
-        headers={"Content-Disposition": f"attachment;filename={filename}"}
+        stream_export(db.engine, filters, export_format, compress),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment;filename={filename}",
+            "X-Accel-Buffering": "no", # Stream through nginx instead of buffering the whole export
+        }
     )
@@ -1,12 +1,16 @@
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, Response, request, jsonify, send_from_directory
 from config import (
     videos_dir,
     thumbnails_dir,
     uploads_dir,
     user_uploaded_music_dir,
+    previews_dir,
+    PREVIEW_CACHE_MAX_AGE,
 )
 from utils import get_processed_user_email_from_header
+from hls_packager import hls_dir_for
 from google_gemini import refine_text_with_gemini
+from metrics import render_metrics
 
 utility_bp = Blueprint('utility_bp', __name__)
 
@@ -45,6 +49,20 @@ def serve_thumbnail(filename):
     response.headers['Cache-Control'] = 'public, max-age=360000'
     return response
 
+@utility_bp.route('/api/previews/<filename>')
+def serve_preview(filename):
+    response = send_from_directory(previews_dir, filename)
+    response.headers['Cache-Control'] = f'public, max-age={PREVIEW_CACHE_MAX_AGE}, immutable'
+    return response
+
+@utility_bp.route('/api/hls/<task_id>/<path:filename>')
+def serve_hls(task_id, filename):
+    # Playlists and segments of a VOD package never change once written
+    mimetype = 'application/vnd.apple.mpegurl' if filename.endswith('.m3u8') else 'video/mp2t'
+    response = send_from_directory(hls_dir_for(task_id), filename, mimetype=mimetype)
+    response.headers['Cache-Control'] = f'public, max-age={PREVIEW_CACHE_MAX_AGE}, immutable'
+    return response
+
 @utility_bp.route('/api/uploads/<filename>')
 def serve_upload(filename):
     response = send_from_directory(uploads_dir, filename)
@@ -61,6 +79,12 @@ def serve_user_uploaded_music(filename):
 def health_check():
     return jsonify({"status": "ok", "message": "OK"}), 200
 
+@utility_bp.route('/api/metrics', methods=['GET'])
+def metrics_route():
+    """Prometheus exposition of all gunicorn workers. nginx does not proxy it; scrape port 5001 directly."""
+    body, content_type = render_metrics()
+    return Response(body, mimetype=content_type)
+
 @utility_bp.route('/api/user-info', methods=['GET'])
 def user_info():
     user_email = get_processed_user_email_from_header()
@@ -6,6 +6,7 @@ from werkzeug.utils import secure_filename
 from database import db
 from models import VideoGenerationTask
 from tasks import _run_video_generation, _run_composite_video_creation
+from metrics import tracked_job
 from config import (
     DEFAULT_VIDEO_MODEL,
     uploads_dir,
@@ -68,7 +69,7 @@ def generate_video_route():
     db.session.add(new_task)
     db.session.commit()
     
-    thread = threading.Thread(target=_run_video_generation, args=(current_app._get_current_object(), new_task.id))
+    thread = threading.Thread(target=tracked_job("video", new_task.model, _run_video_generation), args=(current_app._get_current_object(), new_task.id))
     thread.start()
     
     return jsonify({"message": "Video generation started", "task_id": new_task.id}), 202
@@ -112,7 +113,7 @@ def extend_video_route(original_task_id):
     db.session.add(new_task)
     db.session.commit()
 
-    thread = threading.Thread(target=_run_video_generation, args=(current_app._get_current_object(), new_task.id))
+    thread = threading.Thread(target=tracked_job("video", new_task.model, _run_video_generation), args=(current_app._get_current_object(), new_task.id))
     thread.start()
 
     return jsonify({"message": "Video extension started", "task_id": new_task.id}), 202
@@ -126,12 +127,27 @@ def create_composite_video_route():
     source_clips_info = data['clips']
     composite_prompt = data.get('prompt', "Composite video from selected clips")
     music_file_path = data.get('music_file_path') 
+    duck_clip_audio = bool(data.get('duck_clip_audio', False)) # Keep the Veo clip audio, ducked under the music
 
     user_email = get_processed_user_email_from_header()
 
     for clip_info in source_clips_info:
         if 'task_id' not in clip_info:
             return jsonify({"error": "Each clip in the 'clips' list must have a 'task_id'"}), 400
+
+    # Validate trims against the real durations probed at ingest (one query, no file access)
+    source_ids = {clip_info['task_id'] for clip_info in source_clips_info}
+    source_tasks = {task.id: task for task in VideoGenerationTask.query.filter(VideoGenerationTask.id.in_(source_ids))}
+    for clip_info in source_clips_info:
+        source_task = source_tasks.get(clip_info['task_id'])
+        if not source_task or not source_task.media_duration_seconds:
+            continue
+        try:
+            start_offset = float(clip_info.get('start_offset_seconds') or 0.0)
+        except (ValueError, TypeError):
+            return jsonify({"error": f"Invalid start_offset_seconds for clip {clip_info['task_id']}"}), 400
+        if start_offset < 0 or start_offset >= source_task.media_duration_seconds:
+            return jsonify({"error": f"start_offset_seconds {start_offset} is outside clip {clip_info['task_id']} ({source_task.media_duration_seconds:.2f}s long)"}), 400
     
     new_composite_task = VideoGenerationTask(
         prompt=composite_prompt,
@@ -144,7 +160,7 @@ def create_composite_video_route():
     db.session.add(new_composite_task)
     db.session.commit()
     
-    thread = threading.Thread(target=_run_composite_video_creation, args=(current_app._get_current_object(), new_composite_task.id, source_clips_info, music_file_path))
+    thread = threading.Thread(target=tracked_job("composite", new_composite_task.model, _run_composite_video_creation), args=(current_app._get_current_object(), new_composite_task.id, source_clips_info, music_file_path, duck_clip_audio))
     thread.start()
     
     return jsonify({"message": "Composite video creation started", "task_id": new_composite_task.id}), 202
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from config import segment_cache_dir, COMPOSITE_SEGMENT_CACHE_MAX_BYTES
+
+
+class SegmentCache:
+    """
+    On-disk LRU cache of normalized composite segments.
+
+    Entries are keyed by source task id, trim window and output encoding profile, and stored as
+    `<source_task_id>_<hash>.mp4` so every entry of a source can be purged when the task is deleted.
+    Recency is tracked through the file mtime, which is refreshed on every hit; the least recently
+    used entries are evicted once the cache grows beyond `max_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key_for(self, source_task_id, start, end, profile):
+        fingerprint = json.dumps(
+            {"start": round(start, 3), "end": round(end, 3), "profile": profile},
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32]
+        return f"{source_task_id}_{digest}"
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    def contains(self, key):
+        """Whether an entry is cached now (it may still be evicted before it is checked out)."""
+        return os.path.exists(self._path(key))
+
+    def checkout(self, key, destination_path):
+        """
+        Places the cached segment at `destination_path` (hard link, or copy across filesystems) and
+        marks it as recently used. The link keeps the data alive even if the entry is evicted while a
+        composite is still using it. Returns False on a cache miss.
+        """
+        cached_path = self._path(key)
+        try:
+            os.utime(cached_path)
+        except FileNotFoundError:
+            return False
+        try:
+            os.link(cached_path, destination_path)
+        except FileNotFoundError: # Evicted between the utime and the link
+            return False
+        except OSError:
+            shutil.copyfile(cached_path, destination_path)
+        return True
+
+    def store(self, key, rendered_path):
+        """Adds a freshly rendered segment to the cache (the rendered file itself stays in place)."""
+        cached_path = self._path(key)
+        tmp_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            try:
+                os.link(rendered_path, tmp_path)
+            except OSError:
+                shutil.copyfile(rendered_path, tmp_path)
+            os.replace(tmp_path, cached_path) # Atomic: concurrent renders of the same key simply overwrite
+        except OSError as e:
+            print(f"Could not add segment {key} to the segment cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in `max_bytes`."""
+        with self._lock:
+            entries = []
+            total_bytes = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.name.endswith(".mp4"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total_bytes -= size
+                except FileNotFoundError:
+                    pass
+
+    def purge_source(self, source_task_id):
+        """Drops every cached segment cut from the given source task."""
+        prefix = f"{source_task_id}_"
+        removed = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith(prefix) and entry.name.endswith(".mp4"):
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+segment_cache = SegmentCache(segment_cache_dir, COMPOSITE_SEGMENT_CACHE_MAX_BYTES)
@@ -0,0 +1,66 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from google.cloud import storage
+
+from config import COMPOSITE_PREFETCH_WORKERS
+from metrics import record_gcs_transfer
+from tracing import traced
+
+# Downloads in flight across all composite jobs of this worker, keyed by destination path, so two
+# composites that need the same clip share one transfer.
+_inflight_downloads = {}
+_inflight_lock = threading.Lock()
+_download_executor = ThreadPoolExecutor(max_workers=COMPOSITE_PREFETCH_WORKERS, thread_name_prefix="gcs-prefetch")
+
+
+def split_gcs_uri(gcs_uri):
+    """'gs://bucket/path/to/blob' -> ('bucket', 'path/to/blob')"""
+    if not gcs_uri or not gcs_uri.startswith("gs://"):
+        raise ValueError(f"Not a GCS URI: {gcs_uri}")
+    bucket_name, _, blob_name = gcs_uri[len("gs://"):].partition("/")
+    return bucket_name, blob_name
+
+
+def download_gcs_uri(gcs_uri, destination_path):
+    """Downloads a GCS object to `destination_path` atomically (temp file + rename)."""
+    bucket_name, blob_name = split_gcs_uri(gcs_uri)
+    tmp_path = f"{destination_path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        storage_client = storage.Client()
+        storage_client.bucket(bucket_name).blob(blob_name).download_to_filename(tmp_path)
+        record_gcs_transfer("download", tmp_path)
+        os.replace(tmp_path, destination_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(f"Prefetched {gcs_uri} to {destination_path}")
+    return destination_path
+
+
+def _download_and_forget(gcs_uri, destination_path):
+    try:
+        return download_gcs_uri(gcs_uri, destination_path)
+    finally:
+        with _inflight_lock:
+            _inflight_downloads.pop(destination_path, None)
+
+
+def prefetch(gcs_uri, destination_path):
+    """
+    Starts (or joins) a background download of `gcs_uri` to `destination_path` and returns a Future
+    resolving to the local path. Files already present locally resolve immediately.
+    """
+    with _inflight_lock:
+        future = _inflight_downloads.get(destination_path)
+        if future is None:
+            if os.path.exists(destination_path):
+                future = Future()
+                future.set_result(destination_path)
+            else:
+                # Traced as a child of the composite job that asked for the clip
+                download = traced("gcs download", _download_and_forget, {"gcs.uri": gcs_uri})
+                future = _download_executor.submit(download, gcs_uri, destination_path)
+                _inflight_downloads[destination_path] = future
+        return future
@@ -0,0 +1,269 @@
+"""
+Task change events behind /api/events (Server-Sent Events).
+
+Changes to video, composite and music tasks are appended to the task_change_log table from a session
+after_flush hook, so an event row exists exactly when the change it describes is committed. The row id
+is the SSE event id. Each worker process runs one TaskEventBroker thread that learns about new rows,
+from PostgreSQL LISTEN/NOTIFY (psycopg2) or by tailing the table's id watermark (SQLite and other
+drivers), and wakes the streams open in that process; each stream then reads its user's rows.
+"""
+import json
+import select
+import threading
+import time
+
+from sqlalchemy import delete, event, func, inspect
+from sqlalchemy import select as sql_select
+
+from database import db
+from models import VideoGenerationTask, MusicGenerationTask, TaskChangeLog
+from config import (
+    TASK_EVENTS_POLL_INTERVAL_SECONDS,
+    TASK_EVENTS_HEARTBEAT_SECONDS,
+    TASK_EVENTS_MAX_STREAM_SECONDS,
+    TASK_EVENTS_RETRY_MS,
+    TASK_EVENTS_RETENTION_SECONDS,
+)
+
+NOTIFY_CHANNEL = "task_events"
+PRUNE_INTERVAL_SECONDS = 600
+FETCH_BATCH_SIZE = 200
+# Under PostgreSQL concurrent transactions can commit change log ids out of order; streams re-read this
+# many ids below their position so a row committed late is still delivered (once).
+REORDER_WINDOW_IDS = 50
+
+# Attributes whose change is worth an event; probe details, render stats and the like are not
+VIDEO_EVENT_ATTRIBUTES = (
+    'status', 'error_message', 'progress_percent', 'video_gcs_uri', 'local_video_path',
+    'local_thumbnail_path', 'thumbnail_variants', 'local_preview_path', 'local_hls_manifest_path',
+)
+MUSIC_EVENT_ATTRIBUTES = ('status', 'error_message', 'local_music_path')
+
+
+def mark_composite(task):
+    """Tags a loaded task so the events its changes produce in this session are of kind 'composite'."""
+    inspect(task).info['event_kind'] = 'composite'
+
+
+def _has_changes(task, attributes):
+    state = inspect(task)
+    return any(state.attrs[name].history.has_changes() for name in attributes)
+
+
+def _change_log_row(task, event_name):
+    """change_log insert parameters for a task flushed as created, updated or deleted."""
+    if isinstance(task, MusicGenerationTask):
+        kind = 'music'
+        user = inspect(task).dict.get('user') if event_name == 'deleted' else task.user
+        snapshot = task.to_dict() if event_name != 'deleted' else None
+    else:
+        kind = inspect(task).info.get('event_kind', 'video')
+        user = inspect(task).dict.get('user') if event_name == 'deleted' else task.user
+        snapshot = VideoGenerationTask.list_row_to_dict(task) if event_name != 'deleted' else None
+    return {
+        "user": user,
+        "kind": kind,
+        "task_id": task.id if event_name != 'deleted' else inspect(task).identity[0],
+        "event": event_name,
+        "status": snapshot["status"] if snapshot else None,
+        "payload": json.dumps(snapshot) if snapshot else None,
+        "created_at": time.time(),
+    }
+
+
+def append_change(connection, rows):
+    """Inserts change log rows on `connection`, inside the caller's transaction, and notifies listeners on commit."""
+    if not rows:
+        return
+    connection.execute(TaskChangeLog.__table__.insert(), rows)
+    if connection.dialect.name == 'postgresql':
+        connection.execute(sql_select(func.pg_notify(NOTIFY_CHANNEL, '')))
+
+
+def record_progress_change(connection, task_id):
+    """Change log row for a progress write made through the engine (CompositeProgressReporter)."""
+    row = connection.execute(
+        sql_select(*VideoGenerationTask.list_columns(), VideoGenerationTask.user)
+        .where(VideoGenerationTask.id == task_id)
+    ).first()
+    if row is None:
+        return
+    snapshot = VideoGenerationTask.list_row_to_dict(row)
+    append_change(connection, [{
+        "user": row.user,
+        "kind": 'composite',
+        "task_id": task_id,
+        "event": 'updated',
+        "status": snapshot["status"],
+        "payload": json.dumps(snapshot),
+        "created_at": time.time(),
+    }])
+
+
+@event.listens_for(db.session, 'after_flush')
+def _record_task_changes(session, flush_context):
+    # new/dirty/deleted still describe the flush that just ran; generated defaults (created_at,
+    # updated_at onupdate) are already on the instances.
+    rows = []
+    for task in session.new:
+        if isinstance(task, (VideoGenerationTask, MusicGenerationTask)):
+            rows.append(_change_log_row(task, 'created'))
+    for task in session.dirty:
+        if isinstance(task, VideoGenerationTask) and _has_changes(task, VIDEO_EVENT_ATTRIBUTES):
+            rows.append(_change_log_row(task, 'updated'))
+        elif isinstance(task, MusicGenerationTask) and _has_changes(task, MUSIC_EVENT_ATTRIBUTES):
+            rows.append(_change_log_row(task, 'updated'))
+    for task in session.deleted:
+        if isinstance(task, (VideoGenerationTask, MusicGenerationTask)):
+            rows.append(_change_log_row(task, 'deleted'))
+    append_change(session.connection(), rows)
+
+
+def latest_event_id(connection):
+    return connection.execute(sql_select(func.max(TaskChangeLog.id))).scalar() or 0
+
+
+def prune_change_log(engine):
+    cutoff = time.time() - TASK_EVENTS_RETENTION_SECONDS
+    with engine.begin() as connection:
+        result = connection.execute(delete(TaskChangeLog.__table__).where(TaskChangeLog.created_at < cutoff))
+    if result.rowcount:
+        print(f"Pruned {result.rowcount} task change log row(s) older than {TASK_EVENTS_RETENTION_SECONDS:.0f}s")
+
+
+class TaskEventBroker:
+    """
+    Per-process watcher of the change log's latest id. Streams block in wait() instead of each
+    polling the database; one thread per worker does the listening (or tailing) for all of them.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._latest_id = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self, engine):
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            with engine.connect() as connection:
+                self._publish(latest_event_id(connection))
+            self._thread = threading.Thread(target=self._run, args=(engine,), name="task-event-broker", daemon=True)
+            self._thread.start()
+
+    @property
+    def latest_id(self):
+        with self._condition:
+            return self._latest_id
+
+    def wait(self, after_id, timeout):
+        """Blocks until a change log id above `after_id` is known, or `timeout` passes. Returns the latest id."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._latest_id > after_id, timeout)
+            return self._latest_id
+
+    def _publish(self, latest_id):
+        with self._condition:
+            if latest_id > self._latest_id:
+                self._latest_id = latest_id
+                self._condition.notify_all()
+
+    def _run(self, engine):
+        last_pruned_at = 0.0
+        while True:
+            try:
+                if engine.dialect.name == 'postgresql' and engine.dialect.driver == 'psycopg2':
+                    self._listen(engine)
+                else:
+                    with engine.connect() as connection:
+                        self._publish(latest_event_id(connection))
+                    time.sleep(TASK_EVENTS_POLL_INTERVAL_SECONDS)
+                if time.time() - last_pruned_at > PRUNE_INTERVAL_SECONDS:
+                    last_pruned_at = time.time()
+                    prune_change_log(engine)
+            except Exception as e:
+                print(f"Task event broker error: {e}")
+                time.sleep(TASK_EVENTS_POLL_INTERVAL_SECONDS)
+
+    def _listen(self, engine):
+        """LISTENs on a dedicated connection until PRUNE_INTERVAL_SECONDS have passed."""
+        raw_connection = engine.raw_connection()
+        try:
+            connection = raw_connection.driver_connection
+            connection.autocommit = True
+            cursor = connection.cursor()
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            listening_since = time.time()
+            while time.time() - listening_since < PRUNE_INTERVAL_SECONDS:
+                # The timeout doubles as a safety net for notifications missed across reconnects
+                select.select([connection], [], [], TASK_EVENTS_HEARTBEAT_SECONDS)
+                connection.poll()
+                connection.notifies.clear()
+                cursor.execute(f"SELECT max(id) FROM {TaskChangeLog.__table__.name}")
+                self._publish(cursor.fetchone()[0] or 0)
+            cursor.execute(f"UNLISTEN {NOTIFY_CHANNEL}")
+            connection.autocommit = False
+        finally:
+            raw_connection.close()
+
+
+broker = TaskEventBroker()
+
+
+def _format_event(event_id, event_name, data):
+    return f"id: {event_id}\nevent: {event_name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def _fetch_changes(engine, user_email, after_id):
+    table = TaskChangeLog.__table__
+    statement = sql_select(table).where(table.c.id > after_id).order_by(table.c.id).limit(FETCH_BATCH_SIZE)
+    if user_email is not None:
+        # A user only sees their own tasks; no event kind is broadcast to everyone. Rows without an
+        # owner (music tasks created before owners were recorded) only reach the admin's stream.
+        statement = statement.where(table.c.user == user_email)
+    with engine.connect() as connection:
+        return connection.execute(statement).all()
+
+
+def event_stream(engine, user_email, last_event_id=None):
+    """
+    Generator of SSE lines for the changes visible to `user_email` (None: all users). Without a
+    `last_event_id` the stream starts at the current end of the log; with one it replays what the
+    client missed, or sends a `resync` event if that part of the log was already pruned.
+    """
+    broker.start(engine)
+    started_at = time.time()
+    yield f"retry: {TASK_EVENTS_RETRY_MS}\n\n"
+
+    if last_event_id is None:
+        position = broker.latest_id
+    else:
+        position = last_event_id
+        with engine.connect() as connection:
+            oldest_id = connection.execute(sql_select(func.min(TaskChangeLog.id))).scalar()
+        if oldest_id is not None and oldest_id > last_event_id + 1:
+            yield _format_event(last_event_id, 'resync', {"reason": "events pruned"})
+
+    delivered = set() # Ids within the reorder window already sent on this stream
+    low_water = position # The first read after a resume is strict, the window only covers this stream's own reads
+    last_sent_at = time.time()
+    while time.time() - started_at < TASK_EVENTS_MAX_STREAM_SECONDS:
+        known_id = broker.latest_id
+        rows = _fetch_changes(engine, user_email, low_water)
+        for row in rows:
+            if row.id in delivered:
+                continue
+            delivered.add(row.id)
+            position = max(position, row.id)
+            yield _format_event(position, 'task', TaskChangeLog.row_to_dict(row))
+            last_sent_at = time.time()
+        low_water = max(low_water, position - REORDER_WINDOW_IDS)
+        delivered = {event_id for event_id in delivered if event_id > low_water}
+        if len(rows) == FETCH_BATCH_SIZE:
+            continue # Catching up after a resume
+
+        broker.wait(known_id, timeout=max(0.0, TASK_EVENTS_HEARTBEAT_SECONDS - (time.time() - last_sent_at)))
+        if time.time() - last_sent_at >= TASK_EVENTS_HEARTBEAT_SECONDS:
+            yield ": heartbeat\n\n"
+            last_sent_at = time.time()
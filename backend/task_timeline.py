@@ -0,0 +1,146 @@
+"""
+Per-stage timing of video, composite and music jobs.
+
+Each job keeps a TaskTimeline for its task and calls enter() as it moves from one stage to the next;
+the stage that was open is written to task_event with its start time, duration and outcome. The
+jobs are linear, so one open stage at a time is enough, and a failure is charged to the stage that
+was running (finish(outcome="failed")). Rows go through the engine in their own short transaction,
+like the composite progress writes, so they survive a job that fails and never mix with its session.
+
+    queued                                                    all jobs: created_at -> picked up by the job thread
+    prepare, image_upload, last_frame_upload, veo_submit,     video
+    veo_poll, download, probe
+    prepare_sources, render, probe, gcs_upload                composite
+    lyria_generate, save                                      music
+    thumbnails, preview, hls                                  background pools, after the task completed
+"""
+import collections
+import contextlib
+import time
+
+from sqlalchemy import select
+
+from models import TaskEvent
+from metrics import observe_stage
+
+STAGE_PERCENTILES = (0.5, 0.9, 0.99)
+STAGE_ORDER = (
+    "queued", "prepare", "image_upload", "last_frame_upload", "veo_submit", "veo_poll", "download",
+    "prepare_sources", "render", "lyria_generate", "save", "probe", "gcs_upload", "thumbnails", "preview", "hls",
+)
+STATS_BATCH_ROWS = 10_000
+
+
+class TaskTimeline:
+    def __init__(self, engine, task_id, kind, model=None):
+        self.engine = engine
+        self.task_id = task_id
+        self.kind = kind
+        self.model = model
+        self._stage = None
+        self._stage_started_at = None
+
+    @classmethod
+    def for_task(cls, engine, task):
+        """Timeline of a video task whose job already recorded stages (post-processing pools): reuses its kind."""
+        table = TaskEvent.__table__
+        try:
+            with engine.connect() as connection:
+                kind = connection.execute(select(table.c.kind).where(table.c.task_id == task.id).limit(1)).scalar()
+        except Exception as e:
+            print(f"Could not read the timeline kind of task {task.id}: {e}")
+            kind = None
+        return cls(engine, task.id, kind or "video", task.model)
+
+    def record(self, stage, started_at, ended_at=None, outcome="ok", detail=None):
+        """Writes one stage. Timing must never fail a job, so errors are only logged."""
+        ended_at = ended_at if ended_at is not None else time.time()
+        observe_stage(self.kind, self.model, stage, outcome, max(0.0, ended_at - started_at))
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(TaskEvent.__table__.insert().values(
+                    task_id=self.task_id,
+                    kind=self.kind,
+                    model=self.model,
+                    stage=stage,
+                    started_at=started_at,
+                    duration_seconds=max(0.0, ended_at - started_at),
+                    outcome=outcome,
+                    detail=detail[:1024] if detail else None,
+                ))
+        except Exception as e:
+            print(f"Could not record stage '{stage}' of task {self.task_id}: {e}")
+
+    def enter(self, stage):
+        """Ends the open stage (as ok) and starts timing `stage`."""
+        self.finish()
+        self._stage = stage
+        self._stage_started_at = time.time()
+
+    def finish(self, outcome="ok", detail=None):
+        """Ends the open stage, if any."""
+        if self._stage is None:
+            return
+        stage, started_at = self._stage, self._stage_started_at
+        self._stage = None
+        self.record(stage, started_at, outcome=outcome, detail=detail)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times a block as one stage; an exception marks it failed and propagates."""
+        self.enter(name)
+        try:
+            yield
+        except Exception as e:
+            self.finish(outcome="failed", detail=str(e))
+            raise
+        self.finish()
+
+
+def task_timeline(task_id):
+    """Stages of one task in the order they started."""
+    events = TaskEvent.query.filter_by(task_id=task_id).order_by(TaskEvent.started_at, TaskEvent.id).all()
+    return [event.to_dict() for event in events]
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def stage_percentiles(engine, since, until=None, kind=None):
+    """
+    Duration percentiles per (kind, model, stage) of the stages that started in [since, until),
+    read in batches over the started_at index. Failed stages are counted but left out of the percentiles.
+    """
+    table = TaskEvent.__table__
+    statement = select(table.c.kind, table.c.model, table.c.stage, table.c.duration_seconds, table.c.outcome).where(table.c.started_at >= since)
+    if until is not None:
+        statement = statement.where(table.c.started_at < until)
+    if kind:
+        statement = statement.where(table.c.kind == kind)
+
+    durations = collections.defaultdict(list)
+    failures = collections.Counter()
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=STATS_BATCH_ROWS).execute(statement)
+        for row in result:
+            key = (row.kind, row.model, row.stage)
+            if row.outcome == "ok":
+                durations[key].append(row.duration_seconds)
+            else:
+                failures[key] += 1
+                durations.setdefault(key, [])
+
+    def pipeline_order(item):
+        row_kind, model, stage = item[0]
+        return (row_kind, model or "", STAGE_ORDER.index(stage) if stage in STAGE_ORDER else len(STAGE_ORDER), stage)
+
+    stats = []
+    for (row_kind, model, stage), values in sorted(durations.items(), key=pipeline_order):
+        values.sort()
+        entry = {"kind": row_kind, "model": model, "stage": stage, "count": len(values), "failed": failures[(row_kind, model, stage)]}
+        for fraction in STAGE_PERCENTILES:
+            entry[f"p{int(fraction * 100)}"] = round(_percentile(values, fraction), 3) if values else None
+        entry["max"] = round(values[-1], 3) if values else None
+        stats.append(entry)
+    return stats
@@ -1,20 +1,45 @@
 import time
 import os
-import cv2
+import shutil
+import tempfile
 from google.cloud import storage
-from moviepy import VideoFileClip, AudioFileClip, CompositeAudioClip, concatenate_videoclips
+import numpy as np
+from moviepy import VideoFileClip, AudioArrayClip, concatenate_videoclips
 from database import db
 from models import VideoGenerationTask, MusicGenerationTask
 from config import (
     videos_dir,
-    thumbnails_dir,
     uploads_dir,
     generated_music_dir,
     user_uploaded_music_dir,
+    composite_work_dir,
     DEFAULT_OUTPUT_GCS_BUCKET,
     PROJECT_ID,
+    COMPOSITE_RENDER_ENGINE,
+    COMPOSITE_MAX_OPEN_READERS,
+    HLS_PACKAGING_ENABLED,
 )
 from google_veo import GoogleVeo
+from source_prefetch import prefetch
+from media_probe import probe_task_video
+from thumbnail_engine import schedule_thumbnails
+from preview_proxy import schedule_preview
+from hls_packager import schedule_hls_packaging
+from task_events import mark_composite
+from task_timeline import TaskTimeline
+from metrics import record_gcs_transfer
+from tracing import start_span
+from render_progress import CompositeProgressReporter, MoviepyProgressLogger
+from composite_audio import SAMPLE_RATE as SOUNDTRACK_SAMPLE_RATE, build_soundtrack
+from composite_renderer import (
+    PeakRssMonitor,
+    composite_geometry,
+    choose_composite_engine,
+    render_composite_sequential,
+    render_composite_with_ffmpeg,
+    select_encoder_settings,
+    wait_for_sources,
+)
 from clients import lyria_client
 
 def _run_video_generation(app, task_id):
@@ -24,10 +49,13 @@ def _run_video_generation(app, task_id):
             print(f"Task {task_id} not found for processing.")
             return
 
+        timeline = TaskTimeline(db.engine, task.id, "video", task.model)
+        timeline.record("queued", task.created_at or time.time())
         task.status = "processing"
         task.updated_at = time.time()
         db.session.commit()
         print(f"Starting video generation for task {task_id}, prompt: '{task.prompt}', model: '{task.model}'")
+        timeline.enter("prepare") # Model checks and request parameters, before any upload
 
         try:
             # Model specific checks based on user feedback
@@ -48,7 +76,6 @@ def _run_video_generation(app, task_id):
                     db.session.commit()
                     print(f"Task {task_id} failed: {task.error_message}")
                     return
-            print("@@", task)
             veo_client = GoogleVeo(project_id=PROJECT_ID, model_name=task.model) # Instantiate GoogleVeo with task's model
 
             current_image_gcs_uri = None # Initialize
@@ -98,7 +125,10 @@ def _run_video_generation(app, task_id):
                             image_blob_name = f"image_uploads/{task.id}/{base_image_filename}"
                             blob_img = bucket_img.blob(image_blob_name)
                             
-                            blob_img.upload_from_filename(image_full_path, content_type=current_image_mime_type)
+                            timeline.enter("image_upload")
+                            with start_span("gcs upload", kind="client", attributes={"gcs.uri": f"gs://{image_bucket_name}/{image_blob_name}"}):
+                                blob_img.upload_from_filename(image_full_path, content_type=current_image_mime_type)
+                            record_gcs_transfer("upload", image_full_path)
                             current_image_gcs_uri = f"gs://{image_bucket_name}/{image_blob_name}"
                             task.image_gcs_uri = current_image_gcs_uri # Save to task model
                             db.session.commit()
@@ -138,7 +168,10 @@ def _run_video_generation(app, task_id):
                             last_image_blob_name = f"last_frame_uploads/{task.id}/{base_last_image_filename}"
                             blob_last_img = bucket_last_img.blob(last_image_blob_name)
                             
-                            blob_last_img.upload_from_filename(last_frame_full_path, content_type=current_last_frame_mime_type)
+                            timeline.enter("last_frame_upload")
+                            with start_span("gcs upload", kind="client", attributes={"gcs.uri": f"gs://{last_image_bucket_name}/{last_image_blob_name}"}):
+                                blob_last_img.upload_from_filename(last_frame_full_path, content_type=current_last_frame_mime_type)
+                            record_gcs_transfer("upload", last_frame_full_path)
                             current_last_frame_gcs_uri = f"gs://{last_image_bucket_name}/{last_image_blob_name}"
                             task.last_frame_gcs_uri = current_last_frame_gcs_uri # Save to task model
                             db.session.commit()
@@ -157,7 +190,8 @@ def _run_video_generation(app, task_id):
             # Call GoogleVeo to generate video
             # Note: model_to_use (task.model or DEFAULT_VIDEO_MODEL) is not used here as GoogleVeo class has a hardcoded model.
             # This might be a point of future enhancement if model selection is needed with GoogleVeo.
-            op_result = veo_client.generate_video(
+            timeline.enter("veo_submit")
+            operation_name = veo_client.start_video_generation(
                 prompt=task.prompt,
                 parameters=veo_parameters,
                 image_uri=current_image_gcs_uri if current_image_gcs_uri else "",
@@ -169,6 +203,8 @@ def _run_video_generation(app, task_id):
                 generate_audio=task.generate_audio,
                 resolution=task.resolution
             )
+            timeline.enter("veo_poll") # Queueing and generation on the Veo side
+            op_result = veo_client.wait_for_operation(operation_name)
 
             # Process the result from GoogleVeo
             if "error" in op_result and op_result["error"]:
@@ -212,27 +248,27 @@ def _run_video_generation(app, task_id):
                         storage_client = storage.Client()
                         bucket = storage_client.bucket(bucket_name)
                         blob = bucket.blob(source_blob_name)
-                        blob.download_to_filename(local_video_full_path)
+                        timeline.enter("download")
+                        with start_span("gcs download", kind="client", attributes={"gcs.uri": gcs_raw_uri}):
+                            blob.download_to_filename(local_video_full_path)
+                        record_gcs_transfer("download", local_video_full_path)
                         
                         task.local_video_path = f"/videos/{video_filename}" # Relative path for serving
                         print(f"Video for task {task_id} downloaded successfully via GCS client.")
+                        timeline.enter("probe")
+                        probe_task_video(task, local_video_full_path)
+                        timeline.finish()
 
                         # time.sleep(1) # May not be needed with GCS client download, but can be re-added if moov atom issue persists
 
-                        # Generate thumbnail
-                        thumbnail_filename = f"{task.id}.jpg"
-                        local_thumbnail_full_path = os.path.join(thumbnails_dir, thumbnail_filename)
-                        print(f"Generating thumbnail for task {task_id} at {local_thumbnail_full_path}...")
-                        vid_cap = cv2.VideoCapture(local_video_full_path)
-                        success, image = vid_cap.read()
-                        if success:
-                            cv2.imwrite(local_thumbnail_full_path, image)
-                            task.local_thumbnail_path = f"/thumbnails/{thumbnail_filename}" # Relative path for serving
-                            print(f"Thumbnail for task {task_id} generated successfully.")
-                        else:
-                            print(f"Failed to extract frame for thumbnail for task {task_id}.")
-                        vid_cap.release()
+                        # Thumbnails and the preview proxy are built on background pools; commit first so the jobs see the probed metadata
+                        db.session.commit()
+                        schedule_thumbnails(app, task.id, local_video_full_path)
+                        schedule_preview(app, task.id, local_video_full_path)
+                        if HLS_PACKAGING_ENABLED:
+                            schedule_hls_packaging(app, task.id, local_video_full_path)
                     except Exception as e_dl_thumb: # Catching broader exception for GCS download or thumbnailing
+                        timeline.finish(outcome="failed", detail=str(e_dl_thumb))
                         print(f"Error during video download or thumbnail generation for task {task_id}: {e_dl_thumb}")
                         task.error_message = (task.error_message or "") + f"; Download/Thumbnail failed: {e_dl_thumb}"
                 else:
@@ -251,30 +287,159 @@ def _run_video_generation(app, task_id):
         finally:
             task.updated_at = time.time()
             db.session.commit()
-
-def _run_composite_video_creation(app, task_id, source_clip_task_ids_and_prompts, music_file_path_param=None):
+            # The stage still open is the one the task failed in. Recorded after the commit: on SQLite a
+            # second connection would wait for the write lock of a flushed session.
+            timeline.finish(outcome="failed" if task.status == "failed" else "ok", detail=task.error_message if task.status == "failed" else None)
+
+def _stored_media_info(task):
+    """Segment media info from the metadata probed at ingest, or None if the task was never probed."""
+    if not task.media_duration_seconds or not task.media_width or not task.media_height:
+        return None
+    return {
+        "duration": task.media_duration_seconds,
+        "width": task.media_width,
+        "height": task.media_height,
+        "fps": task.media_fps or 24,
+        "has_audio": task.media_audio_codec is not None,
+    }
+
+def _open_moviepy_segment(segment):
+    """(source clip, clip to concatenate) of a segment; "end": None uses the source to its end."""
+    source_clip = VideoFileClip(segment["path"])
+    end = segment.get("end")
+    # Only apply subclip if the desired segment is different from the full original clip
+    if segment["start"] != 0.0 or (end is not None and end != source_clip.duration):
+        return source_clip, source_clip.subclipped(segment["start"], end)
+    return source_clip, source_clip
+
+def _write_moviepy_composite(segments, output_path, absolute_music_path=None, duck_clip_audio=False, logger='bar', intermediate=False):
+    """
+    One moviepy pass over `segments`, which are all open at once. Intermediates are encoded
+    losslessly (x264 CRF 0, PCM audio in Matroska) so joining them later costs no quality.
+    """
+    source_clips = []
+    video_clips_to_concatenate = []
+    final_clip_moviepy = None # Initialize to ensure it's closable in finally
+    try:
+        for segment in segments:
+            source_clip, clip = _open_moviepy_segment(segment)
+            source_clips.append(source_clip)
+            video_clips_to_concatenate.append(clip)
+
+        final_clip_moviepy = concatenate_videoclips(video_clips_to_concatenate, method="compose")
+
+        if absolute_music_path:
+            # Same NumPy soundtrack as the ffmpeg engines: looped with crossfades, loudness-normalized
+            clip_audio = None
+            if duck_clip_audio and final_clip_moviepy.audio is not None:
+                clip_audio = final_clip_moviepy.audio.to_soundarray(fps=SOUNDTRACK_SAMPLE_RATE).astype(np.float32)
+                if clip_audio.ndim == 1:
+                    clip_audio = clip_audio[:, None]
+                if clip_audio.shape[1] == 1:
+                    clip_audio = np.repeat(clip_audio, 2, axis=1)
+            soundtrack = build_soundtrack(absolute_music_path, final_clip_moviepy.duration, clip_audio=clip_audio)
+            final_clip_moviepy = final_clip_moviepy.with_audio(AudioArrayClip(soundtrack, fps=SOUNDTRACK_SAMPLE_RATE))
+
+        has_audio = final_clip_moviepy.audio is not None
+        encoder_settings = select_encoder_settings()
+
+        if intermediate:
+            final_clip_moviepy.write_videofile(
+                output_path,
+                codec="libx264",
+                audio_codec="pcm_s16le" if has_audio else None,
+                threads=encoder_settings["threads"],
+                preset="ultrafast",
+                ffmpeg_params=["-crf", "0"],
+                logger=logger
+            )
+        else:
+            final_clip_moviepy.write_videofile(
+                output_path,
+                codec="libx264",
+                audio_codec="aac" if has_audio else None,
+                threads=encoder_settings["threads"],
+                preset=encoder_settings["preset"],
+                logger=logger
+            )
+    finally:
+        for clip_obj in video_clips_to_concatenate + source_clips:
+            if hasattr(clip_obj, 'reader') and clip_obj.reader:
+                clip_obj.close()
+        if final_clip_moviepy and hasattr(final_clip_moviepy, 'reader') and final_clip_moviepy.reader:
+            final_clip_moviepy.close()
+
+def _render_composite_with_moviepy(segments, output_path, absolute_music_path=None, duck_clip_audio=False, progress=None):
+    """
+    Fallback render engine: decodes and composes every frame through moviepy.
+    Every clip of a moviepy pass keeps its decoder open, so at most COMPOSITE_MAX_OPEN_READERS clips
+    go into one pass: larger composites are rendered in chunks of that many clips to intermediates
+    in composite_work_dir, which are joined the same way until one pass covers them all. Progress
+    counts the frames of every pass.
+    """
+    wait_for_sources(segments)
+    max_open_readers = max(2, COMPOSITE_MAX_OPEN_READERS) # Joining needs at least two inputs per pass
+    passes = 1
+    remaining = len(segments)
+    while remaining > max_open_readers:
+        remaining = -(-remaining // max_open_readers)
+        passes += 1
+    if progress:
+        progress.reset(progress.total_frames * passes)
+
+    def pass_logger(key):
+        return MoviepyProgressLogger(progress, stream_key=key) if progress else 'bar'
+
+    work_dir = tempfile.mkdtemp(prefix="composite_moviepy_", dir=composite_work_dir)
+    try:
+        level = 0
+        while len(segments) > max_open_readers:
+            print(f"moviepy: joining {len(segments)} clips in chunks of {max_open_readers} (pass {level + 1}/{passes})")
+            chunks = []
+            for chunk_index in range(0, len(segments), max_open_readers):
+                chunk_path = os.path.join(work_dir, f"pass{level}_chunk{chunk_index // max_open_readers:04d}.mkv")
+                _write_moviepy_composite(
+                    segments[chunk_index:chunk_index + max_open_readers],
+                    chunk_path,
+                    logger=pass_logger(f"moviepy_{level}_{chunk_index}"),
+                    intermediate=True,
+                )
+                chunks.append({"path": chunk_path, "start": 0.0, "end": None})
+            # The previous pass's intermediates are no longer needed
+            for segment in segments:
+                if segment["path"].startswith(work_dir + os.sep):
+                    os.remove(segment["path"])
+            segments = chunks
+            level += 1
+        _write_moviepy_composite(segments, output_path, absolute_music_path, duck_clip_audio=duck_clip_audio, logger=pass_logger("moviepy"))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _run_composite_video_creation(app, task_id, source_clip_task_ids_and_prompts, music_file_path_param=None, duck_clip_audio=False):
     with app.app_context():
         composite_task = VideoGenerationTask.query.get(task_id)
         if not composite_task:
             print(f"Composite task {task_id} not found for processing.")
             return
 
+        mark_composite(composite_task) # Its status/progress events are pushed as kind 'composite'
+        timeline = TaskTimeline(db.engine, composite_task.id, "composite", composite_task.model)
+        timeline.record("queued", composite_task.created_at or time.time())
         composite_task.status = "processing"
         composite_task.updated_at = time.time()
         db.session.commit()
         print(f"Starting composite video creation for task {task_id}")
+        timeline.enter("prepare_sources")
 
-        video_clips_to_concatenate = []
+        segments = []
         total_duration = 0
         first_clip_aspect_ratio = "16:9" # Default
-        final_clip_moviepy = None # Initialize to ensure it's closable in finally
-        audio_clip_moviepy = None # Initialize for audio clip
+        absolute_music_path = None
 
         try:
             print(f"Composite video creation: received music_file_path_param: {music_file_path_param}") # Log received param
             if music_file_path_param:
                 # Determine absolute path for music file
-                absolute_music_path = None
                 if music_file_path_param.startswith("/user_uploaded_music/"):
                     base_music_filename = os.path.basename(music_file_path_param)
                     absolute_music_path = os.path.join(user_uploaded_music_dir, base_music_filename)
@@ -289,29 +454,57 @@ def _run_composite_video_creation(app, task_id, source_clip_task_ids_and_prompts
                 if not os.path.exists(absolute_music_path):
                     print(f"Music file NOT FOUND at {absolute_music_path}") # Log if not found
                     raise ValueError(f"Music file not found at {absolute_music_path}")
-                
-                audio_clip_moviepy = AudioFileClip(absolute_music_path)
-                if audio_clip_moviepy:
-                    print(f"Successfully loaded audio_clip_moviepy from {absolute_music_path}") # Log success
-                else:
-                    print(f"Failed to load audio_clip_moviepy from {absolute_music_path}") # Log failure
                 composite_task.music_file_path = music_file_path_param
             else:
                 print("No music_file_path_param provided for composite video.") # Log if no param
 
-            for i, clip_info in enumerate(source_clip_task_ids_and_prompts):
+            # Sources without a local copy (e.g. on a fresh instance) are fetched from GCS into videos_dir.
+            # All downloads are started up front so they run in parallel; clips with stored media metadata do
+            # not wait for them here, the renderer waits for each file only when it starts encoding that clip.
+            source_tasks = {}
+            source_downloads = {}
+            for clip_info in source_clip_task_ids_and_prompts:
                 source_task_id = clip_info['task_id']
+                if source_task_id in source_tasks:
+                    continue
                 source_task = VideoGenerationTask.query.get(source_task_id)
+                source_tasks[source_task_id] = source_task
+                if not source_task or source_task.status != "completed":
+                    continue
+                clip_file_path = os.path.join(videos_dir, os.path.basename(source_task.local_video_path or f"{source_task.id}.mp4"))
+                if not os.path.exists(clip_file_path) and source_task.video_gcs_uri and source_task.video_gcs_uri.startswith("gs://"):
+                    print(f"Prefetching source clip {source_task_id} from {source_task.video_gcs_uri}")
+                    source_downloads[source_task_id] = prefetch(source_task.video_gcs_uri, clip_file_path)
+
+            for i, clip_info in enumerate(source_clip_task_ids_and_prompts):
+                source_task_id = clip_info['task_id']
+                source_task = source_tasks[source_task_id]
                 if not source_task:
                     raise ValueError(f"Source clip task {source_task_id} not found.")
-                if source_task.status != "completed" or not source_task.local_video_path:
-                    raise ValueError(f"Source clip task {source_task_id} is not completed or has no local video path ({source_task.status}, {source_task.local_video_path}).")
+                if source_task.status != "completed" or not (source_task.local_video_path or source_task.video_gcs_uri):
+                    raise ValueError(f"Source clip task {source_task_id} is not completed or has no local video path or GCS URI ({source_task.status}, {source_task.local_video_path}).")
                 
-                if not os.path.basename(source_task.local_video_path): 
+                if source_task.local_video_path and not os.path.basename(source_task.local_video_path): 
                     raise ValueError(f"Source clip task {source_task_id} has an invalid local_video_path: {source_task.local_video_path}")
 
-                clip_file_path = os.path.join(videos_dir, os.path.basename(source_task.local_video_path))
-                if not os.path.exists(clip_file_path):
+                clip_filename = os.path.basename(source_task.local_video_path or f"{source_task.id}.mp4")
+                clip_file_path = os.path.join(videos_dir, clip_filename)
+                source_download = source_downloads.get(source_task_id)
+                media_info = _stored_media_info(source_task)
+                if media_info is None:
+                    # Not probed at ingest (older task): the file is needed now to read its real duration and size
+                    if source_download:
+                        try:
+                            source_download.result()
+                        except Exception as e_fetch:
+                            raise ValueError(f"Could not fetch video for clip task {source_task_id} from {source_task.video_gcs_uri}: {e_fetch}")
+                    if not os.path.exists(clip_file_path):
+                        raise ValueError(f"Local video file for clip task {source_task_id} not found at {clip_file_path}.")
+                    probe_task_video(source_task, clip_file_path)
+                    media_info = _stored_media_info(source_task)
+                    if media_info is None:
+                        raise ValueError(f"Could not read media metadata of clip task {source_task_id} at {clip_file_path}.")
+                elif not source_download and not os.path.exists(clip_file_path):
                     raise ValueError(f"Local video file for clip task {source_task_id} not found at {clip_file_path}.")
                 
                 # Get raw start offset and duration from clip_info
@@ -325,8 +518,7 @@ def _run_composite_video_creation(app, task_id, source_clip_task_ids_and_prompts
                     # If raw_segment_duration is None or missing, default to the full duration of the source_task's video.
                     # Otherwise, convert the provided segment duration.
                     if raw_segment_duration is None:
-                        # Ensure source_task.duration_seconds is float for calculations
-                        segment_duration = float(source_task.duration_seconds) 
+                        segment_duration = float(media_info["duration"])
                     else:
                         segment_duration = float(raw_segment_duration)
                         
@@ -339,8 +531,7 @@ def _run_composite_video_creation(app, task_id, source_clip_task_ids_and_prompts
                         f"Details: {error_detail}. Error: {e}"
                     )
 
-                current_full_clip = VideoFileClip(clip_file_path)
-                original_clip_duration = current_full_clip.duration # True duration of the video file
+                original_clip_duration = media_info["duration"] # True duration of the video file, probed at ingest
 
                 # Calculate the intended end point of the segment in the original clip's timeline
                 intended_subclip_end = start_offset + segment_duration
@@ -353,70 +544,61 @@ def _run_composite_video_creation(app, task_id, source_clip_task_ids_and_prompts
                     actual_segment_duration = 0
 
                 if actual_segment_duration > 0:
-                    processed_segment_clip = None
-                    # Only apply subclip if the desired segment is different from the full original clip
-                    if start_offset != 0.0 or actual_subclip_end != original_clip_duration:
-                        processed_segment_clip = current_full_clip.subclipped(start_offset, actual_subclip_end)
-                        # DO NOT close current_full_clip here. The subclip (processed_segment_clip)
-                        # relies on the original clip's reader.
-                        # The clips in video_clips_to_concatenate will be closed in the main finally block.
-                    else:
-                        # No subclip needed, the segment is the entire original clip.
-                        # processed_segment_clip will be current_full_clip.
-                        # current_full_clip will be added to video_clips_to_concatenate and closed by the main finally block.
-                        processed_segment_clip = current_full_clip 
-                    
-                    video_clips_to_concatenate.append(processed_segment_clip)
+                    segment = dict(media_info)
+                    segment.update({
+                        "source_task_id": source_task_id,
+                        "path": clip_file_path,
+                        "start": start_offset,
+                        "end": actual_subclip_end,
+                        "source_ready": source_download, # Renderers wait on a pending GCS download only when they need the file
+                    })
+                    segments.append(segment)
                     total_duration += actual_segment_duration # Add the duration of the actual segment used
-                else:
-                    # Segment duration is <= 0, so we don't use this clip. Close the VideoFileClip object.
-                    current_full_clip.close()
 
                 if i == 0: 
                     first_clip_aspect_ratio = source_task.aspect_ratio
 
-            if not video_clips_to_concatenate:
+            if not segments:
                 raise ValueError("No valid video clips found to concatenate.")
 
             composite_task.duration_seconds = total_duration
             composite_task.aspect_ratio = first_clip_aspect_ratio
             db.session.commit()
-
-            final_clip_moviepy = concatenate_videoclips(video_clips_to_concatenate, method="compose")
-
-            if audio_clip_moviepy:
-                video_duration = final_clip_moviepy.duration
-                audio_duration = audio_clip_moviepy.duration
-
-                if audio_duration < video_duration:
-                    # Loop audio to match video duration
-                    num_loops = int(video_duration / audio_duration) + 1
-                    looped_clips = [audio_clip_moviepy] * num_loops
-                    final_audio = CompositeAudioClip(looped_clips)
-                    # Trim the looped audio to the exact video duration
-                    final_audio = final_audio.subclipped(0, video_duration)
-                else:
-                    # Truncate audio to match video duration
-                    final_audio = audio_clip_moviepy.subclipped(0, video_duration)
-                
-                final_clip_moviepy = final_clip_moviepy.with_audio(final_audio) # Use with_audio as suggested
+            timeline.enter("render")
 
             composite_video_filename = f"{composite_task.id}.mp4"
             local_composite_video_full_path = os.path.join(videos_dir, composite_video_filename)
-            
-            has_audio = final_clip_moviepy.audio is not None
-            current_audio_codec = "aac" if has_audio else None
-            
-            final_clip_moviepy.write_videofile(
-                local_composite_video_full_path, 
-                codec="libx264", 
-                audio_codec=current_audio_codec, 
-                threads=4, 
-                logger='bar'
-            )
+
+            geometry = composite_geometry(segments)
+            progress = CompositeProgressReporter(db.engine, composite_task.id, geometry["duration"] * geometry["fps"])
+            with PeakRssMonitor() as rss_monitor:
+                rendered = False
+                if COMPOSITE_RENDER_ENGINE in ("ffmpeg", "sequential"):
+                    try:
+                        engine = choose_composite_engine(segments, music_path=absolute_music_path, duck_clip_audio=duck_clip_audio)
+                        print(f"Composite task {task_id}: rendering {len(segments)} segment(s) with the {engine} engine")
+                        if engine == "sequential":
+                            render_composite_sequential(segments, local_composite_video_full_path, music_path=absolute_music_path, duck_clip_audio=duck_clip_audio, rss_monitor=rss_monitor, progress=progress)
+                        else:
+                            render_composite_with_ffmpeg(segments, local_composite_video_full_path, music_path=absolute_music_path, rss_monitor=rss_monitor, progress=progress)
+                        rendered = True
+                    except Exception as e_ffmpeg:
+                        print(f"ffmpeg render failed for composite task {task_id}, falling back to moviepy: {e_ffmpeg}")
+                if not rendered:
+                    progress.reset()
+                    _render_composite_with_moviepy(segments, local_composite_video_full_path, absolute_music_path, duck_clip_audio=duck_clip_audio, progress=progress)
+            progress.finish()
+            for source_task_id in source_downloads:
+                source_task = source_tasks[source_task_id]
+                if not source_task.local_video_path:
+                    source_task.local_video_path = f"/videos/{source_task.id}.mp4" # The fetched copy now serves locally too
+            composite_task.render_peak_rss_bytes = rss_monitor.peak_rss_bytes
+            print(f"Composite task {task_id} peak RSS during render: {rss_monitor.peak_rss_bytes / (1024 * 1024):.1f} MB")
 
             composite_task.local_video_path = f"/videos/{composite_video_filename}"
             print(f"Composite video for task {task_id} saved locally to {local_composite_video_full_path}")
+            timeline.enter("probe")
+            probe_task_video(composite_task, local_composite_video_full_path)
 
             bucket_to_use = composite_task.gcs_output_bucket if composite_task.gcs_output_bucket else DEFAULT_OUTPUT_GCS_BUCKET
             if bucket_to_use:
@@ -426,26 +608,24 @@ def _run_composite_video_creation(app, task_id, source_clip_task_ids_and_prompts
                 composite_blob_name = f"composite_videos/{composite_task.id}/{composite_video_filename}"
                 blob_composite = bucket_composite.blob(composite_blob_name)
                 
-                blob_composite.upload_from_filename(local_composite_video_full_path)
+                timeline.enter("gcs_upload")
+                with start_span("gcs upload", kind="client", attributes={"gcs.uri": f"gs://{composite_bucket_name}/{composite_blob_name}"}):
+                    blob_composite.upload_from_filename(local_composite_video_full_path)
+                record_gcs_transfer("upload", local_composite_video_full_path)
                 composite_task.video_gcs_uri = f"gs://{composite_bucket_name}/{composite_blob_name}"
                 print(f"Composite video for task {task_id} uploaded to GCS: {composite_task.video_gcs_uri}")
             else:
                 print(f"No GCS bucket configured for composite task {task_id}. Skipping GCS upload.")
                 composite_task.video_gcs_uri = None
 
-            composite_thumbnail_filename = f"{composite_task.id}.jpg"
-            local_composite_thumbnail_full_path = os.path.join(thumbnails_dir, composite_thumbnail_filename)
-            vid_cap_composite = cv2.VideoCapture(local_composite_video_full_path)
-            success_thumb, image_thumb = vid_cap_composite.read()
-            if success_thumb:
-                cv2.imwrite(local_composite_thumbnail_full_path, image_thumb)
-                composite_task.local_thumbnail_path = f"/thumbnails/{composite_thumbnail_filename}"
-                print(f"Thumbnail for composite task {task_id} generated successfully.")
-            else:
-                print(f"Failed to extract frame for composite thumbnail for task {task_id}.")
-            vid_cap_composite.release()
-
+            timeline.finish()
             composite_task.status = "completed"
+            composite_task.updated_at = time.time()
+            db.session.commit()
+            schedule_thumbnails(app, composite_task.id, local_composite_video_full_path)
+            schedule_preview(app, composite_task.id, local_composite_video_full_path)
+            if HLS_PACKAGING_ENABLED:
+                schedule_hls_packaging(app, composite_task.id, local_composite_video_full_path)
 
         except Exception as e:
             composite_task.status = "failed"
@@ -454,19 +634,9 @@ def _run_composite_video_creation(app, task_id, source_clip_task_ids_and_prompts
             import traceback
             traceback.print_exc()
         finally:
-            for clip_obj in video_clips_to_concatenate:
-                if hasattr(clip_obj, 'reader') and clip_obj.reader: 
-                    clip_obj.close()
-            if final_clip_moviepy and hasattr(final_clip_moviepy, 'reader') and final_clip_moviepy.reader: 
-                 final_clip_moviepy.close()
-            if audio_clip_moviepy and hasattr(audio_clip_moviepy, 'reader') and audio_clip_moviepy.reader: # Close original audio clip
-                audio_clip_moviepy.close()
-            # final_audio is a new object, ensure it's closed if it has a reader (though often not directly needed for CompositeAudioClip)
-            if 'final_audio' in locals() and final_audio and hasattr(final_audio, 'reader') and final_audio.reader:
-                final_audio.close()
-
             composite_task.updated_at = time.time()
             db.session.commit()
+            timeline.finish(outcome="failed" if composite_task.status == "failed" else "ok", detail=composite_task.error_message if composite_task.status == "failed" else None)
 
 def _run_music_generation(app, task_id):
     with app.app_context():
@@ -483,6 +653,8 @@ def _run_music_generation(app, task_id):
             print(f"Music task {task_id} failed: Lyria client not initialized.")
             return
 
+        timeline = TaskTimeline(db.engine, task.id, "music")
+        timeline.record("queued", task.created_at or time.time())
         task.status = "processing"
         task.updated_at = time.time()
         db.session.commit()
@@ -490,6 +662,7 @@ def _run_music_generation(app, task_id):
 
         try:
             # generate_music returns the full path to the file in its own output_dir (e.g., "generated_music/file.wav")
+            timeline.enter("lyria_generate")
             absolute_music_file_path_from_lyria = lyria_client.generate_music(
                 prompt=task.prompt,
                 negative_prompt=task.negative_prompt,
@@ -497,6 +670,7 @@ def _run_music_generation(app, task_id):
             )
 
             if absolute_music_file_path_from_lyria and os.path.exists(absolute_music_file_path_from_lyria):
+                timeline.enter("save")
                 # We want to move this file to our managed `generated_music_dir` (backend/data/music)
                 # and store a relative path for serving.
                 source_filename = os.path.basename(absolute_music_file_path_from_lyria)
@@ -538,3 +712,4 @@ def _run_music_generation(app, task_id):
         finally:
             task.updated_at = time.time()
             db.session.commit()
+            timeline.finish(outcome="failed" if task.status == "failed" else "ok", detail=task.error_message if task.status == "failed" else None)
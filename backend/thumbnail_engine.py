@@ -0,0 +1,233 @@
+import json
+import math
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+from moviepy.config import FFMPEG_BINARY
+
+from database import db
+from models import VideoGenerationTask
+from task_timeline import TaskTimeline
+from metrics import tracked_job
+from config import (
+    thumbnails_dir,
+    THUMBNAIL_WIDTHS,
+    THUMBNAIL_FORMATS,
+    THUMBNAIL_QUALITY,
+    THUMBNAIL_CANDIDATE_FRAMES,
+    THUMBNAIL_SPRITE_TILE_WIDTH,
+    THUMBNAIL_SPRITE_COLUMNS,
+    THUMBNAIL_SPRITE_INTERVAL_SECONDS,
+    THUMBNAIL_SPRITE_MAX_TILES,
+    THUMBNAIL_WORKERS,
+)
+
+_thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+
+_ENCODE_PARAMS = {
+    "webp": [cv2.IMWRITE_WEBP_QUALITY, THUMBNAIL_QUALITY],
+    "jpg": [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY],
+}
+
+
+def _even(value):
+    return max(2, int(value) // 2 * 2)
+
+
+def candidate_times(duration, keyframe_times=None, count=THUMBNAIL_CANDIDATE_FRAMES):
+    """
+    Timestamps to consider for the poster frame. Keyframes are preferred because seeking to them
+    decodes a single frame; the first and last 10% (fade-in/out) are skipped when possible.
+    """
+    if not duration or duration <= 0:
+        return [0.0]
+    low, high = duration * 0.1, duration * 0.9
+    if keyframe_times:
+        inner = [t for t in keyframe_times if low <= t <= high] or list(keyframe_times)
+        if len(inner) > count:
+            step = len(inner) / count
+            inner = [inner[int(i * step)] for i in range(count)]
+        return inner
+    return [low + (high - low) * i / max(count - 1, 1) for i in range(count)]
+
+
+def score_frame(image):
+    """
+    Higher is better: sharp (variance of the Laplacian) and well exposed (mean luma near mid-grey).
+    Near-black and near-white frames are heavily penalized.
+    """
+    gray = cv2.cvtColor(cv2.resize(image, (320, max(1, int(320 * image.shape[0] / image.shape[1])))), cv2.COLOR_BGR2GRAY)
+    brightness = float(gray.mean())
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    exposure = max(0.05, 1.0 - abs(brightness - 118.0) / 118.0)
+    if brightness < 16 or brightness > 240:
+        exposure *= 0.01
+    return exposure * math.log1p(sharpness)
+
+
+def pick_poster_frame(video_path, duration=None, keyframe_times=None):
+    """Returns (timestamp, BGR image) of the best scoring candidate frame, or (None, None)."""
+    capture = cv2.VideoCapture(video_path)
+    try:
+        if not duration:
+            frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+            fps = capture.get(cv2.CAP_PROP_FPS)
+            duration = frame_count / fps if fps else None
+        best = (None, None, -1.0)
+        for timestamp in candidate_times(duration, keyframe_times):
+            capture.set(cv2.CAP_PROP_POS_MSEC, timestamp * 1000.0)
+            success, image = capture.read()
+            if not success:
+                continue
+            score = score_frame(image)
+            if score > best[2]:
+                best = (timestamp, image, score)
+        if best[1] is None: # Seeking unsupported: fall back to the first frame
+            capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, image = capture.read()
+            return (0.0, image) if success else (None, None)
+        return best[0], best[1]
+    finally:
+        capture.release()
+
+
+def _write_image(path, image, image_format):
+    success, encoded = cv2.imencode(f".{image_format}", image, _ENCODE_PARAMS.get(image_format, []))
+    if not success:
+        raise RuntimeError(f"Could not encode {image_format} thumbnail {path}")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encoded.tobytes())
+    os.replace(tmp_path, path)
+
+
+def write_poster_variants(task_id, image):
+    """
+    Writes the full-size JPEG poster (kept at `<task_id>.jpg` for existing clients) plus one
+    downscaled variant per configured width and format. Returns the poster path and the variants.
+    """
+    poster_filename = f"{task_id}.jpg"
+    _write_image(os.path.join(thumbnails_dir, poster_filename), image, "jpg")
+
+    height, width = image.shape[:2]
+    variants = []
+    # Widths above the source clamp to it, so several configured widths can collapse into one
+    for target_width in sorted({min(target_width, width) for target_width in THUMBNAIL_WIDTHS}):
+        target_height = _even(height * target_width / width)
+        resized = cv2.resize(image, (target_width, target_height), interpolation=cv2.INTER_AREA)
+        for image_format in THUMBNAIL_FORMATS:
+            filename = f"{task_id}_{target_width}.{image_format}"
+            _write_image(os.path.join(thumbnails_dir, filename), resized, image_format)
+            variants.append({"width": target_width, "height": target_height, "format": image_format, "path": f"/thumbnails/{filename}"})
+    return f"/thumbnails/{poster_filename}", variants
+
+
+def _vtt_timestamp(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def write_sprite_sheet(task_id, video_path, duration, width, height):
+    """
+    Renders a hover-scrub sprite sheet (one tile every THUMBNAIL_SPRITE_INTERVAL_SECONDS, longer
+    videos are sampled more sparsely to stay under THUMBNAIL_SPRITE_MAX_TILES) in a single ffmpeg
+    pass, plus a WebVTT index mapping time ranges to `sprite.jpg#xywh=` tile rectangles.
+    Returns (sprite path, vtt path).
+    """
+    interval = max(THUMBNAIL_SPRITE_INTERVAL_SECONDS, duration / THUMBNAIL_SPRITE_MAX_TILES)
+    tile_count = max(1, int(math.ceil(duration / interval)))
+    columns = min(THUMBNAIL_SPRITE_COLUMNS, tile_count)
+    rows = int(math.ceil(tile_count / columns))
+    tile_width = min(THUMBNAIL_SPRITE_TILE_WIDTH, _even(width))
+    tile_height = _even(height * tile_width / width)
+
+    sprite_filename = f"{task_id}_sprite.jpg"
+    sprite_path = os.path.join(thumbnails_dir, sprite_filename)
+    tmp_path = f"{sprite_path}.tmp.jpg"
+    cmd = [
+        FFMPEG_BINARY, "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-i", video_path,
+        "-vf", f"fps=1/{interval:.6f},scale={tile_width}:{tile_height},tile={columns}x{rows}",
+        "-frames:v", "1", "-q:v", "5", tmp_path,
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise RuntimeError(f"Sprite sheet render failed: {result.stderr.decode(errors='replace').strip()[-500:]}")
+    os.replace(tmp_path, sprite_path)
+
+    cues = ["WEBVTT", ""]
+    for index in range(tile_count):
+        start = index * interval
+        end = min((index + 1) * interval, duration)
+        x = (index % columns) * tile_width
+        y = (index // columns) * tile_height
+        cues.append(f"{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}")
+        cues.append(f"{sprite_filename}#xywh={x},{y},{tile_width},{tile_height}")
+        cues.append("")
+    vtt_filename = f"{task_id}_sprite.vtt"
+    with open(os.path.join(thumbnails_dir, vtt_filename), "w") as f:
+        f.write("\n".join(cues))
+    return f"/thumbnails/{sprite_filename}", f"/thumbnails/{vtt_filename}"
+
+
+def generate_thumbnails(task, video_path):
+    """
+    Builds the poster frame, its size/format variants and the sprite sheet for a task and stores the
+    paths on it (caller commits). Uses the metadata probed at ingest when present.
+    """
+    keyframe_times = json.loads(task.media_keyframe_times) if task.media_keyframe_times else None
+    timestamp, image = pick_poster_frame(video_path, task.media_duration_seconds, keyframe_times)
+    if image is None:
+        raise RuntimeError(f"Could not extract any frame from {video_path}")
+    task.local_thumbnail_path, variants = write_poster_variants(task.id, image)
+    task.thumbnail_variants = json.dumps(variants)
+    print(f"Poster frame for task {task.id} taken at {timestamp:.2f}s with {len(variants)} variant(s).")
+
+    duration = task.media_duration_seconds
+    height, width = image.shape[:2]
+    if duration:
+        try:
+            task.local_sprite_path, task.local_sprite_vtt_path = write_sprite_sheet(task.id, video_path, duration, width, height)
+        except Exception as e: # The poster is what matters; the scrub strip is a nice-to-have
+            print(f"Could not build sprite sheet for task {task.id}: {e}")
+
+
+def _run_thumbnail_job(app, task_id, video_path):
+    with app.app_context():
+        task = VideoGenerationTask.query.get(task_id)
+        if not task:
+            print(f"Task {task_id} not found for thumbnail generation.")
+            return
+        try:
+            with TaskTimeline.for_task(db.engine, task).stage("thumbnails"):
+                generate_thumbnails(task, video_path)
+            db.session.commit()
+            print(f"Thumbnails for task {task_id} generated successfully.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Thumbnail generation failed for task {task_id}: {e}")
+        finally:
+            db.session.remove()
+
+
+def schedule_thumbnails(app, task_id, video_path):
+    """Queues thumbnail generation on the background pool so task completion is not delayed by it."""
+    return _thumbnail_executor.submit(tracked_job("thumbnails", None, _run_thumbnail_job), app, task_id, video_path)
+
+
+def purge_task_thumbnails(task_id):
+    """Deletes every thumbnail file of a task (poster, variants, sprite sheet and VTT)."""
+    removed = 0
+    for entry in os.scandir(thumbnails_dir):
+        if entry.name == f"{task_id}.jpg" or entry.name.startswith(f"{task_id}_"):
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
@@ -0,0 +1,286 @@
+"""
+Request and job tracing.
+
+A trace starts at an HTTP request (init_app) and follows the work it hands off: jobs started through
+metrics.tracked_job() run under a child span of the request that queued them, and outbound calls
+(Vertex AI, GCS transfers, token refreshes) are child spans of whatever is running. The current span
+lives in a context variable, so nested start_span() calls need no plumbing; threads receive it
+explicitly (traced()).
+
+Sampling is decided once per trace, at its root: a request carrying a W3C `traceparent` header follows
+the caller's decision, anything else is sampled with probability TRACING_SAMPLE_RATIO. Spans of
+unsampled traces are no-op objects, and with TRACING_EXPORTER=none nothing is ever recorded.
+
+Finished spans are queued and written by a background thread in batches, in the OTLP/HTTP JSON span
+encoding: one span per line to TRACING_JSONL_PATH (`jsonl`), or POSTed to TRACING_OTLP_ENDPOINT
+(`otlp`, e.g. an OpenTelemetry Collector on :4318). A full queue drops spans rather than block.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from config import (
+    TRACING_EXPORTER,
+    TRACING_SAMPLE_RATIO,
+    TRACING_JSONL_PATH,
+    TRACING_OTLP_ENDPOINT,
+    TRACING_SERVICE_NAME,
+    TRACING_EXPORT_BATCH_SIZE,
+    TRACING_EXPORT_INTERVAL_SECONDS,
+    TRACING_QUEUE_SIZE,
+)
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+TRACEPARENT_PATTERN = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, kind, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.sampled = True
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_exception(self, exception):
+        self.error = f"{type(exception).__name__}: {exception}"
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            _exporter.enqueue(self)
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+class _UnsampledSpan:
+    """Stands in for every span of a trace that is not sampled, so its children are not sampled either."""
+    sampled = False
+    trace_id = None
+    traceparent = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+    def end(self):
+        pass
+
+
+UNSAMPLED = _UnsampledSpan()
+
+
+def tracing_enabled():
+    return TRACING_EXPORTER in ("jsonl", "otlp")
+
+
+def _new_span(name, kind, attributes, parent=None, remote_parent=None):
+    """A child of `parent` (or of the current span); a new root, sampled or not, when there is none."""
+    if not tracing_enabled():
+        return UNSAMPLED
+    parent = parent if parent is not None else _current_span.get()
+    if parent is not None:
+        if not parent.sampled:
+            return UNSAMPLED
+        return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+    if remote_parent is not None:
+        trace_id, parent_id, sampled = remote_parent
+        return Span(name, trace_id, parent_id, kind, attributes) if sampled else UNSAMPLED
+    if random.random() >= TRACING_SAMPLE_RATIO:
+        return UNSAMPLED
+    return Span(name, os.urandom(16).hex(), None, kind, attributes)
+
+
+@contextlib.contextmanager
+def start_span(name, kind="internal", attributes=None, parent=None):
+    """Runs the block as a span, current for its duration. An exception is recorded and propagates."""
+    span = _new_span(name, kind, attributes, parent=parent)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def traced(name, target, attributes=None):
+    """
+    Wraps a thread or executor target so it runs under a span that is a child of the span current
+    *now* (typically the request that starts the job).
+    """
+    parent = _current_span.get()
+
+    def run(*args, **kwargs):
+        with start_span(name, attributes=attributes, parent=parent):
+            return target(*args, **kwargs)
+    return run
+
+
+# --- Flask ---
+
+def _parse_traceparent(header):
+    match = TRACEPARENT_PATTERN.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+
+
+def init_app(app):
+    """One server span per request, named after the route template to keep span names bounded."""
+    from flask import g, request
+
+    if not tracing_enabled():
+        return
+
+    @app.before_request
+    def _start_request_span():
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        span = _new_span(f"{request.method} {route}", "server", {
+            "http.method": request.method,
+            "http.route": route,
+            "http.target": request.full_path.rstrip('?'),
+        }, remote_parent=_parse_traceparent(request.headers.get('traceparent')))
+        g.trace_span = span
+        g.trace_token = _current_span.set(span)
+
+    @app.after_request
+    def _tag_response(response):
+        span = g.get('trace_span')
+        if span is not None and span.sampled:
+            span.set_attribute("http.status_code", response.status_code)
+            response.headers['traceparent'] = span.traceparent
+        return response
+
+    @app.teardown_request
+    def _end_request_span(exception):
+        span = g.pop('trace_span', None)
+        token = g.pop('trace_token', None)
+        if span is None:
+            return
+        if exception is not None:
+            span.record_exception(exception)
+        if token is not None:
+            try:
+                _current_span.reset(token)
+            except ValueError: # Torn down from another context (streamed responses)
+                pass
+        span.end()
+
+
+# --- Export ---
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_span(span):
+    """A span in the OTLP/HTTP JSON encoding."""
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": SPAN_KINDS.get(span.kind, 1),
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _attribute_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    return encoded
+
+
+class SpanExporter:
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=TRACING_QUEUE_SIZE)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.dropped = 0
+
+    def enqueue(self, span):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        # Started lazily: gunicorn forks workers after import, and threads do not survive a fork
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + TRACING_EXPORT_INTERVAL_SECONDS
+            while len(batch) < TRACING_EXPORT_BATCH_SIZE:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.export([otlp_span(span) for span in batch])
+            except Exception as e:
+                print(f"Could not export {len(batch)} span(s) to {TRACING_EXPORTER}: {e}")
+
+    def export(self, spans):
+        if TRACING_EXPORTER == "jsonl":
+            lines = "".join(json.dumps(dict(span, service=TRACING_SERVICE_NAME)) + "\n" for span in spans)
+            os.makedirs(os.path.dirname(TRACING_JSONL_PATH), exist_ok=True)
+            # One O_APPEND write per batch, so batches of several worker processes do not interleave
+            fd = os.open(TRACING_JSONL_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, lines.encode("utf-8"))
+            finally:
+                os.close(fd)
+        elif TRACING_EXPORTER == "otlp":
+            import requests
+            body = {"resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACING_SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "dreamer-v"}, "spans": spans}],
+            }]}
+            requests.post(TRACING_OTLP_ENDPOINT, json=body, timeout=10).raise_for_status()
+
+
+_exporter = SpanExporter()
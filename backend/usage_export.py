@@ -0,0 +1,118 @@
+"""
+Streaming usage export behind /api/usage/download.
+
+Rows are read with a server-side cursor (`stream_results` + `yield_per`, a named cursor under
+psycopg2) and encoded in small chunks, so memory stays flat and the first bytes leave the worker
+before the last row is read. Formats are CSV and newline-delimited JSON, optionally gzip-compressed
+on the fly.
+"""
+import csv
+import datetime
+import io
+import json
+import zlib
+
+from sqlalchemy import select
+
+from models import VideoGenerationTask
+
+EXPORT_COLUMNS = (
+    'id', 'user', 'model', 'prompt', 'duration_seconds', 'status',
+    'video_gcs_uri', 'created_at', 'updated_at'
+)
+EXPORT_FORMATS = {
+    # format: (mimetype, file extension)
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+YIELD_PER = 2000
+FLUSH_BYTES = 64 * 1024
+
+
+def _split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+
+def parse_export_filters(args, current_user_email, is_admin):
+    """
+    Export filters from request args: `start`/`end` (YYYY-MM-DD, inclusive UTC days of created_at),
+    `user`, `model` and `status` (comma-separated lists). Non-admins only ever export their own
+    tasks. Raises ValueError on bad input.
+    """
+    filters = {"models": _split_list(args.get('model')), "statuses": _split_list(args.get('status'))}
+    for name in ('start', 'end'):
+        value = args.get(name)
+        try:
+            day = datetime.date.fromisoformat(value) if value else None
+        except ValueError:
+            raise ValueError(f"'{name}' must be a YYYY-MM-DD date")
+        if day is not None and name == 'end':
+            day += datetime.timedelta(days=1) # Exclusive upper bound
+        filters[name] = datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc).timestamp() if day else None
+    filters["users"] = _split_list(args.get('user')) if is_admin else [current_user_email]
+    return filters
+
+
+def export_statement(filters):
+    table = VideoGenerationTask.__table__
+    statement = select(*(table.c[name] for name in EXPORT_COLUMNS))
+    if filters["users"]:
+        statement = statement.where(table.c.user.in_(filters["users"]))
+    if filters["models"]:
+        statement = statement.where(table.c.model.in_(filters["models"]))
+    if filters["statuses"]:
+        statement = statement.where(table.c.status.in_(filters["statuses"]))
+    if filters["start"] is not None:
+        statement = statement.where(table.c.created_at >= filters["start"])
+    if filters["end"] is not None:
+        statement = statement.where(table.c.created_at < filters["end"])
+    return statement.order_by(table.c.created_at, table.c.id)
+
+
+def _encode_rows(rows, export_format):
+    """Text chunks of roughly FLUSH_BYTES for the encoded rows, header first for CSV."""
+    buffer = io.StringIO()
+    if export_format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= FLUSH_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    else:
+        for row in rows:
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(',', ':')))
+            buffer.write('\n')
+            if buffer.tell() >= FLUSH_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(engine, filters, export_format='csv', compress=False):
+    """Generator of response body chunks for the filtered tasks."""
+    def rows():
+        with engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=YIELD_PER).execute(export_statement(filters))
+            for row in result:
+                yield tuple(row)
+
+    chunks = _encode_rows(rows(), export_format)
+    if compress:
+        yield from _gzip(chunks)
+    else:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
@@ -0,0 +1,182 @@
+"""
+Daily usage rollups behind /api/usage.
+
+usage_rollup holds one row per UTC day, user, model, duration and terminal status with the number of
+video tasks. A session hook notes the (day, user) bucket of every task that reaches a terminal state
+(or is deleted) and, once the transaction has committed, recomputes those buckets from
+video_generation_task over the (user, created_at) index. Buckets are recomputed rather than
+incremented, so repeated or concurrent updates converge on the exact counts.
+
+    python usage_rollup.py --backfill               # rebuild every rollup from the task table
+    python usage_rollup.py --backfill-if-empty      # run on deploy, no-op once rollups exist
+"""
+import argparse
+import collections
+import datetime
+import time
+
+from sqlalchemy import delete, event, func, inspect, or_, select
+
+from database import db
+from models import VideoGenerationTask, UsageRollup
+
+TERMINAL_STATUSES = ('completed', 'failed')
+BACKFILL_BATCH_SIZE = 10_000
+_PENDING_BUCKETS_KEY = 'usage_rollup_buckets'
+
+
+def utc_day(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).date()
+
+
+def _day_bounds(day):
+    start = datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc).timestamp()
+    return start, start + 24 * 3600
+
+
+def _upsert(connection, rows):
+    """Inserts rollup rows, overwriting the counts of keys that already exist."""
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(UsageRollup.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['day', 'user', 'model', 'duration_seconds', 'status'],
+        set_={"video_count": statement.excluded.video_count, "updated_at": statement.excluded.updated_at},
+    )
+    connection.execute(statement, rows)
+
+
+def recompute_buckets(connection, buckets):
+    """Recomputes the rollup rows of each (day, user) bucket from video_generation_task."""
+    tasks = VideoGenerationTask.__table__
+    rollups = UsageRollup.__table__
+    for day, user in buckets:
+        start, end = _day_bounds(day)
+        user_filter = or_(tasks.c.user == '', tasks.c.user.is_(None)) if user == '' else tasks.c.user == user
+        counts = connection.execute(
+            select(tasks.c.model, tasks.c.duration_seconds, tasks.c.status, func.count())
+            .where(user_filter, tasks.c.created_at >= start, tasks.c.created_at < end, tasks.c.status.in_(TERMINAL_STATUSES))
+            .group_by(tasks.c.model, tasks.c.duration_seconds, tasks.c.status)
+        ).all()
+        current = {}
+        for model, duration_seconds, status, count in counts:
+            key = (model or '', duration_seconds or 0, status)
+            current[key] = current.get(key, 0) + count
+        bucket_rows = connection.execute(
+            select(rollups.c.model, rollups.c.duration_seconds, rollups.c.status)
+            .where(rollups.c.day == day, rollups.c.user == user)
+        ).all()
+        for stale in set(map(tuple, bucket_rows)) - set(current):
+            connection.execute(delete(rollups).where(
+                rollups.c.day == day, rollups.c.user == user,
+                rollups.c.model == stale[0], rollups.c.duration_seconds == stale[1], rollups.c.status == stale[2],
+            ))
+        if current:
+            now = time.time()
+            _upsert(connection, [
+                {"day": day, "user": user, "model": model, "duration_seconds": duration_seconds,
+                 "status": status, "video_count": count, "updated_at": now}
+                for (model, duration_seconds, status), count in current.items()
+            ])
+
+
+def _bucket_of(task, deleted=False):
+    values = inspect(task).dict if deleted else None
+    created_at = values.get('created_at') if deleted else task.created_at
+    if created_at is None:
+        return None
+    user = values.get('user') if deleted else task.user
+    return utc_day(created_at), user or ''
+
+
+@event.listens_for(db.session, 'after_flush')
+def _note_terminal_transitions(session, flush_context):
+    buckets = session.info.setdefault(_PENDING_BUCKETS_KEY, set())
+    for task in session.new:
+        if isinstance(task, VideoGenerationTask) and task.status in TERMINAL_STATUSES:
+            buckets.add(_bucket_of(task))
+    for task in session.dirty:
+        if not isinstance(task, VideoGenerationTask):
+            continue
+        history = inspect(task).attrs.status.history
+        if history.has_changes() and (
+            task.status in TERMINAL_STATUSES or any(status in TERMINAL_STATUSES for status in history.deleted)
+        ):
+            buckets.add(_bucket_of(task))
+    for task in session.deleted:
+        if isinstance(task, VideoGenerationTask) and inspect(task).dict.get('status') in TERMINAL_STATUSES:
+            buckets.add(_bucket_of(task, deleted=True))
+    buckets.discard(None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _update_rollups(session):
+    buckets = session.info.pop(_PENDING_BUCKETS_KEY, None)
+    if not buckets:
+        return
+    try:
+        with session.get_bind().begin() as connection:
+            recompute_buckets(connection, sorted(buckets))
+    except Exception as e: # Rollups are derived data; a backfill repairs them, the task change must stand
+        print(f"Could not update usage rollups for {len(buckets)} bucket(s): {e}")
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_buckets(session, previous_transaction):
+    session.info.pop(_PENDING_BUCKETS_KEY, None)
+
+
+def backfill(engine, if_empty=False):
+    """Rebuilds usage_rollup from a single streamed pass over video_generation_task."""
+    tasks = VideoGenerationTask.__table__
+    rollups = UsageRollup.__table__
+    started_at = time.time()
+    with engine.begin() as connection:
+        if if_empty and connection.execute(select(func.count()).select_from(rollups)).scalar():
+            print("Usage rollups already populated, skipping backfill.")
+            return
+        counts = collections.Counter()
+        scanned = 0
+        result = connection.execution_options(yield_per=BACKFILL_BATCH_SIZE).execute(
+            select(tasks.c.created_at, tasks.c.user, tasks.c.model, tasks.c.duration_seconds, tasks.c.status)
+            .where(tasks.c.status.in_(TERMINAL_STATUSES), tasks.c.created_at.isnot(None))
+        )
+        for created_at, user, model, duration_seconds, status in result:
+            counts[(utc_day(created_at), user or '', model or '', duration_seconds or 0, status)] += 1
+            scanned += 1
+        connection.execute(delete(rollups))
+        now = time.time()
+        rows = [
+            {"day": day, "user": user, "model": model, "duration_seconds": duration_seconds,
+             "status": status, "video_count": count, "updated_at": now}
+            for (day, user, model, duration_seconds, status), count in counts.items()
+        ]
+        for offset in range(0, len(rows), BACKFILL_BATCH_SIZE):
+            connection.execute(rollups.insert(), rows[offset:offset + BACKFILL_BATCH_SIZE])
+    print(f"Backfilled {len(rows)} usage rollup row(s) from {scanned} task(s) in {time.time() - started_at:.1f}s.")
+
+
+def usage_query(user=None, start_day=None, end_day=None):
+    """UsageRollup query limited to one user (None: everyone) and an inclusive day range."""
+    query = UsageRollup.query
+    if user is not None:
+        query = query.filter(UsageRollup.user == user)
+    if start_day is not None:
+        query = query.filter(UsageRollup.day >= start_day)
+    if end_day is not None:
+        query = query.filter(UsageRollup.day <= end_day)
+    return query
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the usage rollup table.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--backfill', action='store_true', help="Rebuild all rollups from the task table.")
+    group.add_argument('--backfill-if-empty', action='store_true', help="Backfill only if no rollups exist yet.")
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        backfill(db.engine, if_empty=args.backfill_if_empty)
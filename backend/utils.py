@@ -1,5 +1,5 @@
 from flask import request
-from config import ALLOWED_EXTENSIONS, ALLOWED_MUSIC_EXTENSIONS
+from config import ALLOWED_EXTENSIONS, ALLOWED_MUSIC_EXTENSIONS, STATUS_BATCH_MAX_IDS
 
 def get_processed_user_email_from_header(default_fallback_email="public@dreamer-v"):
     user_email = request.headers.get('X-Goog-Authenticated-User-Email')
@@ -16,3 +16,23 @@ def allowed_file(filename):
 def allowed_music_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_MUSIC_EXTENSIONS
+
+def parse_status_batch_args():
+    """
+    Reads `ids` (comma-separated, repeated `ids` parameters also accepted) and the optional `since`
+    updated_at watermark of a batched status request. Raises ValueError on bad input.
+    """
+    ids = []
+    for value in request.args.getlist('ids'):
+        ids.extend(task_id.strip() for task_id in value.split(',') if task_id.strip())
+    ids = list(dict.fromkeys(ids)) # Dedupe, keep order
+    if not ids:
+        raise ValueError("'ids' is required")
+    if len(ids) > STATUS_BATCH_MAX_IDS:
+        raise ValueError(f"At most {STATUS_BATCH_MAX_IDS} ids per request")
+    since = request.args.get('since')
+    try:
+        since = float(since) if since not in (None, '') else None
+    except ValueError:
+        raise ValueError("'since' must be an updated_at timestamp")
+    return ids, since
@@ -21,10 +21,18 @@ echo "VIDEO_GCS_BUCKET: $VIDEO_GCS_BUCKET"
 
 # --- Database Migration ---
 # This script now supports both SQLite and PostgreSQL.
-# It will create the tables if they don't exist and apply any necessary migrations.
+# It applies the pending versioned migrations (see backend/migrations.py) under a migration lock.
 echo "Running database migrations..."
 python /app/backend/migrate_db.py
 echo "Database migration check complete."
+# Usage dashboards read daily rollups; build them from the task table the first time
+python /app/backend/usage_rollup.py --backfill-if-empty
+# Migrations ran above; workers only check the schema version at startup
+export DB_AUTO_MIGRATE=false
+# Prometheus samples of all gunicorn workers, merged by /api/metrics; stale files from a previous run would be summed in
+export PROMETHEUS_MULTIPROC_DIR=/tmp/dreamer_v_metrics
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 
 # Start the Flask backend in the background
 echo "Starting Flask backend..."
@@ -32,7 +40,9 @@ cd /app/backend
 # The app.py already runs on 0.0.0.0 and port 5001.
 # We'll send its output to stdout/stderr for Docker logs.
 # python app.py & # Replaced with gunicorn
-gunicorn -w 3 -b 0.0.0.0:5001 --access-logfile=- app:app &
+# gthread workers: /api/events streams hold a thread each for up to TASK_EVENTS_MAX_STREAM_SECONDS,
+# so sync workers would be exhausted by a few open browser tabs.
+gunicorn -c gunicorn.conf.py -w 3 -k gthread --threads 16 -b 0.0.0.0:5001 --access-logfile=- app:app &
 
 # Wait a few seconds for the backend to initialize (optional, but can be helpful)
 sleep 5 
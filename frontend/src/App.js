@@ -12,7 +12,7 @@ import {
   STATUS_INITIALIZING,
   STATUS_COMPLETED_WAITING_URI,
 } from './constants';
-import { urlToImageFile } from './utils'; // Keep if used directly, or it's only used by handlers.js
+import { urlToImageFile, taskPlaybackUrl } from './utils'; // Keep if used directly, or it's only used by handlers.js
 import * as Api from './api';
 import * as Handlers from './handlers';
 import TopToolbar from './components/TopToolbar';
@@ -61,6 +61,7 @@ function App() {
   const [isLoading, setIsLoading] = useState(false);
   const [pollingIntervalId, setPollingIntervalId] = useState(null);
   const [historyTasks, setHistoryTasks] = useState([]);
+  const [taskEventsConnected, setTaskEventsConnected] = useState(false); // /api/events stream open
   const [historyFilter, setHistoryFilter] = useState(''); // New state for history filter
   const [isRefining, setIsRefining] = useState(false); // New state for refine button loading
   const [activeSpinnerButtonKey, setActiveSpinnerButtonKey] = useState(''); // New state for specific spinning button
@@ -207,6 +208,8 @@ function App() {
   const lastImagePreviewRef = useRef(null); // New ref for last image preview
   const lastFileInputRef = useRef(null); // New ref for last image file input
   const userDropdownRef = useRef(null); // Ref for user dropdown
+  const statusWatermarkRef = useRef({ taskId: null, since: null }); // Batched status poll of the current video task
+  const musicStatusWatermarkRef = useRef({ taskId: null, since: null }); // Batched status poll of the current music task
 
   // Function to ensure track playback is stopped
   const ensureTrackPlaybackStopped = useCallback(() => {
@@ -434,7 +437,7 @@ function App() {
       getTasks: memoizedFetchHistoryTasks, // Use memoized version
       setTaskStatus, setVideoGcsUri, setErrorMessage, setPollingIntervalId,
       setCompletedUriPollRetries, setPrompt, setModel, setRatio,
-      setCameraControl, setDuration, setResolution, setGcsOutputBucket, t,
+      setCameraControl, setDuration, setResolution, setGcsOutputBucket, statusWatermarkRef, t,
     });
   }, [
     taskId, taskStatus, pollingIntervalId, completedUriPollRetries, memoizedFetchHistoryTasks,
@@ -478,6 +481,7 @@ function App() {
       setGeneratedMusicUrl, 
       setMusicErrorMessage, 
       setMusicPollingIntervalId,
+      musicStatusWatermarkRef,
       t, 
       BACKEND_URL, 
     });
@@ -538,7 +542,7 @@ function App() {
       const taskFromHistory = historyTasks.find(t => t.task_id === taskId);
       if (taskFromHistory) {
         const historyStatus = taskFromHistory.status;
-        const historyVideoUri = taskFromHistory.local_video_path ? `${BACKEND_URL}${taskFromHistory.local_video_path}` : '';
+        const historyVideoUri = taskPlaybackUrl(taskFromHistory, BACKEND_URL);
         const historyErrorMessage = taskFromHistory.error_message || '';
 
         if (historyStatus === STATUS_COMPLETED && historyVideoUri) {
@@ -589,20 +593,34 @@ function App() {
     });
   }, [historyTasks]);
 
-  // Effect for periodic refresh of the entire history if there are ongoing tasks
+  // Effect for periodic refresh of the ongoing history tasks: one batched status request per tick
+  // for every pending/processing task, plus just-completed ones whose thumbnail is still being built
+  const activeHistoryTaskIds = historyTasks
+    .filter(task => task.status === STATUS_PENDING || task.status === STATUS_PROCESSING
+      || (task.status === STATUS_COMPLETED && !task.local_thumbnail_path && Date.now() / 1000 - task.updated_at < 120))
+    .map(task => task.task_id)
+    .join(',');
+
+  // Pushed task changes; while the stream is open the batched refresh below is not needed
   useEffect(() => {
-    const hasNonFinalTasks = historyTasks.some(task => task.status === STATUS_PENDING || task.status === STATUS_PROCESSING);
-    let historyRefreshIntervalId = null;
+    const eventSource = Api.subscribeTaskEvents(setHistoryTasks, setTaskEventsConnected);
+    return () => {
+      eventSource.close();
+    };
+  }, [setHistoryTasks]);
 
-    if (hasNonFinalTasks) {
-      historyRefreshIntervalId = setInterval(memoizedFetchHistoryTasks, 10000);
+  useEffect(() => {
+    if (!activeHistoryTaskIds || taskEventsConnected) {
+      return undefined;
     }
+    let watermark = null;
+    const historyRefreshIntervalId = setInterval(async () => {
+      watermark = await Api.refreshHistoryTasks(activeHistoryTaskIds.split(','), watermark, setHistoryTasks);
+    }, 10000);
     return () => {
-      if (historyRefreshIntervalId) {
-        clearInterval(historyRefreshIntervalId);
-      }
+      clearInterval(historyRefreshIntervalId);
     };
-  }, [historyTasks, memoizedFetchHistoryTasks]);
+  }, [activeHistoryTaskIds, taskEventsConnected, setHistoryTasks]);
 
   const currentTask = historyTasks.find(task => task.task_id === taskId);
   const processingTaskCount = historyTasks.filter(task => task.status === 'processing').length;
@@ -697,7 +715,7 @@ function App() {
 
   const handleClipClick = (clip) => {
     if (clip.local_video_path) {
-      setActiveCreateModeVideoSrc(`${BACKEND_URL}${clip.local_video_path}`);
+      setActiveCreateModeVideoSrc(`${BACKEND_URL}${clip.preview_url || clip.local_video_path}`);
       setSelectedClipInTrack(clip.trackInstanceId);
       if (createModeVideoRef.current) {
         // createModeVideoRef.current.load(); // Removed: autoPlay and key change should handle loading
@@ -9,6 +9,7 @@ import {
   STATUS_INITIALIZING,
   STATUS_COMPLETED_WAITING_URI,
 } from './constants';
+import { taskPlaybackUrl } from './utils';
 
 export const getAuthHeaders = () => {
   const email = localStorage.getItem('userEmail');
@@ -101,6 +102,27 @@ export const handleGenerateMusicClick = async ({
   // setIsGeneratingMusic(false); // Removed, as this is now derived from musicTaskStatus in App.js
 };
 
+// Batched status poll of a single task (`path` is 'task-status' or 'music-task-status') through the
+// updated_at watermark kept in `watermarkRef` (a React ref holding { taskId, since }). `task` is the
+// task's row if it changed since the previous poll and null if it did not; `notFound` is set when
+// the first poll of a task returns nothing.
+const pollChangedTask = async (path, taskId, watermarkRef) => {
+  if (watermarkRef.current.taskId !== taskId) {
+    watermarkRef.current = { taskId, since: null };
+  }
+  const { since } = watermarkRef.current;
+  const params = new URLSearchParams({ ids: taskId });
+  if (since) params.set('since', since);
+  const response = await fetch(`${BACKEND_URL}/${path}?${params.toString()}`);
+  const data = await response.json();
+  if (!response.ok) {
+    return { response, data, task: null, notFound: false };
+  }
+  watermarkRef.current = { taskId, since: data.watermark };
+  const task = data.tasks.find(changedTask => changedTask.task_id === taskId) || null;
+  return { response, data, task, notFound: !task && !since };
+};
+
 export const pollMusicTaskStatus = async ({
   musicTaskId,
   musicTaskStatus, // Current status, useful for logic if needed
@@ -111,26 +133,27 @@ export const pollMusicTaskStatus = async ({
   setMusicErrorMessage,
   setMusicPollingIntervalId,
   // setMusicCompletedUriPollRetries, // Removed
+  musicStatusWatermarkRef, // { taskId, since } of the batched status poll
   t,
   BACKEND_URL, // Passed from App.js
 }) => {
   if (!musicTaskId) return;
 
   try {
-    const response = await fetch(`${BACKEND_URL}/music-task-status/${musicTaskId}`);
-    const data = await response.json();
+    const { response, data: batch, task: data, notFound } = await pollChangedTask('music-task-status', musicTaskId, musicStatusWatermarkRef);
 
     if (!response.ok) {
-      if (response.status === 404) {
-        console.warn(`Music task ${musicTaskId} not found during polling. Stopping polling.`);
-        if (musicPollingIntervalId) clearInterval(musicPollingIntervalId);
-        setMusicPollingIntervalId(null);
-        // setMusicCompletedUriPollRetries(0); // Removed
-        // No separate history for music tasks for now
-        return;
-      }
-      throw new Error(data.error || t('errorFetchMusicTaskStatus', { statusText: response.statusText }));
+      throw new Error(batch.error || t('errorFetchMusicTaskStatus', { statusText: response.statusText }));
     }
+    if (notFound) {
+      console.warn(`Music task ${musicTaskId} not found during polling. Stopping polling.`);
+      if (musicPollingIntervalId) clearInterval(musicPollingIntervalId);
+      setMusicPollingIntervalId(null);
+      // setMusicCompletedUriPollRetries(0); // Removed
+      // No separate history for music tasks for now
+      return;
+    }
+    if (!data) return; // Unchanged since the previous poll
 
     const newStatusFromBackend = data.status;
     const currentMusicUrl = data.music_url_http; // Backend provides full URL or relative to /api/music/
@@ -207,6 +230,51 @@ export const getTasks = async (page = 1, setHistoryTasks, setTotalPages, t) => {
   }
 };
 
+// Batched poll of the given history tasks: one request returns only the tasks updated after `since`,
+// which are merged into the history list. Returns the new watermark (or `since` on failure).
+export const refreshHistoryTasks = async (taskIds, since, setHistoryTasks) => {
+  try {
+    const params = new URLSearchParams({ ids: taskIds.join(',') });
+    if (since) params.set('since', since);
+    const response = await fetch(`${BACKEND_URL}/task-status?${params.toString()}`);
+    if (!response.ok) {
+      throw new Error(response.statusText);
+    }
+    const data = await response.json();
+    if (data.tasks.length > 0) {
+      const changedById = new Map(data.tasks.map(task => [task.task_id, task]));
+      setHistoryTasks(prevTasks => prevTasks.map(task => changedById.has(task.task_id) ? { ...task, ...changedById.get(task.task_id) } : task));
+    }
+    return data.watermark;
+  } catch (error) {
+    console.error('Error refreshing history tasks:', error);
+    return since;
+  }
+};
+
+// Opens the task event stream; video and composite changes are merged into the history list.
+// EventSource reconnects on its own (resuming after the last event id), onConnectedChange reports
+// whether the stream is currently open so callers can fall back to polling.
+export const subscribeTaskEvents = (setHistoryTasks, onConnectedChange) => {
+  const eventSource = new EventSource(`${BACKEND_URL}/events`);
+  eventSource.onopen = () => onConnectedChange(true);
+  eventSource.onerror = () => onConnectedChange(false);
+  eventSource.addEventListener('task', (message) => {
+    const change = JSON.parse(message.data);
+    if (change.kind === 'music') {
+      return;
+    }
+    if (change.event === 'deleted') {
+      setHistoryTasks(prevTasks => prevTasks.filter(task => task.task_id !== change.task_id));
+    } else if (change.task) {
+      setHistoryTasks(prevTasks => prevTasks.map(task => task.task_id === change.task_id ? { ...task, ...change.task } : task));
+    }
+  });
+  // The server no longer has the events we missed: let the polling fallback catch up once
+  eventSource.addEventListener('resync', () => onConnectedChange(false));
+  return eventSource;
+};
+
 export const fetchUserEmail = async (setUserEmail, t) => {
   try {
     const response = await fetch(`${BACKEND_URL}/user-info`);
@@ -315,28 +383,29 @@ export const pollTaskStatus = async ({
   setDuration,
   setResolution,
   setGcsOutputBucket,
+  statusWatermarkRef, // { taskId, since } of the batched status poll
   t,
 }) => {
   if (!taskId) return;
 
   try {
-    const response = await fetch(`${BACKEND_URL}/task-status/${taskId}`);
-    const data = await response.json();
+    const { response, data: batch, task: data, notFound } = await pollChangedTask('task-status', taskId, statusWatermarkRef);
 
     if (!response.ok) {
-      if (response.status === 404) {
-        console.warn(`Task ${taskId} not found during polling. Stopping polling.`);
-        if (pollingIntervalId) clearInterval(pollingIntervalId);
-        setPollingIntervalId(null);
-        setCompletedUriPollRetries(0);
-        getTasks();
-        return;
-      }
-      throw new Error(data.error || t('errorFetchTaskStatus', { statusText: response.statusText }));
+      throw new Error(batch.error || t('errorFetchTaskStatus', { statusText: response.statusText }));
+    }
+    if (notFound) {
+      console.warn(`Task ${taskId} not found during polling. Stopping polling.`);
+      if (pollingIntervalId) clearInterval(pollingIntervalId);
+      setPollingIntervalId(null);
+      setCompletedUriPollRetries(0);
+      getTasks();
+      return;
     }
+    if (!data) return; // Unchanged since the previous poll
 
     const newStatusFromBackend = data.status;
-    const currentVideoUri = data.local_video_path ? `${BACKEND_URL}${data.local_video_path}` : '';
+    const currentVideoUri = taskPlaybackUrl(data, BACKEND_URL);
     let finalTaskStatusToSet = taskStatus;
 
     if (newStatusFromBackend !== taskStatus || [STATUS_PROCESSING, STATUS_COMPLETED, STATUS_FAILED].includes(newStatusFromBackend)) {
@@ -357,6 +426,7 @@ export const pollTaskStatus = async ({
           setCompletedUriPollRetries(prev => prev + 1);
           finalTaskStatusToSet = STATUS_COMPLETED_WAITING_URI;
           setErrorMessage('');
+          statusWatermarkRef.current.since = null; // Re-read the row on the next retry even if it has not changed
         } else {
           finalTaskStatusToSet = STATUS_FAILED;
           setErrorMessage(t('errorTaskCompletedNoUri'));
@@ -739,9 +809,13 @@ export const updateTaskStatus = async (taskId, status, errorMessage) => {
   }
 };
 
-export const getUsageData = async () => {
+export const getUsageData = async ({ start, end } = {}) => {
   try {
-    const response = await fetch(`${BACKEND_URL}/usage`, {
+    const params = new URLSearchParams();
+    if (start) params.set('start', start);
+    if (end) params.set('end', end);
+    const query = params.toString();
+    const response = await fetch(`${BACKEND_URL}/usage${query ? `?${query}` : ''}`, {
       headers: getAuthHeaders()
     });
     if (!response.ok) {
@@ -9,6 +9,7 @@ import {
   STATUS_FAILED,
   STATUS_ERROR,
 } from '../constants';
+import { thumbnailSrcSet } from '../utils';
 
 function HistorySidebar({
   theme,
@@ -82,6 +83,8 @@ function HistorySidebar({
                       <div className={`thumbnail-container position-relative mb-2 ${isCurrentDreamTask || isSelectedInCreateTrack ? 'selected-thumbnail-custom-border' : ''}`}>
                         <img
                           src={`${BACKEND_URL}${task.local_thumbnail_path}`}
+                          srcSet={thumbnailSrcSet(task, BACKEND_URL) || undefined}
+                          sizes="80px"
                           alt={t('historyThumbnailAlt', { prompt: task.prompt })}
                           className="img-thumbnail"
                         />
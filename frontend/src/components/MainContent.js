@@ -9,6 +9,7 @@ import {
   STATUS_ERROR,
   STATUS_COMPLETED,
 } from '../constants'; // Assuming constants are in ../constants
+import { thumbnailSrcSet } from '../utils';
 
 function MainContent({
   theme,
@@ -338,7 +339,9 @@ function MainContent({
   useEffect(() => {
     if (activeView === 'create' && createModeClips && createModeClips.length > 0) {
       const newPlaylist = createModeClips.map(clip => {
-        const videoSrc = clip.video_url || (clip.local_video_path ? `${BACKEND_URL}${clip.local_video_path}` : null);
+        // Timeline playback uses the low-bitrate proxy when it exists
+        const videoPath = clip.preview_url || clip.local_video_path;
+        const videoSrc = clip.video_url || (videoPath ? `${BACKEND_URL}${videoPath}` : null);
         const startTime = parseFloat(clip.start_offset_seconds) || 0;
         const duration = parseFloat(clip.duration_seconds);
         
@@ -1074,7 +1077,7 @@ function MainContent({
                                   </button>
                                 )}
                                 {clip.local_thumbnail_path ? (
-                                  <img src={`${BACKEND_URL}${clip.local_thumbnail_path}`} alt={`Clip ${clip.task_id}`} />
+                                  <img src={`${BACKEND_URL}${clip.local_thumbnail_path}`} srcSet={thumbnailSrcSet(clip, BACKEND_URL) || undefined} sizes="100px" alt={`Clip ${clip.task_id}`} />
                                 ) : (
                                   <div className="clip-thumbnail-placeholder">
                                   <i className="bi bi-film"></i>
@@ -9,9 +9,15 @@ function UsageAnalysisModal({ show, onHide, theme, t }) {
   const [usageData, setUsageData] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
+  const [startDate, setStartDate] = useState(''); // YYYY-MM-DD, UTC days
+  const [endDate, setEndDate] = useState('');
 
   const handleDownload = () => {
-    fetch('/api/usage/download', {
+    const params = new URLSearchParams();
+    if (startDate) params.set('start', startDate);
+    if (endDate) params.set('end', endDate);
+    const query = params.toString();
+    fetch(`/api/usage/download${query ? `?${query}` : ''}`, {
       headers: getAuthHeaders()
     })
       .then(response => response.blob())
@@ -33,7 +39,7 @@ function UsageAnalysisModal({ show, onHide, theme, t }) {
   useEffect(() => {
     if (show) {
       setLoading(true);
-      getUsageData()
+      getUsageData({ start: startDate, end: endDate })
         .then(data => {
           setUsageData(data);
           setLoading(false);
@@ -43,7 +49,7 @@ function UsageAnalysisModal({ show, onHide, theme, t }) {
           setLoading(false);
         });
     }
-  }, [show]);
+  }, [show, startDate, endDate]);
 
   if (!show) {
     return null;
@@ -65,6 +71,13 @@ function UsageAnalysisModal({ show, onHide, theme, t }) {
               <button type="button" className={`btn-close ${theme === 'dark' ? 'btn-close-white' : ''}`} onClick={onHide}></button>
             </div>
             <div className="modal-body">
+              <div className="d-flex justify-content-end align-items-center gap-2 mb-3">
+                <input type="date" className="form-control form-control-sm" style={{ width: 'auto' }}
+                  value={startDate} max={endDate || undefined} onChange={e => setStartDate(e.target.value)} />
+                <span>-</span>
+                <input type="date" className="form-control form-control-sm" style={{ width: 'auto' }}
+                  value={endDate} min={startDate || undefined} onChange={e => setEndDate(e.target.value)} />
+              </div>
               {loading ? (
                 <p>Loading...</p>
               ) : error ? (
@@ -1,4 +1,4 @@
-import { urlToImageFile } from './utils';
+import { urlToImageFile, taskPlaybackUrl } from './utils';
 // Ensure STATUS_COMPLETED is imported
 import { BACKEND_URL, STATUS_PENDING, STATUS_ERROR, STATUS_COMPLETED } from './constants'; 
 import { createCompositeVideo, uploadMusicFile as apiUploadMusicFile, generateImage } from './api'; // Import the new API function and alias uploadMusicFile
@@ -217,7 +217,8 @@ export const handleHistoryItemClick = async ({
           // Max duration check
           const MAX_TOTAL_DURATION_SECONDS = 60;
           const currentTotalDuration = prevClips.reduce((sum, clip) => sum + (parseFloat(clip.duration_seconds) || 0), 0);
-          const newClipDuration = parseFloat(task.duration_seconds) || 0;
+          // Prefer the probed duration of the actual file over the requested generation length
+          const newClipDuration = parseFloat(task.media_duration_seconds || task.duration_seconds) || 0;
 
           if (currentTotalDuration + newClipDuration > MAX_TOTAL_DURATION_SECONDS) {
             alert(t('errorMaxDurationReached', { maxDuration: MAX_TOTAL_DURATION_SECONDS }));
@@ -229,14 +230,14 @@ export const handleHistoryItemClick = async ({
           const newClipInstance = { 
             ...task, 
             trackInstanceId: newTrackInstanceId,
-            original_duration_seconds: parseFloat(task.duration_seconds) || 0, // Assuming task.duration_seconds is the original
+            original_duration_seconds: newClipDuration,
             start_offset_seconds: 0,
             // Ensure duration_seconds for the instance is also set, it might be trimmed later
-            duration_seconds: parseFloat(task.duration_seconds) || 0 
+            duration_seconds: newClipDuration 
           };
 
           // Set the active video source to the newly added clip
-          setActiveCreateModeVideoSrc(`${BACKEND_URL}${newClipInstance.local_video_path}`);
+          setActiveCreateModeVideoSrc(`${BACKEND_URL}${newClipInstance.preview_url || newClipInstance.local_video_path}`);
           setSelectedClipInTrack(newTrackInstanceId);
           return [...prevClips, newClipInstance];
         });
@@ -263,7 +264,7 @@ export const handleHistoryItemClick = async ({
     setResolution(task.resolution || '');
     setGcsOutputBucket(task.gcs_output_bucket || '');
     setTaskId(task.task_id);
-    setVideoGcsUri(task.local_video_path ? `${BACKEND_URL}${task.local_video_path}` : '');
+    setVideoGcsUri(taskPlaybackUrl(task, BACKEND_URL));
     setTaskStatus(task.status);
     setErrorMessage(task.error_message || '');
     setIsLoading(false);
@@ -15,3 +15,27 @@ export async function urlToImageFile(url, filename, defaultMimeType = 'image/jpe
     return null;
   }
 }
+
+// Builds an <img srcSet> from the WebP poster variants of a task (empty string if none were generated yet).
+// Each width appears once: posters stored before widths were de-duplicated can repeat the clamped source width.
+export function thumbnailSrcSet(task, backendUrl) {
+  const byWidth = new Map();
+  (task.thumbnail_variants || [])
+    .filter(variant => variant.format === 'webp')
+    .forEach(variant => byWidth.set(variant.width, variant));
+  return Array.from(byWidth.values())
+    .map(variant => `${backendUrl}${variant.path} ${variant.width}w`)
+    .join(', ');
+}
+
+// Browsers with native HLS playback (Safari, iOS, Android) stream the adaptive package; others get the MP4
+const supportsNativeHls = typeof document !== 'undefined'
+  && !!document.createElement('video').canPlayType('application/vnd.apple.mpegurl');
+
+// Full-quality playback URL of a task: the HLS manifest when packaged and playable, else the MP4 (empty string if neither)
+export function taskPlaybackUrl(task, backendUrl) {
+  if (task.hls_manifest_url && supportsNativeHls) {
+    return `${backendUrl}${task.hls_manifest_url}`;
+  }
+  return task.local_video_path ? `${backendUrl}${task.local_video_path}` : '';
+}